@@ -142,6 +142,18 @@ class BackgroundProcessInterface:
         self.toward_background.put(request_object)
         return await self.wait_data_return(data_id)
 
+    async def request_database_status(self) -> DatabaseStatus:
+        data_id = self.__generate_data_id()
+        request_object = DatabaseStatus(data_id)
+        self.toward_background.put(request_object)
+        return await self.wait_data_return(data_id)
+
+    async def request_undecoded_chapters(self) -> UndecodedChaptersStatus:
+        data_id = self.__generate_data_id()
+        request_object = UndecodedChaptersStatus(data_id)
+        self.toward_background.put(request_object)
+        return await self.wait_data_return(data_id)
+
     async def force_queue_update(self) -> ForceQueueUpdate:
         data_id = self.__generate_data_id()
         request_object = ForceQueueUpdate(data_id)
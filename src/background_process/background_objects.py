@@ -232,6 +232,41 @@ class ProcessStatus(StatusRequest):
         self.last_main_loop_execution = 0
 
 
+class DatabaseStatus(StatusRequest):
+    """Will request the query profiler stats of the background process database"""
+
+    def __init__(self, command_id: int):
+        super().__init__(command_id)
+        self.methods = []
+        self.slow_queries = []
+        self.busy_connections = 0
+        self.peak_busy_connections = 0
+        self.max_connections = 0
+        self.saturated_acquires = 0
+        self.acquires = 0
+        self.started = 0
+
+    def load_profiler(self, profiler):
+        """Copies the current stats out of a database QueryProfiler so that they can be sent between processes"""
+        self.methods = profiler.return_sorted_methods()
+        self.slow_queries = list(profiler.slow_queries)
+        self.busy_connections = profiler.busy_connections
+        self.peak_busy_connections = profiler.peak_busy_connections
+        self.max_connections = profiler.max_connections
+        self.saturated_acquires = profiler.saturated_acquires
+        self.acquires = profiler.acquires
+        self.started = profiler.started
+
+
+class UndecodedChaptersStatus(StatusRequest):
+    """Will request the chapters the decoder service is holding back because their font has unknown glyphs"""
+
+    def __init__(self, command_id: int):
+        super().__init__(command_id)
+        # (book id, chapter id, chapter index, unknown glyphs)
+        self.chapters: typing.List[typing.Tuple[int, int, int, int]] = []
+
+
 class ChapterPing:
     def __init__(self, book_obj: SimpleBook, chapters_range: typing.List[typing.Tuple[int, int]], *users: int):
         self.book_obj = book_obj
@@ -5,11 +5,14 @@ from queue import Empty
 
 from config import ConfigReader
 from dependencies.database import Database
+from dependencies.account_health import LibraryAccountMonitor
 from dependencies.database.database_exceptions import DatabaseDuplicateEntry
+from dependencies.session_manager import AccountSessionManager
 from dependencies.webnovel import classes
 from .background_objects import *
 from .services import BaseService, BooksLibraryChecker, NewChapterFinder, BuyerService, PasteCreator, PasteRequest, \
-    MultiPasteRequest, Paste, CookieMaintainerService, CurrencyFarmerService, PingService
+    MultiPasteRequest, Paste, CookieMaintainerService, CurrencyFarmerService, PingService, ChapterDecoderService, \
+    LibraryAccountHealthService
 
 
 # from operator import attrgetter
@@ -26,15 +29,25 @@ class BackgroundProcess:
         self.database = Database(database_host=config.db_host, database_name=config.db_name,
                                  database_user=config.db_user,
                                  database_password=config.db_password, database_port=config.db_port,
-                                 min_conns=config.min_db_conns, max_conns=config.max_db_conns)
-        self.services: typing.Dict[int: BaseService] = {1: BooksLibraryChecker(self.database),
+                                 min_conns=config.min_db_conns, max_conns=config.max_db_conns,
+                                 slow_query_threshold=config.db_slow_query_threshold)
+        # one kept open session per account, shared by every service that makes requests with accounts
+        self.session_manager = AccountSessionManager(self.database)
+        # the library accounts and their standbys, checked by the health service and used by the library checker
+        self.library_accounts = LibraryAccountMonitor(self.database)
+        self.services: typing.Dict[int: BaseService] = {1: BooksLibraryChecker(self.database, self.session_manager,
+                                                                               self.library_accounts),
                                                         2: NewChapterFinder(self.database),
-                                                        # 3: BuyerService(self.database),
+                                                        # 3: BuyerService(self.database, self.session_manager),
                                                         4: PasteCreator(),
                                                         # 5: ProxyManager(self.database)
-                                                        5: CookieMaintainerService(self.database),
-                                                        6: CurrencyFarmerService(self.database),
+                                                        5: CookieMaintainerService(self.database,
+                                                                                   self.session_manager),
+                                                        6: CurrencyFarmerService(self.database, self.session_manager),
                                                         # 7: PingService(self.database)
+                                                        8: ChapterDecoderService(self.database),
+                                                        9: LibraryAccountHealthService(self.database,
+                                                                                       self.library_accounts)
                                                         }
 
         if loop is None:
@@ -178,9 +191,20 @@ class BackgroundProcess:
                 self.queue_history[parent_id]['chs'][id_]['_'] = time.time()
                 new_bought_chapters.append(possible_bought_chapter)
 
+        # encrypted chapters go through the decoder before being pasted
+        self.services[8].add_to_queue(*new_bought_chapters)
+        decoded_chapters = []
+        try:
+            decoded_chapters.extend(self.services[8].retrieve_completed_cache())
+        except ErrorReport as e:
+            self.__return_data(e)
+        except ErrorList as e:
+            for error in e.errors:
+                self.__return_data(error)
+
         # organizing the groups that are for pastes
         organized_chapters = {}
-        for chapter in new_bought_chapters:
+        for chapter in decoded_chapters:
             if chapter.parent_id in organized_chapters:
                 organized_chapters[chapter.parent_id].append(chapter)
             else:
@@ -333,6 +357,7 @@ class BackgroundProcess:
         while self.running:
             try:
                 await self.main_loop()
+                await self.session_manager.close_idle()
                 self.last_main_loop = time.time()
                 await asyncio.sleep(5)
             except Exception as e:
@@ -460,6 +485,8 @@ class BackgroundProcess:
                         elif issubclass(type(received_object), ProcessCommand):
                             # TODO write the graceful stop method
                             if isinstance(received_object, HardStopProcess):
+                                # the batched account updates would be lost otherwise
+                                await self.database.close()
                                 exit()
                         elif issubclass(type(received_object), ServiceCommand):
                             if isinstance(received_object, StartService):
@@ -487,6 +514,12 @@ class BackgroundProcess:
                                 books_queue_status_list = self.read_history_queue()
                                 received_object.books_status_list.extend(books_queue_status_list)
                                 self.__return_data(received_object)
+                            if isinstance(received_object, DatabaseStatus):
+                                received_object.load_profiler(self.database.profiler)
+                                self.__return_data(received_object)
+                            if isinstance(received_object, UndecodedChaptersStatus):
+                                received_object.chapters.extend(self.services[8].return_waiting_chapters())
+                                self.__return_data(received_object)
                         else:
                             self.unknown_received_object(received_object, where='deciding what type of command it is')
                             # self.__return_data(ErrorReport(ValueError, "Invalid data type received at background
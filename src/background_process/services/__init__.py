@@ -1,6 +1,8 @@
+from .account_health_service import LibraryAccountHealthService
 from .base_service import BaseService
 from .buyer_service import BuyerService
 from .cookie_maintainer_service import CookieMaintainerService
+from .decoder_service import ChapterDecoderService
 from .farmer_service import CurrencyFarmerService
 from .new_chapter_finder import NewChapterFinder
 from .paste_service import PasteCreator, PasteRequest, MultiPasteRequest, Paste
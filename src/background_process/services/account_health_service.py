@@ -0,0 +1,16 @@
+from dependencies.account_health import LibraryAccountMonitor
+from dependencies.database import Database
+from .base_service import BaseService
+
+
+class LibraryAccountHealthService(BaseService):
+    """Checks the library accounts and their standbys in the background, away from the library check"""
+
+    def __init__(self, database: Database, account_monitor: LibraryAccountMonitor = None):
+        super().__init__(name="Library account health service", loop_time=120, output_service=False)
+        if account_monitor is None:
+            account_monitor = LibraryAccountMonitor(database)
+        self.account_monitor = account_monitor
+
+    async def main(self):
+        await self.account_monitor.refresh()
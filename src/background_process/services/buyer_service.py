@@ -4,10 +4,13 @@ import typing
 
 import aiohttp
 
+from dependencies.buy_scheduler import pack_chapters, schedule_buys
 from dependencies.database.database import Database
+from dependencies.database.database_exceptions import NoAccountFound
+from dependencies.privilege_fetcher import PrivilegeChapterFetcher
 from dependencies.proxy_classes import Proxy
+from dependencies.session_manager import AccountSession, AccountSessionManager
 from dependencies.webnovel import classes
-from dependencies.webnovel.waka import book as wbook
 from dependencies.webnovel.web import book
 from .base_service import BaseService
 from ..background_objects import NoAvailableBuyerAccountError
@@ -101,53 +104,92 @@ class InnerBuyQueue:
 
 
 class BuyManager:
-    def __init__(self, chapter: classes.SimpleChapter, session: aiohttp.ClientSession):
+    """Buys one chapter on its own task and hands the result to its pool as soon as it is done, failed attempts are
+    retried after the delay the pool gives back, which stops the retries by returning None"""
+
+    def __init__(self, chapter: classes.SimpleChapter, pool: 'BuyerPool'):
         self.chapter = chapter
-        self._session = session
-        self._task = asyncio.create_task(book.chapter_buyer(chapter.parent_id, chapter.id, session=self._session))
+        self.attempts = 0
+        self._pool = pool
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                async with self._pool.throttle:
+                    chapter = await book.chapter_buyer(self.chapter.parent_id, self.chapter.id,
+                                                       session=self._pool.session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.attempts += 1
+                delay = await self._pool.retry_delay(self, e)
+                if delay is None:
+                    return
+                await asyncio.sleep(delay)
+            else:
+                self._pool.buy_completed(self, chapter)
+                return
 
     def is_done(self):
         return self._task.done()
 
-    def return_chapter(self) -> classes.Chapter:
-        return self._task.result()
+    def cancel(self):
+        self._task.cancel()
+
 
-    def is_error(self) -> bool:
-        return bool(self._task.exception())
+def backoff_delay(attempts: int, base_delay: float, max_delay: float = 60) -> float:
+    return min(base_delay * 2 ** (attempts - 1), max_delay)
 
 
-# TODO Finish writing the handler in case of error | could be done.... need to check in detail
 class BuyerPool:
-    def __init__(self, account: classes.QiAccount, proxy: Proxy = None):
+    """Buys chapters with one account, every buy reports to the given callbacks as soon as it finishes instead of
+    waiting for the next loop of the service
+        :arg session a session kept open by the caller for the account, the pool makes and closes its own if not given
+        :arg on_completed called with every bought chapter
+        :arg on_uncompleted called with every chapter that couldn't be bought with this account
+        :arg max_concurrent_buys how many buy requests the account has going at the same time
+        :arg max_attempts attempts made for a chapter before giving it back"""
+
+    def __init__(self, account: classes.QiAccount, proxy: Proxy = None, session: aiohttp.ClientSession = None, *,
+                 on_completed: typing.Callable[[classes.Chapter], typing.Any],
+                 on_uncompleted: typing.Callable[[classes.SimpleChapter], typing.Any],
+                 max_concurrent_buys: int = 5, max_attempts: int = 4, retry_base_delay: float = 1):
         self._proxy = proxy
         self._account = account
         self._slots = account.fast_pass_count
-        if self._proxy:
-            self._connector = proxy.generate_connector(**default_connector_settings)
-        else:
-            self._connector = aiohttp.TCPConnector(**default_connector_settings)
-        self._buys = []
-        self._completed_chapters = []
-        self._completed_buys = []
-        self._uncompleted_chapters_to_return = []
+        self._buys: typing.List[BuyManager] = []
         self._created_time = time.time()
-
-        # TODO find if there is a non deprecated form, ps. the deprecated form is creating it from an sync code,
-        #  creating it from an async code is legal
-        self._session = aiohttp.ClientSession(connector=self._connector, cookies=account.cookies)
-
-    def __return__completed_chapter(self) -> list:
-        return_list = self._completed_chapters.copy()
-        self._completed_chapters.clear()
-        for buy_manager in self._completed_buys:
-            self._buys.remove(buy_manager)
-        self._completed_buys.clear()
-        return return_list
+        # buys completed since the fp count of the account was last read from qi
+        self._spent_fast_passes = 0
+        self._on_completed = on_completed
+        self._on_uncompleted = on_uncompleted
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.throttle = asyncio.Semaphore(max_concurrent_buys)
+        # failures that happen together share a single forced check of the account
+        self._validity_lock = asyncio.Lock()
+        self._last_validity_check = 0
+        self._account_can_buy = True
+
+        self._owns_session = session is None
+        if session is None:
+            if self._proxy:
+                connector = proxy.generate_connector(**default_connector_settings)
+            else:
+                connector = aiohttp.TCPConnector(**default_connector_settings)
+            # TODO find if there is a non deprecated form, ps. the deprecated form is creating it from an sync code,
+            #  creating it from an async code is legal
+            session = aiohttp.ClientSession(connector=connector, cookies=account.cookies)
+        self.session = session
 
     def available_capacity(self) -> bool:
+        return self.remaining_slots() > 0
+
+    def remaining_slots(self) -> int:
         if time.time() - self._created_time >= 180:
             self._slots = 0
-        return self._slots > 0
+        return max(self._slots, 0)
 
     def return_number_of_items_in_pool(self):
         return len(self._buys)
@@ -158,110 +200,125 @@ class BuyerPool:
     def has_queue(self) -> bool:
         return len(self._buys) > 1
 
-    def has_uncompleted_chapters(self) -> bool:
-        return len(self._uncompleted_chapters_to_return) > 0
-
-    def return_uncompleted_chapters(self):
-        return self._uncompleted_chapters_to_return
-
-    async def retrieve_done(self) -> list:
-        for buy_manager in self._buys:
-            buy_manager: BuyManager
-            if buy_manager.is_done():
-                if buy_manager.is_error():
-                    if await self._account.async_check_valid():
-                        if self._account.fast_pass_count > 0:
-                            if self._slots != self._account.fast_pass_count:
-                                self._slots = self._account.fast_pass_count
-
-                            self._buys.append(BuyManager(buy_manager.chapter, self._session))
-                            self._buys.remove(buy_manager)
-                            self._slots -= 1
-                        else:
-                            self._slots = 0
-                            self._uncompleted_chapters_to_return.append(buy_manager.chapter)
-                            self._buys.remove(buy_manager)
-                    else:
-                        self._slots = 0
-                        self._uncompleted_chapters_to_return.append(buy_manager.chapter)
-                        self._buys.remove(buy_manager)
-                else:
-                    self._completed_chapters.append(buy_manager.return_chapter())
-                    self._completed_buys.append(buy_manager)
-        return self.__return__completed_chapter()
+    async def __check_account(self) -> bool:
+        async with self._validity_lock:
+            if time.time() - self._last_validity_check < self.retry_base_delay:
+                return self._account_can_buy
+            # a failed buy is the only time the cached validity isn't trusted
+            self._spent_fast_passes = 0
+            valid = await self._account.async_check_valid(force=True)
+            self._account_can_buy = valid and self._account.fast_pass_count > 0
+            self._last_validity_check = time.time()
+            if self._account_can_buy:
+                # every buy still going on will take one of the fast passes
+                self._slots = self._account.fast_pass_count - len(self._buys)
+            else:
+                self._slots = 0
+            return self._account_can_buy
+
+    async def retry_delay(self, buy_manager: BuyManager, error: Exception) -> typing.Optional[float]:
+        """Decides if a failed buy is attempted again, returns the seconds to wait before it or None if the chapter is
+        given back"""
+        try:
+            retry = buy_manager.attempts < self.max_attempts and await self.__check_account()
+        except Exception:
+            # qi couldn't even be asked about the account, the chapter is better off with another one
+            retry = False
+        if retry:
+            return backoff_delay(buy_manager.attempts, self.retry_base_delay)
+        self._buys.remove(buy_manager)
+        self._on_uncompleted(buy_manager.chapter)
+        return None
+
+    def buy_completed(self, buy_manager: BuyManager, chapter: classes.Chapter):
+        self._buys.remove(buy_manager)
+        self._spent_fast_passes += 1
+        self._on_completed(chapter)
+
+    def spent_fast_passes(self) -> int:
+        return self._spent_fast_passes
 
     def buy(self, chapter: classes.SimpleChapter):
-        self._buys.append(BuyManager(chapter, self._session))
+        self._buys.append(BuyManager(chapter, self))
         self._slots -= 1
 
     def return_account(self):
         return self._account
 
     async def close(self):
-        await self._session.close()
-
-
-class WakaBuyManager:
-    def __init__(self, chapter: classes.SimpleChapter, session: aiohttp.ClientSession):
-        self.chapter = chapter
-        self._session = session
-        self._task = asyncio.create_task(wbook.chapter_retriever(chapter.parent_id, chapter.id, chapter.volume_index,
-                                                                 session=self._session))
-
-    def is_done(self):
-        return self._task.done()
-
-    def return_chapter(self) -> classes.Chapter:
-        return self._task.result()
-
-    def is_error(self):
-        return bool(self._task.exception())
+        for buy_manager in self._buys:
+            buy_manager.cancel()
+        if self._owns_session:
+            await self.session.close()
 
 
 class WakaBuyerPool:
-    def __init__(self, waka_proxy: Proxy):
-        self._proxy = waka_proxy
-        self._buyers = []
-        self._done_managers = set()
-        self._chapters = []
-        self._connector = waka_proxy.generate_connector(**default_connector_settings)
-        self._session = aiohttp.ClientSession(connector=self._connector)
-
-    def retrieve_done(self) -> list:
-        for manager in self._buyers:
-            manager: WakaBuyManager
-            if manager.is_done():
-                if manager.is_error():
-                    self._buyers.append(WakaBuyManager(chapter=manager.chapter, session=self._session))
-                    self._done_managers.add(manager)
-                    manager.return_chapter()
-                else:
-                    self._chapters.append(manager.return_chapter())
-                    self._done_managers.add(manager)
-                    # self._done_managers.append(manager)
-
-        for manager_to_delete in self._done_managers:
-            try:
-                self._buyers.remove(manager_to_delete)
-            except ValueError:
-                pass
-        self._done_managers.clear()
-        chapters_to_return = self._chapters.copy()
-        self._chapters.clear()
-        return chapters_to_return
+    """Retrieves the privilege chapters through the waka proxies of the fetcher, reporting to the callbacks like
+    BuyerPool, the retries and the spreading over the proxies are left to the fetcher"""
+
+    def __init__(self, fetcher: PrivilegeChapterFetcher, *,
+                 on_completed: typing.Callable[[classes.Chapter], typing.Any],
+                 on_uncompleted: typing.Callable[[classes.SimpleChapter], typing.Any]):
+        self.fetcher = fetcher
+        self._fetches: typing.Dict[int, asyncio.Task] = {}
+        self._on_completed = on_completed
+        self._on_uncompleted = on_uncompleted
+
+    async def __fetch(self, chapter: classes.SimpleChapter):
+        try:
+            chapter_obj = await self.fetcher.fetch(chapter)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._on_uncompleted(chapter)
+        else:
+            self._on_completed(chapter_obj)
+        finally:
+            del self._fetches[chapter.id]
 
     def buy(self, chapter: classes.SimpleChapter):
-        self._buyers.append(WakaBuyManager(chapter, self._session))
+        self._fetches[chapter.id] = asyncio.create_task(self.__fetch(chapter))
+
+    def return_number_of_items_in_pool(self):
+        return len(self._fetches)
+
+    async def close(self):
+        for task in self._fetches.values():
+            task.cancel()
+        await self.fetcher.close()
 
 
 class BuyerService(BaseService):
-    def __init__(self, database: Database):
+    def __init__(self, database: Database, session_manager: AccountSessionManager = None):
         super().__init__("Buyer Service")
         self._buyer_queue = InnerBuyQueue()
         self.database = database
+        if session_manager is None:
+            session_manager = AccountSessionManager(database)
+        self.session_manager = session_manager
         self.pools = []
+        self._pools_sessions: typing.Dict[int, AccountSession] = {}
         self.priv_buyer = None
         self.max_buys = 30
+        # chapters handed at the same time to a single account
+        self.max_buys_per_account = 10
+        # buy requests an account has going at the same time, the rest of its chapters wait for one to finish
+        self.max_concurrent_buys_per_account = 5
+        # attempts made for a chapter with the same account, retries wait 1, 2, 4... times the base delay
+        self.max_buy_attempts = 4
+        self.buy_retry_base_delay = 1
+        # waka proxies the privilege chapters are spread over and requests each of them has going at the same time
+        self.privilege_proxies = 5
+        self.max_fetches_per_proxy = 4
+        self.last_proxy_report = time.time()
+
+    def _chapter_bought(self, chapter: classes.Chapter):
+        self._buyer_queue.marked_as_complete(chapter.id)
+        self._output_queue.append(chapter)
+
+    def _chapter_not_bought(self, chapter: classes.SimpleChapter):
+        # back to the queue to be tried with another account
+        self.add_to_queue(chapter)
 
     def load_inner_queue(self):
         cache_content = self._retrieve_input_queue()
@@ -272,7 +329,11 @@ class BuyerService(BaseService):
 
     async def main(self):
         if self.priv_buyer is None:
-            self.priv_buyer = WakaBuyerPool(await self.database.retrieve_proxy(1))
+            fetcher = await PrivilegeChapterFetcher.from_database(self.database,
+                                                                  max_proxies=self.privilege_proxies,
+                                                                  max_per_proxy=self.max_fetches_per_proxy)
+            self.priv_buyer = WakaBuyerPool(fetcher, on_completed=self._chapter_bought,
+                                            on_uncompleted=self._chapter_not_bought)
 
         self.load_inner_queue()
 
@@ -289,67 +350,69 @@ class BuyerService(BaseService):
             chapters_to_buy = self._buyer_queue.return_used_chapters()
 
         # will assign the chapters from the input queue to a pool
+        non_privilege_chapters = []
         for chapter in chapters_to_buy:
             if chapter.is_privilege:
                 self.priv_buyer.buy(chapter)
             else:
-                for pool in self.pools:
-                    pool: typing.Union[BuyerPool]
-                    if pool.available_capacity():
-                        pool.buy(chapter)
-                        break
-                else:
-                    account = await self.database.retrieve_buyer_account()
-                    account_try = 0
-                    while True:
-                        account_working = await account.async_check_valid()
-                        if account_working:
-                            if account.fast_pass_count == 0:
-                                await self.database.update_account_fp_count(0, account)
-                                account_try += 1
-                                if account_try >= 10:
-                                    raise NoAvailableBuyerAccountError("No available account was found for a "
-                                                                       "new buyer pool")
-                                continue
-                            break
-                        else:
-                            account_try += 1
-                            await self.database.expired_account(account)
-                            if account_try >= 10:
-                                raise NoAvailableBuyerAccountError("No available account was found for a "
-                                                                   "new buyer pool")
-                            account = await self.database.retrieve_buyer_account()
-                    new_pool = BuyerPool(account=account)
+                non_privilege_chapters.append(chapter)
+
+        # the pools already running are filled first so that no account is leased while a leased one still has room
+        pools_capacities = [(pool, min(pool.remaining_slots(),
+                                       self.max_buys_per_account - pool.return_number_of_items_in_pool()))
+                            for pool in self.pools]
+        pools_assignments, non_privilege_chapters = pack_chapters(non_privilege_chapters, pools_capacities)
+        for pool, pool_chapters in pools_assignments:
+            for chapter in pool_chapters:
+                pool.buy(chapter)
+
+        # the pools already running are cleaned up and keep their leases even when no new pool could be made
+        try:
+            try:
+                accounts_assignments = await schedule_buys(self.database, non_privilege_chapters,
+                                                           max_per_account=self.max_buys_per_account)
+            except NoAccountFound:
+                # back to the queue so that they are tried again on the next loop
+                self.add_to_queue(*non_privilege_chapters)
+                raise NoAvailableBuyerAccountError("No available account was found for a new buyer pool")
+            for account, account_chapters in accounts_assignments:
+                # pinned for as long as the pool lives so that no cleanup of the manager closes it under the buys
+                account_session = await self.session_manager.get(account, pin=True)
+                self._pools_sessions[account.guid] = account_session
+                new_pool = BuyerPool(account=account, session=account_session.session,
+                                     on_completed=self._chapter_bought, on_uncompleted=self._chapter_not_bought,
+                                     max_concurrent_buys=self.max_concurrent_buys_per_account,
+                                     max_attempts=self.max_buy_attempts, retry_base_delay=self.buy_retry_base_delay)
+                for chapter in account_chapters:
                     new_pool.buy(chapter)
-                    self.pools.append(new_pool)
+                self.pools.append(new_pool)
+        finally:
+            await self._maintain_pools()
 
-        # will add to the output cache the completed values from the pools
-        for pool in self.pools:
-            completed_chapters = await pool.retrieve_done()
-            for chapter in completed_chapters:
-                self._buyer_queue.marked_as_complete(chapter.id)
-            self._output_queue.extend(completed_chapters)
-        self._output_queue.extend(self.priv_buyer.retrieve_done())
-
-        # will look for empty pools and clean up
-        pool_to_delete = []
-        for pool in self.pools:
-            if pool.is_empty():
-                if pool.has_uncompleted_chapters():
-                    uncompleted_chapters = pool.return_uncompleted_chapters()
-                    pool_to_delete.append(pool)
-                    self.add_to_queue(*uncompleted_chapters)
-                else:
-                    pool_to_delete.append(pool)
+    async def _maintain_pools(self):
+        # the bought chapters reach the output cache through the callbacks of the pools, here only the pools that
+        # have nothing left going on are cleaned up
+        pool_to_delete = [pool for pool in self.pools if pool.is_empty()]
 
         for pool in pool_to_delete:
             pool_account = pool.return_account()
-            await pool_account.async_check_valid()
-            await self.database.update_account_fp_count(pool_account.fast_pass_count, pool_account)
-            await self.database.release_account(pool_account)
+            pool_account.spend_fast_passes(pool.spent_fast_passes())
+            await self.database.update_account_fp_count(pool_account.fast_pass_count, pool_account, batch=True)
+            await self.database.release_account(pool_account, batch=True)
             await pool.close()
+            await self.session_manager.store_cookies(pool_account)
+            account_session = self._pools_sessions.pop(pool_account.guid, None)
+            if account_session is not None:
+                await self.session_manager.unpin(account_session)
             self.pools.remove(pool)
 
         self._buyer_queue.clean_queue()
 
-        await self.database.release_accounts_over_five_in_use_minutes()
+        if time.time() - self.last_proxy_report >= 600:
+            print(f"Privilege chapter proxies: {self.priv_buyer.fetcher.stats()}")
+            self.last_proxy_report = time.time()
+
+        # keeps the accounts of the live pools leased while they still have buys going on
+        lost_leases = await self.database.renew_account_leases(*[pool.return_account() for pool in self.pools])
+        for account in lost_leases:
+            print(f"Lease of account {account.guid} expired while a buyer pool was still using it")
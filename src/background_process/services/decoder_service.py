@@ -0,0 +1,102 @@
+import time
+import typing
+
+from dependencies.database import Database
+from dependencies.webnovel import classes
+from dependencies.webnovel.web.font_decoder.batch_decoder import decode_chapters
+from dependencies.webnovel.web.font_decoder.decode_executor import DecodeExecutor
+from dependencies.webnovel.web.font_decoder.font_cache import FontDecodeCache, font_bytes_hash, font_metrics_hash
+from dependencies.webnovel.web.font_decoder.glyph_dictionary import GlyphDictionary
+from .base_service import BaseService
+
+
+class WaitingFont:
+    """Font with glyphs that no known font matched, its chapters wait until someone teaches them through the bot"""
+
+    def __init__(self, font_bytes: bytes, unknown_glyphs: int):
+        self.font_bytes = font_bytes
+        self.unknown_glyphs = unknown_glyphs
+        self.chapters: typing.Dict[int, classes.Chapter] = {}
+        # the font is looked up on every check, it is only hashed and parsed once
+        self.font_hash = font_bytes_hash(font_bytes)
+        self.metrics_hash = font_metrics_hash(font_bytes)
+
+
+class ChapterDecoderService(BaseService):
+    """Decodes the bought encrypted chapters before they are pasted. Chapters whose font has unknown glyphs are held
+    back until the font decode is learned by the bot (buy_decode_id) and then decoded on a later loop"""
+
+    def __init__(self, database: Database):
+        super().__init__('Chapter Decoder Service', loop_time=10)
+        self.database = database
+        self.glyph_dictionary = GlyphDictionary()
+        self.font_decode_cache = FontDecodeCache(database)
+        self.decode_executor = DecodeExecutor(self.glyph_dictionary)
+        self._dictionary_loaded = False
+        # font hash: font waiting for help
+        self._waiting_fonts: typing.Dict[str, WaitingFont] = {}
+        # seconds between the lookups of the waiting fonts on the decode cache
+        self.waiting_fonts_check_interval = 60
+        self._last_waiting_fonts_check = 0
+
+    async def __load_glyph_dictionary(self):
+        self.glyph_dictionary.load()
+        fonts = await self.database.retrieve_top_50_fonts()
+        if self.glyph_dictionary.add_fonts(fonts) > 0:
+            self.glyph_dictionary.save()
+        self.decode_executor.refresh_dictionary()
+        self._dictionary_loaded = True
+
+    def return_waiting_chapters(self) -> typing.List[typing.Tuple[int, int, int, int]]:
+        """(book id, chapter id, chapter index, unknown glyphs of its font) of every chapter waiting for help"""
+        waiting_chapters = []
+        for waiting_font in self._waiting_fonts.values():
+            for chapter in waiting_font.chapters.values():
+                waiting_chapters.append((chapter.parent_id, chapter.id, chapter.index, waiting_font.unknown_glyphs))
+        waiting_chapters.sort()
+        return waiting_chapters
+
+    async def main(self):
+        if not self._dictionary_loaded or self._is_a_restart:
+            await self.__load_glyph_dictionary()
+
+        chapters_to_decode = []
+        for chapter in self._retrieve_input_queue():
+            chapter: classes.Chapter
+            if chapter.encrypt_type == 2:
+                chapters_to_decode.append(chapter)
+            else:
+                self._output_queue.append(chapter)
+
+        try:
+            # waiting chapters are only decoded again once their font shows up on the decode cache
+            if time.time() - self._last_waiting_fonts_check >= self.waiting_fonts_check_interval:
+                self._last_waiting_fonts_check = time.time()
+                for font_hash, waiting_font in list(self._waiting_fonts.items()):
+                    if await self.font_decode_cache.retrieve_hashed(waiting_font.font_hash,
+                                                                    waiting_font.metrics_hash) is not None:
+                        chapters_to_decode.extend(waiting_font.chapters.values())
+                        del self._waiting_fonts[font_hash]
+
+            if len(chapters_to_decode) == 0:
+                return
+
+            chapter_decodes, incomplete_fonts = await decode_chapters(chapters_to_decode, self.decode_executor,
+                                                                      self.font_decode_cache)
+        except BaseException:
+            # the chapters are already marked as in paste, they go back to the queue to be decoded on the next loop
+            # and the error is reported by the service loop
+            self.add_to_queue(*chapters_to_decode)
+            raise
+        for chapter_decode in chapter_decodes:
+            if chapter_decode.is_complete:
+                chapter = chapter_decode.chapter
+                chapter.content = chapter_decode.decoded_text()
+                chapter.encrypt_type = 0
+                self._output_queue.append(chapter)
+
+        for font in incomplete_fonts:
+            if font.font_hash not in self._waiting_fonts:
+                self._waiting_fonts[font.font_hash] = WaitingFont(font.font_bytes, len(font.unknown_glyphs))
+            for chapter_decode in font.chapters:
+                self._waiting_fonts[font.font_hash].chapters[chapter_decode.chapter.id] = chapter_decode.chapter
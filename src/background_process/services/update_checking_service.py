@@ -1,12 +1,15 @@
 import asyncio
+import traceback
 import typing
 
+from dependencies.account_health import LibraryAccountMonitor
 from dependencies.database.database import Database
 from dependencies.proxy_classes import Proxy
+from dependencies.session_manager import AccountSessionManager
 from dependencies.webnovel.classes import QiAccount, SimpleBook, SimpleComic
 from dependencies.webnovel.web import library
 from .base_service import BaseService
-from ..background_objects import LibraryRetrievalError
+from ..background_objects import ErrorReport
 
 
 async def retrieve_library_accounts(database: Database) -> typing.List[QiAccount]:
@@ -18,49 +21,43 @@ async def retrieve_library_accounts(database: Database) -> typing.List[QiAccount
     return accounts
 
 
-async def test_account(account: QiAccount):
-    account_status = await account.async_check_valid()
-    return account_status, account
+async def invalidate_on_error(account: QiAccount, coroutine: typing.Awaitable):
+    """Awaits the request made with the account, if it fails the cached validity of the account is dropped since it is
+    what let the account through, the next check has to ask qi again"""
+    try:
+        return await coroutine
+    except Exception:
+        account.invalidate_validity()
+        raise
 
 
-async def retrieve_library_content(account: QiAccount, proxy: Proxy = None):
-    library_items, pages_in_library = await library.retrieve_all_library_pages(account=account, proxy=proxy)
+async def retrieve_library_content(account: QiAccount, session_manager: AccountSessionManager, proxy: Proxy = None):
+    async with session_manager.checkout(account, proxy) as session:
+        library_items, pages_in_library = await invalidate_on_error(account, library.retrieve_all_library_pages(
+            session=session, account=account, csrf_token=session_manager.csrf_token(account)))
+        await session_manager.store_cookies(account)
     return library_items, pages_in_library, account
 
 
 class BooksLibraryChecker(BaseService):
-    def __init__(self, database: Database):
+    def __init__(self, database: Database, session_manager: AccountSessionManager = None,
+                 account_monitor: LibraryAccountMonitor = None):
         super().__init__('Library Checker Service')
         self.database = database
+        if session_manager is None:
+            session_manager = AccountSessionManager(database)
+        self.session_manager = session_manager
+        if account_monitor is None:
+            account_monitor = LibraryAccountMonitor(database)
+        self.account_monitor = account_monitor
 
     async def main(self):
-        # accounts = await retrieve_library_accounts(self.database)
-        accounts = await self.database.retrieve_all_library_type_number_accounts(1)
-        expected_accounts_count = len(accounts)
-        working_accounts = []
-        # working_accounts_number = []
-        run_count = 0
-
-        # this retrieves accounts and check if they are working before using them
-        while True:
-            account_tests = [asyncio.create_task(test_account(account)) for account in accounts]
-            results = await asyncio.gather(*account_tests)
-            accounts = []
-            for check_result, account in results:
-                if check_result:
-                    working_accounts.append(account)
-                    # working_accounts_number.append(account.library_type)
-                else:
-                    await self.database.expired_account(account)
-                    accounts.append(await self.database.retrieve_specific_library_type_number_account(
-                        account.library_type))
-            if len(working_accounts) == expected_accounts_count:
-                break
-            run_count += 1
-            if run_count >= 3:
-                raise LibraryRetrievalError
-
-        accounts_number_dict = {account.library_type: account for account in working_accounts}
+        # the accounts are checked in the background by the health service, only the first run waits for a check
+        await self.account_monitor.ensure_checked()
+        working_accounts = list(self.account_monitor.accounts().values())
+        if len(working_accounts) == 0:
+            print("Library check skipped, there is no working library account")
+            return
 
         # retrieves the books and orders them in the expected accounts groups
         simple_books_list = await self.database.retrieve_all_simple_books()
@@ -83,15 +80,26 @@ class BooksLibraryChecker(BaseService):
 
         # will retrieve the library content and order them
         library_books = []
-        tasks = [asyncio.create_task(retrieve_library_content(account)) for account in working_accounts]
-        results = await asyncio.gather(*tasks)
-        for library_items, all_library_pages_count, account in results:
+        tasks = [asyncio.create_task(retrieve_library_content(account, self.session_manager))
+                 for account in working_accounts]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        accounts_number_dict = {}
+        for account, result in zip(working_accounts, results):
+            if isinstance(result, Exception):
+                # the library types without content are left out of the comparison, they are checked on a later run
+                self.account_monitor.report_failure(account)
+                traceback_str = ''.join(traceback.format_exception(type(result), result, result.__traceback__))
+                self.add_to_error_queue(ErrorReport(type(result), f'library retrieval with account {account.guid} '
+                                                                  f'failed', traceback_str, str(result)))
+                continue
+            library_items, all_library_pages_count, account = result
             library_items: typing.List[typing.Union[SimpleBook, SimpleComic]]
             all_library_pages_count: int
             account: QiAccount
+            accounts_number_dict[account.library_type] = account
             library_books.append((account.library_type, library_items))
             if account.library_pages != all_library_pages_count:
-                await self.database.set_library_pages_number(account, all_library_pages_count)
+                await self.database.set_library_pages_number(account, all_library_pages_count, batch=True)
 
         # will compare the library books with the db books
         extra_books_in_library = {}
@@ -127,7 +135,8 @@ class BooksLibraryChecker(BaseService):
             for library_type_number, missing_books in missing_book_from_library.items():
                 account_obj: QiAccount = accounts_number_dict[library_type_number]
                 for missing_book in missing_books:
-                    tasks.append(asyncio.create_task(library.add_item_to_library(missing_book, account=account_obj)))
+                    tasks.append(asyncio.create_task(invalidate_on_error(
+                        account_obj, library.add_item_to_library(missing_book, account=account_obj))))
             await asyncio.gather(*tasks)
 
         # will remove unchecked items from the library
@@ -135,6 +144,6 @@ class BooksLibraryChecker(BaseService):
             tasks = []
             for library_type_number, extra_books in extra_books_in_library.items():
                 account_obj: QiAccount = accounts_number_dict[library_type_number]
-                tasks.append(asyncio.create_task(library.batch_remove_books_from_library(*extra_books,
-                                                                                         account=account_obj)))
+                tasks.append(asyncio.create_task(invalidate_on_error(
+                    account_obj, library.batch_remove_books_from_library(*extra_books, account=account_obj))))
             await asyncio.gather(*tasks)
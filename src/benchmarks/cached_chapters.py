@@ -0,0 +1,46 @@
+"""Reads the bought chapters the bot keeps, for the benchmarks that run over them. The chapters live in the chapter
+content store, a directory of the older one pickle per chapter cache can still be given instead."""
+import asyncio
+import os
+import pickle
+import typing
+
+from config import ConfigReader
+from dependencies.chapter_store import ChapterContentStore
+from dependencies.database import Database
+from dependencies.webnovel.classes import Chapter
+
+
+def iter_directory_chapters(directory: str) -> typing.Iterator[typing.Tuple[str, Chapter]]:
+    """The (file name, chapter) of a pickle directory, one the bot already imported into the store is read too"""
+    if not os.path.isdir(directory) and os.path.isdir(f'{directory}.imported'):
+        directory = f'{directory}.imported'
+    for file_name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, file_name), 'rb') as file:
+            yield file_name, pickle.load(file)
+
+
+def iter_store_chapters(batch_size: int = 100) -> typing.Iterator[typing.Tuple[str, Chapter]]:
+    """The (book id-chapter id, chapter) of every chapter of the chapter content store, read in batches"""
+    loop = asyncio.new_event_loop()
+    config = ConfigReader()
+    database = Database(database_host=config.db_host, database_name=config.db_name, database_user=config.db_user,
+                        database_password=config.db_password, database_port=config.db_port, min_conns=1,
+                        max_conns=2, loop=loop)
+    try:
+        store = ChapterContentStore(database)
+        loop.run_until_complete(store.load())
+        keys = store.keys()
+        for index in range(0, len(keys), batch_size):
+            for chapter in loop.run_until_complete(store.retrieve_many(*keys[index:index + batch_size])):
+                yield f'{chapter.parent_id}-{chapter.id}', chapter
+    finally:
+        loop.run_until_complete(database.close())
+        loop.close()
+
+
+def iter_cached_chapters(directory: str = None) -> typing.Iterator[typing.Tuple[str, Chapter]]:
+    """The chapters of the given pickle directory, or of the chapter content store if none is given"""
+    if directory is None:
+        return iter_store_chapters()
+    return iter_directory_chapters(directory)
@@ -0,0 +1,87 @@
+"""Checks that the hot database queries are planned with the indexes added by the migrations.
+
+Run it from the src directory, same as the launcher:  python -m benchmarks.db_explain
+"""
+import asyncio
+import json
+import sys
+import typing
+
+import asyncpg
+
+from config import ConfigReader
+from dependencies.database.database import ALL_BOOKS_PINGS_QUERY, BUYER_ACCOUNTS_QUERY, CHAPTERS_FROM_INDEX_QUERY, \
+    LIBRARY_TYPE_ACCOUNT_QUERY, USER_PINGS_QUERY
+from dependencies.database.migration_runner import apply_migrations
+
+
+class ExplainCheck:
+    def __init__(self, method_name: str, query: str, arguments: tuple, expected_index: typing.Optional[str]):
+        """
+            :arg method_name the Database method that runs the query
+            :arg expected_index the index the planner should pick once sequential scans are disabled, None for a query
+            that reads the whole table and should stay a plain sequential scan
+        """
+        self.method_name = method_name
+        self.query = query
+        self.arguments = arguments
+        self.expected_index = expected_index
+
+
+HOT_QUERIES = (
+    ExplainCheck('get_chapter_objs_from_index', CHAPTERS_FROM_INDEX_QUERY, (0, 1, 20), 'CHAPTERS_BOOK_ID_INDEX_IDX'),
+    # EXPLAIN alone doesn't run the statement, no account is leased by the check
+    ExplainCheck('retrieve_buyer_accounts', BUYER_ACCOUNTS_QUERY, (1, 10, 'db_explain', 300.0),
+                 'QIACCOUNT_BUYABLE_FP_IDX'),
+    ExplainCheck('retrieve_specific_library_type_number_account', LIBRARY_TYPE_ACCOUNT_QUERY, (1,),
+                 'QIACCOUNT_LIBRARY_TYPE_IDX'),
+    ExplainCheck('retrieve_all_books_pings', ALL_BOOKS_PINGS_QUERY, (), None),
+    ExplainCheck('retrieve_user_pings', USER_PINGS_QUERY, (0,), 'BOOKS_PINGS_REQUESTS_USER_ID_IDX'),
+)
+
+
+def find_used_indexes(plan: dict) -> typing.Set[str]:
+    indexes = set()
+    if 'Index Name' in plan:
+        indexes.add(plan['Index Name'])
+    for sub_plan in plan.get('Plans', []):
+        indexes.update(find_used_indexes(sub_plan))
+    return indexes
+
+
+async def run_explain_check(connection: asyncpg.Connection, check: ExplainCheck) -> typing.Tuple[bool, set]:
+    async with connection.transaction():
+        if check.expected_index is not None:
+            # small tables are always cheaper to scan sequentially, so the check only proves the index is usable
+            await connection.execute('SET LOCAL enable_seqscan = off')
+        explain_result = await connection.fetchval(f'EXPLAIN (FORMAT JSON) {check.query}', *check.arguments)
+    if isinstance(explain_result, str):
+        explain_result = json.loads(explain_result)
+    used_indexes = find_used_indexes(explain_result[0]['Plan'])
+    if check.expected_index is None:
+        return len(used_indexes) == 0, used_indexes
+    return check.expected_index in used_indexes, used_indexes
+
+
+async def main() -> int:
+    config = ConfigReader()
+    pool = await asyncpg.create_pool(f'postgres://{config.db_user}:{config.db_password}@{config.db_host}:'
+                                     f'{config.db_port}/{config.db_name}', min_size=1, max_size=1)
+    failures = 0
+    try:
+        await apply_migrations(pool)
+        async with pool.acquire() as connection:
+            for check in HOT_QUERIES:
+                passed, used_indexes = await run_explain_check(connection, check)
+                if not passed:
+                    failures += 1
+                status = 'OK  ' if passed else 'FAIL'
+                print(f'{status} {check.method_name:<48} expected {check.expected_index or "no index"}, '
+                      f'used: {", ".join(sorted(used_indexes)) or "no index"}')
+    finally:
+        await pool.close()
+    return failures
+
+
+if __name__ == '__main__':
+    sys.exit(1 if asyncio.run(main()) else 0)
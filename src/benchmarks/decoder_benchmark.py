@@ -0,0 +1,189 @@
+"""Measures the speed and accuracy of the font decoders over a stored corpus of encrypted chapters.
+
+Run it from the src directory, same as the launcher:
+    python -m benchmarks.decoder_benchmark [--corpus decoder_corpus] [--cutoffs 0,5,10,20]
+    python -m benchmarks.decoder_benchmark --export-cache            copies the stored chapters into the corpus
+    python -m benchmarks.decoder_benchmark --export-cache chapters   same from a directory of the old pickle cache
+
+Corpus layout:
+    samples/<name>.ttf        a known font
+    samples/<name>.txt        its letters in glyph order, same as the LETTERS column of the FONTS table
+    chapters/<name>.content   the raw content of an encrypted chapter, as stored on Chapter.content
+    chapters/<name>.txt       the expected decoded text, chapters without it are timed but not scored
+"""
+import argparse
+import difflib
+import os
+import sys
+import time
+import typing
+
+from dependencies.webnovel.web.font_decoder.decoder import DecoderBase, HashBasedDecoder, MetricsBasedDecoder
+from dependencies.webnovel.web.font_decoder.glyph_dictionary import GlyphDictionary
+from dependencies.webnovel.web.font_decoder.utils import ContentInfo
+from .cached_chapters import iter_cached_chapters
+
+DECODERS = (MetricsBasedDecoder, HashBasedDecoder)
+STAGES = ('font parse', 'map build', 'unscramble', 'translate')
+
+
+class CorpusChapter:
+    def __init__(self, name: str, content: str, expected: typing.Optional[str]):
+        self.name = name
+        self.content = content
+        self.expected = expected
+
+
+class BenchmarkResult:
+    def __init__(self, decoder_class: typing.Type[DecoderBase], score_cutoff: int):
+        self.decoder_class = decoder_class
+        self.score_cutoff = score_cutoff
+        self.stage_times = {stage: 0.0 for stage in STAGES}
+        self.chars = 0
+        self.unknown_glyphs = 0
+        self.scored_chapters = 0
+        self.accuracy_total = 0.0
+
+    @property
+    def total_time(self) -> float:
+        return sum(self.stage_times.values())
+
+    @property
+    def accuracy(self) -> typing.Optional[float]:
+        if self.scored_chapters == 0:
+            return None
+        return self.accuracy_total / self.scored_chapters
+
+
+def read_text(path: str) -> typing.Optional[str]:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def load_samples(corpus: str) -> typing.List[typing.Tuple[str, bytes]]:
+    samples_dir = os.path.join(corpus, 'samples')
+    samples = []
+    for file_name in sorted(os.listdir(samples_dir)):
+        name, extension = os.path.splitext(file_name)
+        if extension != '.ttf':
+            continue
+        letters = read_text(os.path.join(samples_dir, f'{name}.txt'))
+        if letters is None:
+            print(f'sample {file_name} has no letters file, skipping it')
+            continue
+        with open(os.path.join(samples_dir, file_name), 'rb') as file:
+            samples.append((letters, file.read()))
+    return samples
+
+
+def load_chapters(corpus: str) -> typing.List[CorpusChapter]:
+    chapters_dir = os.path.join(corpus, 'chapters')
+    chapters = []
+    for file_name in sorted(os.listdir(chapters_dir)):
+        name, extension = os.path.splitext(file_name)
+        if extension != '.content':
+            continue
+        content = read_text(os.path.join(chapters_dir, file_name))
+        chapters.append(CorpusChapter(name, content, read_text(os.path.join(chapters_dir, f'{name}.txt'))))
+    return chapters
+
+
+def score(decoded: str, expected: str) -> float:
+    """Share of the expected text that the decoded text got right"""
+    if decoded == expected:
+        return 1.0
+    if len(decoded) == len(expected):
+        return sum(a == b for a, b in zip(decoded, expected)) / max(len(expected), 1)
+    return difflib.SequenceMatcher(None, decoded, expected, autojunk=False).ratio()
+
+
+def run_benchmark(decoder_class: typing.Type[DecoderBase], score_cutoff: int,
+                  samples: typing.List[typing.Tuple[str, bytes]], chapters: typing.List[CorpusChapter]) -> \
+        BenchmarkResult:
+    # a subclass so that the cutoff of the real decoder class isn't touched
+    decoder_class = type(decoder_class.__name__, (decoder_class,), {'SCORE_CUTOFF': score_cutoff})
+    glyph_dictionary = GlyphDictionary(decoder_class)
+    glyph_dictionary.add_fonts(samples)
+    result = BenchmarkResult(decoder_class, score_cutoff)
+
+    for chapter in chapters:
+        start = time.perf_counter()
+        content_info = ContentInfo.from_content_info(chapter.content)
+        decoder = glyph_dictionary.create_decoder(content_info.get_font())
+        result.stage_times['font parse'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        trans_map, order_map, unknown_glyphs = decoder._build_map(render_unknown=False)
+        result.stage_times['map build'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        obfuscated_text = content_info.unscramble_fast()
+        result.stage_times['unscramble'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = obfuscated_text.translate(trans_map)
+        result.stage_times['translate'] += time.perf_counter() - start
+
+        result.chars += len(decoded)
+        result.unknown_glyphs += len(unknown_glyphs)
+        if chapter.expected is not None:
+            result.scored_chapters += 1
+            result.accuracy_total += score(decoded, chapter.expected)
+    return result
+
+
+def print_result(result: BenchmarkResult):
+    accuracy = 'n/a' if result.accuracy is None else f'{result.accuracy * 100:.2f}%'
+    chars_per_second = result.chars / result.total_time if result.total_time else 0
+    stages = '  '.join(f'{stage}: {result.stage_times[stage]:.3f}s' for stage in STAGES)
+    print(f'{result.decoder_class.__name__:<22} cutoff {result.score_cutoff:<4} {chars_per_second:>12,.0f} chars/s  '
+          f'accuracy {accuracy:>8}  unknown glyphs {result.unknown_glyphs:<5} {stages}')
+
+
+def export_cache(cache_dir: typing.Optional[str], corpus: str):
+    """Copies the chapters the bot bought as corpus chapters, the expected text has to be added by hand
+        :arg cache_dir a directory of the old pickle cache, None reads the chapter content store"""
+    chapters_dir = os.path.join(corpus, 'chapters')
+    os.makedirs(chapters_dir, exist_ok=True)
+    os.makedirs(os.path.join(corpus, 'samples'), exist_ok=True)
+    exported = 0
+    for file_name, chapter in iter_cached_chapters(cache_dir):
+        if chapter.encrypt_type != 2:
+            continue
+        with open(os.path.join(chapters_dir, f'{file_name}.content'), 'w', encoding='utf-8') as file:
+            file.write(chapter.content)
+        exported += 1
+    print(f'{exported} chapters exported to {chapters_dir}')
+
+
+def main(arguments: typing.List[str]) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.decoder_benchmark')
+    parser.add_argument('--corpus', default='decoder_corpus')
+    parser.add_argument('--cutoffs', default=None,
+                        help='comma separated SCORE_CUTOFF values to try, defaults to the one of each decoder')
+    parser.add_argument('--export-cache', nargs='?', const='', default=None, metavar='CACHE_DIR',
+                        help='exports the chapter content store, or the given pickle directory, into the corpus')
+    args = parser.parse_args(arguments)
+
+    if args.export_cache is not None:
+        export_cache(args.export_cache or None, args.corpus)
+        return 0
+
+    samples = load_samples(args.corpus)
+    chapters = load_chapters(args.corpus)
+    print(f'{len(samples)} sample fonts, {len(chapters)} chapters '
+          f'({sum(chapter.expected is not None for chapter in chapters)} with expected text)')
+    for decoder_class in DECODERS:
+        if args.cutoffs is None:
+            cutoffs = [decoder_class.SCORE_CUTOFF]
+        else:
+            cutoffs = [int(cutoff) for cutoff in args.cutoffs.split(',')]
+        for cutoff in cutoffs:
+            print_result(run_benchmark(decoder_class, cutoff, samples, chapters))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
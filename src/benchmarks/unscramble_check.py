@@ -0,0 +1,44 @@
+"""Checks that ContentInfo.unscramble_fast gives the same text as the BeautifulSoup unscramble on recorded chapters and
+compares their speed. The chapters are read from the chapter content store unless a pickle directory is given.
+
+Run it from the src directory, same as the launcher:  python -m benchmarks.unscramble_check [chapters directory]
+"""
+import sys
+import time
+
+from dependencies.webnovel.web.font_decoder.utils import ContentInfo
+from .cached_chapters import iter_cached_chapters
+
+
+def main(directory: str = None) -> int:
+    mismatches = 0
+    checked = 0
+    soup_time = 0.0
+    fast_time = 0.0
+    for file_name, chapter in iter_cached_chapters(directory):
+        try:
+            content_info = ContentInfo.from_content_info(chapter.content)
+        except (IndexError, KeyError, ValueError):
+            # not an obfuscated chapter
+            continue
+
+        start = time.perf_counter()
+        expected = content_info.unscramble()
+        soup_time += time.perf_counter() - start
+        start = time.perf_counter()
+        result = content_info.unscramble_fast()
+        fast_time += time.perf_counter() - start
+
+        checked += 1
+        if result != expected:
+            mismatches += 1
+            print(f"MISMATCH {file_name}")
+
+    print(f"{checked} chapters checked, {mismatches} mismatches")
+    if checked:
+        print(f"unscramble: {soup_time:.3f}s  unscramble_fast: {fast_time:.3f}s")
+    return mismatches
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main(*sys.argv[1:]) else 0)
@@ -49,7 +49,8 @@ class Raider(commands.AutoShardedBot):
                          help_command=commands.DefaultHelpCommand(dm_help=True, width=120))
         self.bot_token = self.config.bot_token
         self.db = Database(self.config.db_host, self.config.db_name, self.config.db_user, self.config.db_password,
-                           self.config.db_port, self.config.min_db_conns, self.config.max_db_conns, loop=self.loop)
+                           self.config.db_port, self.config.min_db_conns, self.config.max_db_conns, loop=self.loop,
+                           slow_query_threshold=self.config.db_slow_query_threshold)
 
         self.uptime: datetime.datetime = datetime.datetime.now()
 
@@ -272,6 +273,7 @@ class Raider(commands.AutoShardedBot):
         """
         await super().close()
         await self.session.close()
+        await self.db.close()
 
     # probably won't be manually implemented
     def run(self):
@@ -199,6 +199,57 @@ class BackgroundManager(commands.Cog):
                                          ('Accounts', f"{accounts_count[0]}/{accounts_count[1]}"))
         await ctx.send(embed=embed)
 
+    @bot_checks.check_permission_level(5)
+    @commands.command(aliases=['dbstats'],
+                      brief='Retrieves the query timings and pool usage of the bot db, or the background one if '
+                            '"background" is given')
+    async def db_stats(self, ctx: Context, source: str = 'bot'):
+        if source.lower() == 'background':
+            try:
+                database_status = await self.background_process_interface.request_database_status()
+            except TimeoutError:
+                await ctx.send("Timeout Error!! The background process never answered the db stats request....")
+                return
+        else:
+            database_status = DatabaseStatus(0)
+            database_status.load_profiler(self.db.profiler)
+
+        uptime = datetime.datetime.now() - datetime.datetime.fromtimestamp(database_status.started)
+        uptime_str = str(uptime)[:str(uptime).find('.')]
+        fields = [('Pool', f"busy: {database_status.busy_connections}/{database_status.max_connections}\n"
+                           f"peak: {database_status.peak_busy_connections}\n"
+                           f"saturated acquires: {database_status.saturated_acquires}/{database_status.acquires}"),
+                  ('Measuring For', uptime_str)]
+        for method_stats in database_status.methods[:20]:
+            fields.append((method_stats.name, f"calls: {method_stats.calls} | errors: {method_stats.errors}\n"
+                                              f"avg: {method_stats.average_time * 1000:.1f}ms | "
+                                              f"p95: <{method_stats.percentile(95) * 1000:.0f}ms | "
+                                              f"max: {method_stats.max_time * 1000:.1f}ms\n"
+                                              f"rows: {method_stats.rows} | "
+                                              f"pool wait: {method_stats.pool_wait_time * 1000:.1f}ms"))
+        embed = bot_utils.generate_embed(f'Database Stats ({source.lower()})', ctx.author, *fields)
+        await ctx.send(embed=embed)
+
+        if len(database_status.slow_queries) != 0:
+            slow_queries_str = '\n'.join(str(slow_query) for slow_query in database_status.slow_queries[-5:])
+            await ctx.send(f"Last slow queries:\n```{slow_queries_str[:1900]}```")
+
+    @bot_checks.check_permission_level(4)
+    @commands.command(brief='Lists the bought chapters the background decoder is holding back because of unknown '
+                            'glyphs, use buy_decode_id on one of them to teach the glyphs')
+    async def undecoded(self, ctx: Context):
+        try:
+            undecoded_status = await self.background_process_interface.request_undecoded_chapters()
+        except TimeoutError:
+            await ctx.send("Timeout Error!! The background process never answered the undecoded chapters request....")
+            return
+        if len(undecoded_status.chapters) == 0:
+            await ctx.send("There are no chapters waiting to be decoded")
+            return
+        lines = [f"book id: `{book_id}` | chapter id: `{chapter_id}` | index: `{index}` | unknown glyphs: `{unknown}`"
+                 for book_id, chapter_id, index, unknown in undecoded_status.chapters]
+        await ctx.send('\n'.join(lines)[:1900])
+
     def inner_services_cache_updater(self, services_status_object: AllServicesStatus):
         for service in services_status_object.services:
             self.services_ids.append(service.service_id)
@@ -346,7 +397,7 @@ class BackgroundManager(commands.Cog):
         print('trying to retrieve buyer account')
         # account = await self.db.retrieve_buyer_account()
         # print(True)
-        await self.db.release_accounts_over_five_in_use_minutes()
+        await self.db.release_expired_leases()
         print('released extra accounts')
 
     @commands.command(hidden=True)
@@ -1,9 +1,8 @@
 import asyncio
 import io
 import re
-import os
-import pickle
 import typing
+import zlib
 from typing import Union, List, Tuple, Dict, Optional
 
 import discord
@@ -12,6 +11,7 @@ from discord.ext import commands
 from discord.ext.commands import Context
 
 from bot.bot_utils import generate_embed, emoji_selection_detector, text_response_waiter
+from dependencies.chapter_store import ChapterContentStore
 from dependencies.database import database_exceptions, Database
 from dependencies.utils import generic_buyer, generic_buyer_obj, paste_generator
 from dependencies.webnovel.classes import SimpleBook, Book, Chapter, QiAccount
@@ -19,8 +19,11 @@ from dependencies.webnovel.utils import book_string_to_book_id
 from dependencies.webnovel.web.book import full_book_retriever, generate_thumbnail_url_or_file, trail_read_books_finder, chapter_retriever
 from . import bot_checks
 
-from dependencies.webnovel.web.font_decoder import decoder as font_decoder_module
 from dependencies.webnovel.web.font_decoder import utils as font_utilities
+from dependencies.webnovel.web.font_decoder.batch_decoder import FontDecodeResult, decode_chapters
+from dependencies.webnovel.web.font_decoder.decode_executor import DecodeExecutor
+from dependencies.webnovel.web.font_decoder.font_cache import FontDecodeCache
+from dependencies.webnovel.web.font_decoder.glyph_dictionary import GlyphDictionary
 
 NUMERIC_EMOTES = ['1⃣', '2⃣', '3⃣', '4⃣', '5⃣', '6⃣', '7⃣', '8⃣', '9⃣', '0⃣']
 
@@ -76,14 +79,22 @@ class QiCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.db: Database = bot.db
-        self.font_cache = []
+        self.glyph_dictionary = GlyphDictionary()
+        self.font_decode_cache = FontDecodeCache(self.db)
+        self.decode_executor = DecodeExecutor(self.glyph_dictionary)
         self.letters_bitwise = {}
         self.retrieved_dataset = False
         self.being_retrieved = False
-        try:
-            os.mkdir("chapters")
-        except FileExistsError:
-            pass
+        self.chapter_store = ChapterContentStore(self.db)
+
+    async def load_chapter_store(self):
+        """Loads the keys of the stored chapters, the first time the old chapters directory is moved into the store"""
+        if self.chapter_store.loaded:
+            return
+        imported = await self.chapter_store.import_pickle_directory("chapters")
+        if imported:
+            print(f"{imported} chapters imported from the chapters directory into the chapter content store")
+        await self.chapter_store.load()
 
     async def __interactive_book_chapter_string_to_book(self, ctx: Context, book_string: str, limit: int = 5
                                                         ) -> Union[SimpleBook, None]:
@@ -197,12 +208,87 @@ class QiCommands(commands.Cog):
             await ctx.send(error_msg)
 
 
+    def cog_unload(self):
+        self.decode_executor.shutdown()
+
+    async def load_glyph_dictionary(self):
+        """Loads the glyph dictionary saved on disk and adds to it the fonts of the db it doesn't know yet"""
+        self.glyph_dictionary.load()
+        fonts = await self.db.retrieve_top_50_fonts()
+        if self.glyph_dictionary.add_fonts(fonts) > 0:
+            self.glyph_dictionary.save()
+        self.decode_executor.refresh_dictionary()
+
+    async def __learn_font_glyphs(self, ctx: Context, font: FontDecodeResult, books: Dict[int, SimpleBook]) -> bool:
+        """Asks for the glyphs of the font that couldn't be matched and, once confirmed, saves the font so that they are
+        known for future chapters. The learned glyphs apply to every chapter of the batch using the font
+            :returns True if the font is now fully decoded"""
+        letters_to_be_added = []
+        await ctx.send("There are some things I don't know how to read :( Could you help me?")
+        for order_num, (char, image_obj) in font.unknown_glyphs.items():
+            image_obj.seek(0)
+            message = await ctx.send("Please reply me what character this image is, **This is CASE SENSITIVE**",
+                                     file=discord.File(image_obj, "image.png"))
+            char_message = await text_response_waiter(ctx, message, 180)
+            if char_message is None:
+                await ctx.send("Did not receive an answer, will skip the chapters using this font")
+                return False
+            letters_to_be_added.append((order_num, image_obj, char_message.clean_content))
+        await ctx.send("You told me the following images are the following: ")
+        for order_num, image_obj, char in letters_to_be_added:
+            image_obj.seek(0)
+            await ctx.send(char, file=discord.File(image_obj, "image.png"))
+        message = await ctx.send("Reply to this message with `yes` if you are sure so that I can "
+                                 "save this for future chapters")
+        confirmation = await text_response_waiter(ctx, message, 120)
+        if confirmation is None:
+            await ctx.send("Did not receive confirmation, will skip the chapters using this font")
+            return False
+        if confirmation.clean_content.lower() != "yes":
+            for chapter_decode in font.chapters:
+                chapter = chapter_decode.chapter
+                await ctx.send(f"Received negative confirmation, ignoring chapter {chapter.index} of "
+                               f"{books[chapter.parent_id].name}.")
+            return False
+
+        await ctx.send("Learning new letters......")
+        for order_num, image_obj, char in letters_to_be_added:
+            font.learn(order_num, char)
+        order_nums = list(font.order_map.keys())
+        order_nums.sort()
+        letters_to_join = []
+        for x in order_nums:
+            letters_to_join.append(font.order_map[x])
+        font_letters = ''.join(letters_to_join)
+        bitwise_letters = list(self.letters_bitwise.keys())
+        bitwise_values = list(self.letters_bitwise.values())
+        font_num = 0
+        for char in letters_to_join:
+            if char in bitwise_letters:
+                font_num = font_num | self.letters_bitwise[char]
+            else:
+                starting_num = 1
+                while True:
+                    if starting_num not in bitwise_values:
+                        self.letters_bitwise[char] = starting_num
+                        await self.db.insert_new_char_bitwise(starting_num, char)
+                        bitwise_values.append(starting_num)
+                        break
+                    else:
+                        starting_num = starting_num << 1
+                font_num = font_num | starting_num
+        await self.db.insert_new_font(font.font_bytes, font_num, font_letters, font.chapters[0].chapter.id)
+        self.glyph_dictionary.add_font(font.font_bytes, font_letters)
+        self.glyph_dictionary.save()
+        self.decode_executor.refresh_dictionary()
+        await self.font_decode_cache.store(font.font_bytes, font.trans_map, font.order_map)
+        return True
+
     @commands.command(aliases=['bd'])
     @bot_checks.is_whitelist()
     @bot_checks.check_permission_level(2)
     async def buy_decode(self, ctx: Context, *, user_input: str = None):
-        await self.db.release_accounts_over_five_in_use_minutes()
-        cache_chapters = os.listdir("chapters")
+        await self.load_chapter_store()
         chapters_from_cache = []
 
         if self.retrieved_dataset is False:
@@ -210,7 +296,7 @@ class QiCommands(commands.Cog):
                 await ctx.send("The data set is still being retrieved!!! Please Wait!!")
             else:
                 self.being_retrieved = True
-                self.font_cache = await self.db.retrieve_top_50_fonts()
+                await self.load_glyph_dictionary()
                 self.letters_bitwise = await self.db.retrieve_char_bitwise()
                 self.retrieved_dataset = True
 
@@ -260,7 +346,7 @@ class QiCommands(commands.Cog):
                 # divides in batches the chapters about to be bought
                 chap_objs_non_priv_non_cache = []
                 for chapter in chap_objs_non_priv:
-                    if f"{chapter.parent_id}_{chapter.id}" in cache_chapters:
+                    if self.chapter_store.has(chapter.parent_id, chapter.id):
                         chapters_from_cache.append(chapter)
                     else:
                         chap_objs_non_priv_non_cache.append(chapter)
@@ -300,101 +386,26 @@ class QiCommands(commands.Cog):
                 for chapter in list_:
                     if type(chapter) == Chapter:
                         chapters_to_decode.append(chapter)
-                        try:
-                            with open(f"chapters/{chapter.parent_id}_{chapter.id}", "wb") as file:
-                                file.write(pickle.dumps(chapter))
-                        except FileNotFoundError:
-                            os.makedirs("chapters")
-                            with open(f"chapters/{chapter.parent_id}_{chapter.id}", "wb") as file:
-                                file.write(pickle.dumps(chapter))
-
-        for chapter_to_load in chapters_from_cache:
-            with open(f"chapters/{chapter_to_load.parent_id}_{chapter_to_load.id}", "rb") as file:
-                chapters_to_decode.append(pickle.load(file))
+        await self.chapter_store.store(*chapters_to_decode)
+
+        chapters_to_decode.extend(await self.chapter_store.retrieve_many(
+            *[(chapter.parent_id, chapter.id) for chapter in chapters_from_cache]))
 
         await asyncio.gather(*async_tasks)
         async_tasks.clear()
         pastes = []
-        for chapter in chapters_to_decode:
-            content_info_helper = font_utilities.ContentInfo.from_content_info(chapter.content)
-            decoder = font_decoder_module.MetricsBasedDecoder(content_info_helper.get_font())
-            for font in self.font_cache:
-                font_file = io.BytesIO()
-                font_file.write(font[1])
-                font_file.seek(0)
-                decoder.add_sample(font_file, font[0])
-            obfs = content_info_helper.unscramble()
-            tl_map, order_map, unknown_glyphs = decoder._build_map()
-            book = await self.db.retrieve_simple_book(chapter.parent_id)
-            if len(unknown_glyphs) == 0:
-                decoded_content = obfs.translate(tl_map)
-                chapter.encrypt_type = 0
-                chapter.content = decoded_content
-                async_tasks.append(asyncio.create_task(paste_generator(book.name, chapter)))
-                # url = await privatebin.upload_to_privatebin(decoded_content)
-                # await ctx.send(url)
-            else:
-                letters_to_be_added = []
-                await ctx.send("There are some things I don't know how to read :( Could you help me?")
-                for order_num, (char, image_obj) in unknown_glyphs.items():
-                    image_obj.seek(0)
-                    message = await ctx.send("Please reply me what character this image is, **This is CASE SENSITIVE**",
-                                             file=discord.File(image_obj, "image.png"))
-                    char_message = await text_response_waiter(ctx, message, 180)
-                    letters_to_be_added.append((order_num, char, image_obj, char_message.clean_content,
-                                                content_info_helper.get_font()))
-                confirmation_list = [(char, image_obj) for order_num,
-                                     coded_char, image_obj, char, font_file in letters_to_be_added]
-                await ctx.send("You told me the following images are the following: ")
-                for (char, image_obj) in confirmation_list:
-                    image_obj.seek(0)
-                    await ctx.send(char, file=discord.File(image_obj, "image.png"))
-                message = await ctx.send("Reply to this message with `yes` if you are sure so that I can "
-                                         "save this for future chapters")
-                confirmation = await text_response_waiter(ctx, message, 120)
-                if confirmation is None:
-                    await ctx.send("Did not receive confirmation, will skip the chapter")
-                elif confirmation.clean_content.lower() == "yes":
-                    await ctx.send("Learning new letters......")
-                    for item_to_add in letters_to_be_added:
-                        order_map[item_to_add[0]] = item_to_add[3]
-                        tl_map[ord(item_to_add[1])] = item_to_add[3]
-                    order_nums = list(order_map.keys())
-                    order_nums.sort()
-                    letters_to_join = []
-                    for x in order_nums:
-                        letters_to_join.append(order_map[x])
-                    font_letters = ''.join(letters_to_join)
-                    bitwise_letters = list(self.letters_bitwise.keys())
-                    bitwise_values = list(self.letters_bitwise.values())
-                    font_num = 0
-                    for char in letters_to_join:
-                        if char in bitwise_letters:
-                            font_num = font_num | self.letters_bitwise[char]
-                        else:
-                            starting_num = 1
-                            while True:
-                                if starting_num not in bitwise_values:
-                                    self.letters_bitwise[char] = starting_num
-                                    await self.db.insert_new_char_bitwise(starting_num, char)
-                                    bitwise_values.append(starting_num)
-                                    break
-                                else:
-                                    starting_num = starting_num << 1
-                            font_num = font_num | starting_num
-                    font = content_info_helper.get_font()
-                    font.seek(0)
-                    font_bytes = font.read()
-                    await self.db.insert_new_font(font_bytes, font_num, font_letters, chapter.id)
-                    self.font_cache.append((font_letters, font_bytes))
-
-                    decoded_content = obfs.translate(tl_map)
-                    chapter.encrypt_type = 0
-                    chapter.content = decoded_content
-                    async_tasks.append(asyncio.create_task(paste_generator(book.name, chapter)))
-                else:
-                    await ctx.send(f"Received negative confirmation, ignoring chapter {chapter.index} of {book.name}.")
-                # print("There is an unknown glyph in the paste!!!!!")
+        chapter_decodes, incomplete_fonts = await decode_chapters(chapters_to_decode, self.decode_executor,
+                                                                  self.font_decode_cache)
+        for font in incomplete_fonts:
+            await self.__learn_font_glyphs(ctx, font, books_objs)
+        for chapter_decode in chapter_decodes:
+            if not chapter_decode.is_complete:
+                continue
+            chapter = chapter_decode.chapter
+            book = books_objs[chapter.parent_id]
+            chapter.encrypt_type = 0
+            chapter.content = chapter_decode.decoded_text()
+            async_tasks.append(asyncio.create_task(paste_generator(book.name, chapter)))
         pastes = await asyncio.gather(*async_tasks)
         async_tasks.clear()
         for paste in pastes:
@@ -424,7 +435,7 @@ class QiCommands(commands.Cog):
     @commands.command()
     @bot_checks.check_permission_level(4)
     async def release_accounts(self, ctx: Context):
-        await self.db.release_accounts_over_five_in_use_minutes()
+        await self.db.release_expired_leases()
         await ctx.send("accounts released!!!")
 
     @commands.command(aliases=['bdi'])
@@ -446,106 +457,26 @@ class QiCommands(commands.Cog):
                     await ctx.send("The data set is still being retrieved!!! Please Wait!!")
                 else:
                     self.being_retrieved = True
-                    self.font_cache = await self.db.retrieve_top_50_fonts()
+                    await self.load_glyph_dictionary()
                     self.letters_bitwise = await self.db.retrieve_char_bitwise()
                     self.retrieved_dataset = True
 
-            content_info_helper = font_utilities.ContentInfo.from_content_info(chapter.content)
-            decoder = font_decoder_module.MetricsBasedDecoder(content_info_helper.get_font())
-            for font in self.font_cache:
-                font_file = io.BytesIO()
-                font_file.write(font[1])
-                font_file.seek(0)
-                decoder.add_sample(font_file, font[0])
-            obfs = content_info_helper.unscramble()
-            tl_map, order_map, unknown_glyphs = decoder._build_map()
-
-            if len(unknown_glyphs) == 0:
-                decoded_content = obfs.translate(tl_map)
+            chapter_decodes, incomplete_fonts = await decode_chapters([chapter], self.decode_executor,
+                                                                      self.font_decode_cache)
+            for font in incomplete_fonts:
+                await self.__learn_font_glyphs(ctx, font, {book.id: book})
+            if chapter_decodes[0].is_complete:
                 chapter.encrypt_type = 0
-                chapter.content = decoded_content
+                chapter.content = chapter_decodes[0].decoded_text()
                 paste = await paste_generator(book.name, chapter)
                 await ctx.send(paste)
-                # url = await privatebin.upload_to_privatebin(decoded_content)
-                # await ctx.send(url)
-
-            else:
-                letters_to_be_added = []
-                await ctx.send("There are some things I don't know how to read :( Could you help me?")
-                for order_num, (char, image_obj) in unknown_glyphs.items():
-                    image_obj.seek(0)
-                    message = await ctx.send("Please reply me what character this image is, **This is CASE SENSITIVE**",
-                                             file=discord.File(image_obj, "image.png"))
-                    char_message = await text_response_waiter(ctx, message, 180)
-                    letters_to_be_added.append((order_num, char, image_obj, char_message.clean_content,
-                                                content_info_helper.get_font()))
-                confirmation_list = [(char, image_obj) for order_num,
-                                     coded_char, image_obj, char, font_file in letters_to_be_added]
-                await ctx.send("You told me the following images are the following: ")
-                for (char, image_obj) in confirmation_list:
-                    image_obj.seek(0)
-                    await ctx.send(char, file=discord.File(image_obj, "image.png"))
-                message = await ctx.send("Reply to this message with `yes` if you are sure so that I can "
-                                         "save this for future chapters")
-                confirmation = await text_response_waiter(ctx, message, 120)
-                if confirmation is None:
-                    await ctx.send("Did not receive confirmation, will skip the chapter")
-                elif confirmation.clean_content.lower() == "yes":
-                    await ctx.send("Learning new letters......")
-                    for item_to_add in letters_to_be_added:
-                        order_map[item_to_add[0]] = item_to_add[3]
-                        tl_map[ord(item_to_add[1])] = item_to_add[3]
-                    order_nums = list(order_map.keys())
-                    order_nums.sort()
-                    letters_to_join = []
-                    for x in order_nums:
-                        letters_to_join.append(order_map[x])
-                    font_letters = ''.join(letters_to_join)
-                    bitwise_letters = list(self.letters_bitwise.keys())
-                    bitwise_values = list(self.letters_bitwise.values())
-                    font_num = 0
-                    for char in letters_to_join:
-                        if char in bitwise_letters:
-                            font_num = font_num | self.letters_bitwise[char]
-                        else:
-                            starting_num = 1
-                            while True:
-                                if starting_num not in bitwise_values:
-                                    self.letters_bitwise[char] = starting_num
-                                    await self.db.insert_new_char_bitwise(starting_num, char)
-                                    bitwise_values.append(starting_num)
-                                    break
-                                else:
-                                    starting_num = starting_num << 1
-                            font_num = font_num | starting_num
-                    font = content_info_helper.get_font()
-                    font.seek(0)
-                    font_bytes = font.read()
-                    await self.db.insert_new_font(font_bytes, font_num, font_letters, chapter.id)
-                    self.font_cache.append((font_letters, font_bytes))
-
-                    decoded_content = obfs.translate(tl_map)
-                    chapter.encrypt_type = 0
-                    chapter.content = decoded_content
-                    paste = await paste_generator(book.name, chapter)
-                    await ctx.send(paste)
-                else:
-                    await ctx.send(f"Received negative confirmation, ignoring chapter {chapter.index} of {book.name}.")
 
     @commands.command()
     @bot_checks.check_permission_level(8)
     async def build_sample(self, ctx: Context):
-        chapters = os.listdir("chapters")
-        chapters_obj = []
+        await self.load_chapter_store()
+        chapters_obj = await self.chapter_store.retrieve_many(*self.chapter_store.keys(limit=5))
         fonts = []
-        if len(chapters) > 5:
-            for x in range(0, 5):
-                with open(f"chapters/{chapters[x]}", "rb") as file:
-                    chapters_obj.append(pickle.load(file))
-        else:
-            for chapter in chapters:
-                with open(f"chapters/{chapter}", "rb") as file:
-                    chapters_obj.append(pickle.load(file))
 
         for chapter in chapters_obj:
             util_obj = font_utilities.ContentInfo.from_content_info(chapter.content)
@@ -561,7 +492,7 @@ class QiCommands(commands.Cog):
                 if confirmation is None:
                     return
                 if confirmation.clean_content.lower() == 'yes':
-                    fonts.append((util_obj.get_font().read(), data.clean_content, chapter.id))
+                    fonts.append((util_obj.font_bytes, data.clean_content, chapter.id))
                     break
                 else:
                     await ctx.send("Aborting!! initiating the process again")
@@ -586,6 +517,9 @@ class QiCommands(commands.Cog):
                     number = number | starting_num
             await self.db.insert_new_font(individual_font_data[0], number, individual_font_data[1],
                                           individual_font_data[2])
+            self.glyph_dictionary.add_font(individual_font_data[0], individual_font_data[1])
+        self.glyph_dictionary.save()
+        self.decode_executor.refresh_dictionary()
         print("Sample Imported")
 
 
@@ -607,10 +541,13 @@ class QiCommands(commands.Cog):
     @commands.command()
     @bot_checks.check_permission_level(8)
     async def retrieve_cache_file(self, ctx: Context, book_id: int, chapter_id: int):
-        io_bytes = io.BytesIO()
-        with open(f"chapters/{book_id}_{chapter_id}", "rb") as file:
-            io_bytes.write(file.read())
-        io_bytes.seek(0)
+        await self.load_chapter_store()
+        raw_chapters = await self.chapter_store.retrieve_raw((book_id, chapter_id))
+        if (book_id, chapter_id) not in raw_chapters:
+            await ctx.send("That chapter isn't on the chapter content store")
+            return
+        # sent as the plain pickle the old cache files had
+        io_bytes = io.BytesIO(zlib.decompress(raw_chapters[(book_id, chapter_id)]))
         await ctx.send(file=discord.File(io_bytes, f"{book_id}_{chapter_id}"))
 
     @commands.command()
@@ -626,7 +563,7 @@ class QiCommands(commands.Cog):
         await ctx.send(f"Starting update of {len(accounts)}")
         for account in accounts:
             fp_count = account.fast_pass_count
-            await account.async_check_valid()
+            await account.async_check_valid(force=True)
             if fp_count != account.fast_pass_count:
                 await self.db.update_qi_account(account.guid, ticket=account.ticket, expired_status=account.expired,
                                                 fp_count=account.fast_pass_count, cookies=account.cookies)
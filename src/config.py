@@ -79,7 +79,7 @@ class ConfigReader:
         config['main bot'] = {'token': '', 'prefix': '!', 'description': 'A bot'}
         config['test bot'] = {'token': '', 'prefix': '?', 'description': 'A test bot'}
         config['database'] = {'host': '', 'name': '', 'user': '', 'port': '3306', 'password': '', 'min conns': '1',
-                              'max conns': '5'}
+                              'max conns': '5', 'slow query threshold': '0.5'}
         config['misc'] = {'use-test': 'False', 'auto-start-background': 'True'}
         with open('../settings.ini', 'w') as settings_file:
             config.write(settings_file)
@@ -101,6 +101,7 @@ class ConfigReader:
         self.db_port: int = literal_eval(db_section['port'])
         self.min_db_conns: int = literal_eval(db_section['min conns'])
         self.max_db_conns: int = literal_eval(db_section['max conns'])
+        self.db_slow_query_threshold: float = literal_eval(db_section.get('slow query threshold', '0.5'))
 
     def __init__(self):
         """
@@ -121,4 +122,5 @@ class ConfigReader:
         self.db_password = ''
         self.min_db_conns = 0
         self.max_db_conns = 0
+        self.db_slow_query_threshold = 0.5
         self.__load_values_to_attribute()
@@ -0,0 +1,95 @@
+import asyncio
+import time
+import typing
+
+from .database import Database
+from .webnovel.classes import QiAccount
+
+
+class LibraryAccountMonitor:
+    """Keeps a working account ready for every account library type number of a library, along with warm standbys
+    that take its place as soon as it fails. The accounts are checked by refresh, which is meant to be awaited in the
+    background so that the library check itself only reads what is already known
+        :arg library_type the library whose accounts are monitored
+        :arg standbys_per_type accounts kept checked besides the one in use for each library type number
+        :arg max_age seconds a validity check is trusted for, None uses the account default"""
+
+    def __init__(self, database: Database, *, library_type: int = 1, standbys_per_type: int = 1,
+                 max_age: float = None):
+        self._database = database
+        self.library_type = library_type
+        self.standbys_per_type = standbys_per_type
+        self.max_age = max_age
+        self._active: typing.Dict[int, QiAccount] = {}
+        self._standbys: typing.Dict[int, typing.List[QiAccount]] = {}
+        self._library_types: typing.List[int] = []
+        self._refresh_lock = asyncio.Lock()
+        self.last_check = 0
+
+    async def _check(self, account: QiAccount) -> typing.Tuple[QiAccount, typing.Optional[bool]]:
+        """:returns the account and if it works, None when qi couldn't be asked"""
+        try:
+            return account, await account.async_check_valid(max_age=self.max_age)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Failed to check library account {account.guid}, error:  {e}, type:  {type(e)}")
+            return account, None
+
+    async def refresh(self):
+        """Checks the accounts of every library type number, the expired ones are marked as so and the working ones
+        become the accounts in use and their standbys"""
+        async with self._refresh_lock:
+            start, last = await self._database.retrieve_library_range(self.library_type)
+            accounts = await self._database.retrieve_library_accounts(self.library_type, self.standbys_per_type + 1)
+            results = await asyncio.gather(*[self._check(account) for account in accounts])
+
+            working_accounts: typing.Dict[int, typing.List[QiAccount]] = {}
+            for account, account_works in results:
+                if account_works is False:
+                    await self._database.expired_account(account, batch=True)
+                elif account_works:
+                    working_accounts.setdefault(account.library_type, []).append(account)
+            await self._database.flush_account_updates()
+
+            active = {}
+            standbys = {}
+            for library_type, type_accounts in working_accounts.items():
+                current = self._active.get(library_type)
+                # the account in use stays in use while it works, its session is already warm
+                type_accounts.sort(key=lambda account_: current is None or account_.guid != current.guid)
+                active[library_type] = type_accounts[0]
+                standbys[library_type] = type_accounts[1:]
+            self._active = active
+            self._standbys = standbys
+            self._library_types = list(range(start, last + 1))
+            self.last_check = time.time()
+
+            missing_types = self.missing_types()
+            if len(missing_types) != 0:
+                print(f"Library accounts degraded, no working account for the library types:  {missing_types}")
+
+    async def ensure_checked(self):
+        """Checks the accounts if they were never checked, so that the first library check has something to use"""
+        if self.last_check == 0:
+            await self.refresh()
+
+    def accounts(self) -> typing.Dict[int, QiAccount]:
+        """The account in use for every library type number that has a working one"""
+        return dict(self._active)
+
+    def missing_types(self) -> typing.List[int]:
+        return [library_type for library_type in self._library_types if library_type not in self._active]
+
+    def report_failure(self, account: QiAccount):
+        """Takes the account out of use and puts its first standby in its place, the next refresh decides if the
+        account is expired"""
+        account.invalidate_validity()
+        current = self._active.get(account.library_type)
+        if current is None or current.guid != account.guid:
+            return
+        standbys = self._standbys.get(account.library_type, [])
+        if len(standbys) != 0:
+            self._active[account.library_type] = standbys.pop(0)
+        else:
+            del self._active[account.library_type]
@@ -0,0 +1,98 @@
+import typing
+
+from .database import Database
+from .database.database_exceptions import NoAccountFound
+from .webnovel.classes import QiAccount
+
+T = typing.TypeVar('T')
+
+
+def pack_chapters(chapters: list, capacities: typing.List[typing.Tuple[T, int]], *,
+                  max_per_account: int = None) -> typing.Tuple[typing.List[typing.Tuple[T, list]], list]:
+    """Assigns the chapters to as few accounts as possible. Every account but the last one taken is the one with the
+    most room left, the last one is the smallest that still fits the remaining chapters so that the big accounts are
+    kept for later batches. Chapters are handed out in order so that each account gets a contiguous run of them
+        :arg capacities (account, fast passes it can spend) pairs, the account can be anything (accounts, pools...)
+        :arg max_per_account caps how many chapters are bought at the same time with one account
+        :returns the (account, chapters) assignments, in the order they were taken, and the chapters that didn't fit"""
+    available = []
+    for account, capacity in capacities:
+        if max_per_account is not None:
+            capacity = min(capacity, max_per_account)
+        if capacity > 0:
+            available.append((account, capacity))
+    available.sort(key=lambda item: item[1], reverse=True)
+
+    assignments = []
+    position = 0
+    while position < len(chapters) and len(available) != 0:
+        remaining = len(chapters) - position
+        fitting = [item for item in available if item[1] >= remaining]
+        if len(fitting) != 0:
+            chosen = min(fitting, key=lambda item: item[1])
+        else:
+            chosen = available[0]
+        available.remove(chosen)
+        taken = min(chosen[1], remaining)
+        assignments.append((chosen[0], chapters[position:position + taken]))
+        position += taken
+    return assignments, chapters[position:]
+
+
+async def lease_buyer_accounts(db: Database, fp_needed: int) -> typing.List[QiAccount]:
+    """Leases working accounts until their fast passes add up to the needed amount. Every leased account is checked
+    against qi, the expired ones are marked as such and the ones that turned out to have no fp are released
+        :raises NoAccountFound if there aren't enough fast passes, the accounts leased until then are released"""
+    accounts = []
+    missing_fp = fp_needed
+    while missing_fp > 0:
+        try:
+            leased_accounts = await db.retrieve_buyer_accounts(missing_fp)
+        except NoAccountFound:
+            for account in accounts:
+                await db.release_account(account, batch=True)
+            raise
+        for account in leased_accounts:
+            db_fp_count = account.fast_pass_count
+            working = await account.async_check_valid()
+            if not working:
+                await db.expired_account(account, batch=True)
+                continue
+            if account.validity_from_cache:
+                # the cached count can be older than the one another process or the farmer wrote to the db
+                account.fast_pass_count = db_fp_count
+            elif db_fp_count != account.fast_pass_count:
+                await db.update_account_fp_count(account.fast_pass_count, account, batch=True)
+            if account.fast_pass_count == 0 or missing_fp <= 0:
+                await db.release_account(account, batch=True)
+                continue
+            accounts.append(account)
+            missing_fp -= account.fast_pass_count
+    return accounts
+
+
+async def schedule_buys(db: Database, chapters: list, *, max_per_account: int = None) -> \
+        typing.List[typing.Tuple[QiAccount, list]]:
+    """Leases the accounts needed to buy the chapters and packs the chapters onto them, leased accounts that end up
+    without chapters are released right away
+        :raises NoAccountFound if there aren't enough fast passes for all the chapters"""
+    if len(chapters) == 0:
+        return []
+    accounts = await lease_buyer_accounts(db, len(chapters))
+    while True:
+        assignments, unassigned = pack_chapters(chapters, [(account, account.fast_pass_count) for account in accounts],
+                                                max_per_account=max_per_account)
+        if len(unassigned) == 0:
+            break
+        # the per account cap left chapters out, more accounts are needed
+        try:
+            accounts.extend(await lease_buyer_accounts(db, len(unassigned)))
+        except NoAccountFound:
+            for account in accounts:
+                await db.release_account(account, batch=True)
+            raise
+    used_accounts = {account.guid for account, _ in assignments}
+    for account in accounts:
+        if account.guid not in used_accounts:
+            await db.release_account(account, batch=True)
+    return assignments
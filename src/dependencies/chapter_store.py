@@ -0,0 +1,115 @@
+import asyncio
+import os
+import pickle
+import typing
+import zlib
+
+from .database import Database
+from .webnovel.classes import Chapter
+
+ChapterKey = typing.Tuple[int, int]
+
+
+def compress_chapter(chapter: Chapter) -> bytes:
+    return zlib.compress(pickle.dumps(chapter), 6)
+
+
+def decompress_chapter(data: bytes) -> Chapter:
+    return pickle.loads(zlib.decompress(data))
+
+
+class ChapterContentStore:
+    """Bought chapters kept on the CHAPTER_CONTENTS table, compressed and keyed by (book id, chapter id). The keys of
+    every stored chapter are held in memory so that checking if a chapter is stored doesn't need a query, load has to
+    be awaited once before that"""
+
+    def __init__(self, database: Database):
+        self._database = database
+        self._keys: typing.Set[ChapterKey] = set()
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key: ChapterKey) -> bool:
+        return key in self._keys
+
+    def has(self, book_id: int, chapter_id: int) -> bool:
+        return (book_id, chapter_id) in self._keys
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    async def load(self):
+        async with self._load_lock:
+            if self._loaded:
+                return
+            self._keys.update(await self._database.retrieve_chapter_content_keys())
+            self._loaded = True
+
+    async def store(self, *chapters: Chapter):
+        loop = asyncio.get_event_loop()
+        rows = []
+        for chapter in chapters:
+            data = await loop.run_in_executor(None, compress_chapter, chapter)
+            rows.append((chapter.parent_id, chapter.id, data))
+        if len(rows) == 0:
+            return
+        await self._database.insert_chapter_contents(*rows)
+        self._keys.update((book_id, chapter_id) for book_id, chapter_id, _ in rows)
+
+    async def retrieve_raw(self, *keys: ChapterKey) -> typing.Dict[ChapterKey, bytes]:
+        """The compressed data of the stored chapters among the given ones"""
+        keys = [key for key in keys if key in self._keys]
+        if len(keys) == 0:
+            return {}
+        rows = await self._database.retrieve_chapter_contents(*keys)
+        return {(book_id, chapter_id): data for book_id, chapter_id, data in rows}
+
+    async def retrieve_many(self, *keys: ChapterKey) -> typing.List[Chapter]:
+        """The stored chapters among the given ones, in the order the keys were given"""
+        raw_chapters = await self.retrieve_raw(*keys)
+        loop = asyncio.get_event_loop()
+        chapters = []
+        for key in keys:
+            if key in raw_chapters:
+                chapters.append(await loop.run_in_executor(None, decompress_chapter, raw_chapters.pop(key)))
+        return chapters
+
+    async def retrieve(self, book_id: int, chapter_id: int) -> typing.Optional[Chapter]:
+        chapters = await self.retrieve_many((book_id, chapter_id))
+        if len(chapters) == 0:
+            return None
+        return chapters[0]
+
+    def keys(self, limit: int = None) -> typing.List[ChapterKey]:
+        keys = sorted(self._keys)
+        if limit is not None:
+            keys = keys[:limit]
+        return keys
+
+    async def import_pickle_directory(self, directory: str = "chapters", batch_size: int = 100) -> int:
+        """Moves the chapters of the old one pickle per chapter cache into the store, the directory is renamed once
+        done so that it isn't imported again
+            :returns the number of chapters imported"""
+        if not os.path.isdir(directory):
+            return 0
+        await self.load()
+        imported = 0
+        batch = []
+        for file_name in os.listdir(directory):
+            with open(os.path.join(directory, file_name), "rb") as file:
+                chapter = pickle.load(file)
+            if (chapter.parent_id, chapter.id) in self._keys:
+                continue
+            batch.append(chapter)
+            if len(batch) >= batch_size:
+                await self.store(*batch)
+                imported += len(batch)
+                batch.clear()
+        await self.store(*batch)
+        imported += len(batch)
+        os.rename(directory, f"{directory}.imported")
+        return imported
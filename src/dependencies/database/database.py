@@ -4,25 +4,61 @@ import asyncio
 import json
 import time
 import typing
+import uuid
 from xdrlib import ConversionError
 
 import asyncpg
 
 from .database_exceptions import *
+from .migration_runner import apply_migrations
+from .profiling import ProfiledPool, QueryProfiler, profile_methods
+from .write_batcher import AccountWriteBatcher
 from ..proxy_classes import Proxy, DummyProxy
 from ..webnovel.classes import Chapter, Book, Volume, SimpleChapter, SimpleBook, SimpleComic, QiAccount, EmailAccount
 
-
+# an account is free when it isn't in use or when the lease of whoever was using it already expired
+ACCOUNT_AVAILABLE_CONDITION = '("IN_USE"=False OR "LEASE_EXPIRES_AT" < extract(epoch from now()))'
+DEFAULT_LEASE_TIME = 300
+# module level so that benchmarks/db_explain.py explains the same query texts
+ALL_BOOKS_PINGS_QUERY = '''SELECT "BOOK_ID", "USER_ID" FROM "BOOKS_PINGS_REQUESTS"'''
+USER_PINGS_QUERY = '''SELECT "BOOK_ID" FROM "BOOKS_PINGS_REQUESTS" WHERE "USER_ID"=$1'''
+CHAPTERS_FROM_INDEX_QUERY = '''SELECT "PRIVILEGE", "CHAPTER_ID", "INDEX", "VIP_LEVEL", "CHAPTER_NAME", "VOLUME"
+FROM "CHAPTERS" WHERE "BOOK_ID" = $1 AND "INDEX" BETWEEN $2 AND $3 ORDER BY "INDEX"'''
+LIBRARY_TYPE_ACCOUNT_QUERY = '''SELECT "ID", "EMAIL", "PASSWORD", "COOKIES", "TICKET", "EXPIRED", "UPDATED_AT", "FP",
+"LIBRARY_TYPE", "LIBRARY_PAGES", "MAIN_EMAIL", "GUID" FROM "QIACCOUNT"
+WHERE "LIBRARY_TYPE" = $1 AND "EXPIRED" = False'''
+# $1 fp needed, $2 max accounts, $3 lease id, $4 lease time
+BUYER_ACCOUNTS_QUERY = f'''WITH "CANDIDATES" AS (
+    SELECT "GUID", "FP" FROM "QIACCOUNT" WHERE {ACCOUNT_AVAILABLE_CONDITION} AND "EXPIRED"=False AND "FP" > 0
+    ORDER BY "FP" DESC LIMIT $2 FOR UPDATE SKIP LOCKED),
+"SELECTED" AS (
+    SELECT "GUID" FROM (SELECT "GUID", SUM("FP") OVER (ORDER BY "FP" DESC, "GUID") - "FP" AS "PREVIOUS_FP"
+                        FROM "CANDIDATES") AS "RUNNING"
+    WHERE "PREVIOUS_FP" < $1)
+UPDATE "QIACCOUNT" SET "IN_USE"=True, "USE_TIME"=extract(epoch from now()), "LEASE_ID"=$3,
+"LEASE_EXPIRES_AT"=extract(epoch from now()) + $4
+FROM "SELECTED" WHERE "QIACCOUNT"."GUID" = "SELECTED"."GUID"
+RETURNING "ID", "EMAIL", "PASSWORD", "COOKIES", "TICKET", "EXPIRED", "UPDATED_AT", "FP", "LIBRARY_TYPE",
+"LIBRARY_PAGES", "MAIN_EMAIL", "QIACCOUNT"."GUID", "OWNED", "LEASE_EXPIRES_AT"'''
+
+
+@profile_methods
 class Database:
     def __init__(self, database_host: str, database_name: str, database_user: str, database_password,
                  database_port: int = 5432, min_conns: int = 3, max_conns: int = 10,
-                 loop: asyncio.AbstractEventLoop = None):
+                 loop: asyncio.AbstractEventLoop = None, *, slow_query_threshold: float = 0.5,
+                 account_writes_delay: float = 1.0):
         # self.db_connections = {}
-        self._db_pool: asyncpg.pool.Pool
+        self._db_pool: ProfiledPool
         self._running = False
         self._database_data = {'dsn': f'postgres://{database_user}:{database_password}'
                                       f'@{database_host}:{database_port}/{database_name}', 'min_size': min_conns,
                                'max_size': max_conns}
+        self.profiler = QueryProfiler(max_conns, slow_query_threshold)
+        self._account_writes = AccountWriteBatcher()
+        self._account_writes_delay = account_writes_delay
+        self._account_writes_task: typing.Optional[asyncio.Task] = None
+        self._account_writes_lock = asyncio.Lock()
 
         self.loop = loop
         if self.loop is None:
@@ -32,7 +68,8 @@ class Database:
 
     async def __pool_starter__(self):
         try:
-            self._db_pool: asyncpg.pool.Pool = await asyncpg.create_pool(**self._database_data)
+            pool = await asyncpg.create_pool(**self._database_data)
+            self._db_pool = ProfiledPool(pool, self.profiler)
             self._running = True
             await self.__database_initializer__()
             print("connected to database")
@@ -51,12 +88,7 @@ class Database:
         print(data)
 
     async def __database_initializer__(self):
-        try:
-            with open('./dependencies/database/database_initialization.sql') as file:
-                query = file.read()
-                await self._db_pool.execute(query)
-        except FileNotFoundError:
-            print('Please run the the launcher with the repository as the working directory.')
+        await apply_migrations(self._db_pool)
 
     async def permission_retriever(self, *ids, with_name=False):
         await self.__init_check__()
@@ -271,9 +303,7 @@ class Database:
     async def get_chapter_objs_from_index(self, book_id: int, range_start: int, range_end: int) -> \
             typing.List[SimpleChapter]:
         await self.__init_check__()
-        query = f'''SELECT "PRIVILEGE", "CHAPTER_ID", "INDEX", "VIP_LEVEL", "CHAPTER_NAME", "VOLUME" 
-        FROM "CHAPTERS" WHERE "BOOK_ID" = $1 AND "INDEX" BETWEEN $2 AND $3 ORDER BY "INDEX"'''
-        chapters_records = await self._db_pool.fetch(query, book_id, range_start, range_end)
+        chapters_records = await self._db_pool.fetch(CHAPTERS_FROM_INDEX_QUERY, book_id, range_start, range_end)
         chapters = []
         for chapter_record in chapters_records:
             chapters.append(SimpleChapter(chapter_record[0], chapter_record[1], book_id, chapter_record[2],
@@ -281,32 +311,69 @@ class Database:
 
         return chapters
 
-    async def release_accounts_over_five_in_use_minutes(self):
+    async def release_expired_leases(self):
+        """Will mark as free the accounts whose lease expired. Checkouts already treat those accounts as free, so this
+        is only needed to clean up the in use flag"""
         await self.__init_check__()
-        release_query = '''UPDATE "QIACCOUNT" SET "IN_USE"=False 
-        WHERE (select extract(epoch from now())) - "USE_TIME" >=300'''
+        release_query = '''UPDATE "QIACCOUNT" SET "IN_USE"=False, "LEASE_ID"=NULL
+        WHERE "IN_USE"=True AND "LEASE_EXPIRES_AT" < extract(epoch from now())'''
         await self._db_pool.execute(release_query)
 
     async def retrieve_buyer_account(self) -> QiAccount:
         """Will retrieve an account for buying and should mark in the db either here or in sql that the account is being
          used to prevent a double count and attempting a buy when there aren't anymore fp"""
+        accounts = await self.retrieve_buyer_accounts(1, max_accounts=1)
+        return accounts[0]
+
+    async def retrieve_buyer_accounts(self, fp_needed: int, *, max_accounts: int = 10,
+                                      lease_time: int = DEFAULT_LEASE_TIME) -> typing.List[QiAccount]:
+        """Will lease and return, in a single statement, the fewest accounts (highest fp first) whose combined fp covers
+        the requested amount. Rows locked by a concurrent checkout are skipped instead of waited on and accounts whose
+        lease expired are considered free
+            :arg fp_needed the amount of fast passes the returned accounts should sum up to
+            :arg max_accounts the max amount of accounts that will be leased in this call
+            :arg lease_time seconds until the lease expires unless it is renewed with renew_account_leases
+            :raises NoAccountFound if no account with fp is available"""
         await self.__init_check__()
-        select_accounts_guid_with_fp_query = '''SELECT "GUID", "FP" FROM "QIACCOUNT" 
-        WHERE "IN_USE"=False and "EXPIRED"=False and "FP" > 0 order by "FP" DESC'''
-        accounts_with_fp_records = await self._db_pool.fetch(select_accounts_guid_with_fp_query)
-        accounts_with_fp_tuples = ((guid, fp) for guid, fp in accounts_with_fp_records)
-        # accounts_with_fp_tuples_sorted = accounts_with_fp_tuples.sort(key=itemgetter(1), reverse=True)
-        update_query = '''UPDATE "QIACCOUNT" SET "IN_USE"=True, "USE_TIME" = (select extract(epoch from now())) 
-        WHERE "GUID"=$1 and "IN_USE"=False'''
-        selected_account_guid = 0
-        for account_tuple in accounts_with_fp_tuples:
-            guid, fp = account_tuple
-            operation_status = await self._db_pool.execute(update_query, guid)
-            if operation_status == 'UPDATE 1':
-                selected_account_guid = guid
-                break
-
-        return await self.retrieve_specific_account(selected_account_guid)
+        lease_id = uuid.uuid4().hex
+        records = await self._db_pool.fetch(BUYER_ACCOUNTS_QUERY, max(fp_needed, 1), max_accounts, lease_id,
+                                            float(lease_time))
+        if len(records) == 0:
+            raise NoAccountFound
+        accounts = []
+        for record in records:
+            account = QiAccount(record[0], record[1], record[2], record[3], record[4], record[5], record[6], record[7],
+                                record[8], record[9], record[10], record[11], record[12])
+            account.lease_id = lease_id
+            account.lease_expires_at = record[13]
+            accounts.append(account)
+        accounts.sort(key=lambda account: account.fast_pass_count, reverse=True)
+        return accounts
+
+    async def renew_account_leases(self, *accounts: QiAccount, lease_time: int = DEFAULT_LEASE_TIME) -> \
+            typing.List[QiAccount]:
+        """Will push back the lease expiry of the given accounts, accounts without a lease are ignored
+            :returns the accounts whose lease was lost (expired and taken by someone else) and therefore not renewed"""
+        await self.__init_check__()
+        leased_accounts = [account for account in accounts if account.lease_id is not None]
+        if len(leased_accounts) == 0:
+            return []
+        query = '''UPDATE "QIACCOUNT" SET "IN_USE"=True, "LEASE_EXPIRES_AT"=extract(epoch from now()) + $3
+        FROM unnest($1::bigint[], $2::varchar[]) AS "LEASES"("LEASE_GUID", "LEASE_ID")
+        WHERE "GUID"="LEASES"."LEASE_GUID" AND "QIACCOUNT"."LEASE_ID"="LEASES"."LEASE_ID"
+        RETURNING "GUID", "LEASE_EXPIRES_AT"'''
+        query_args = ([account.guid for account in leased_accounts], [account.lease_id for account in leased_accounts],
+                      float(lease_time))
+        records = await self._db_pool.fetch(query, *query_args)
+        renewed = {record[0]: record[1] for record in records}
+        lost_leases = []
+        for account in leased_accounts:
+            if account.guid in renewed:
+                account.lease_expires_at = renewed[account.guid]
+            else:
+                account.lease_id = None
+                lost_leases.append(account)
+        return lost_leases
 
     async def insert_new_font(self, font: bytes, bitwise: int, letters_in_font: str, chapter_id: int):
         """Will insert a new font with its decoded and metadata to the db"""
@@ -333,6 +400,52 @@ class Database:
             return_list.append((row[1], row[0]))
         return return_list
 
+    async def retrieve_font_decode(self, font_hash: str, metrics_hash: str = None) -> \
+            typing.Optional[typing.Tuple[str, str]]:
+        """Will retrieve the json encoded (translation table, order map) stored for the font, looked up by the hash of
+        its bytes or, if given, by its metrics fingerprint. None if the font was never decoded"""
+        await self.__init_check__()
+        if metrics_hash is None:
+            query = '''SELECT "TRANS_MAP", "ORDER_MAP" FROM "FONT_DECODES" WHERE "FONT_HASH" = $1'''
+            record = await self._db_pool.fetchrow(query, font_hash)
+        else:
+            query = '''SELECT "TRANS_MAP", "ORDER_MAP" FROM "FONT_DECODES" WHERE "FONT_HASH" = $1 OR "METRICS_HASH" = $2
+            LIMIT 1'''
+            record = await self._db_pool.fetchrow(query, font_hash, metrics_hash)
+        if record is None:
+            return None
+        return record[0], record[1]
+
+    async def insert_font_decode(self, font_hash: str, metrics_hash: str, trans_map: str, order_map: str):
+        """Will store the json encoded translation table and order map of a font, already stored fonts are ignored"""
+        await self.__init_check__()
+        query = '''INSERT INTO "FONT_DECODES" ("FONT_HASH", "METRICS_HASH", "TRANS_MAP", "ORDER_MAP")
+        VALUES ($1, $2, $3, $4) ON CONFLICT ("FONT_HASH") DO NOTHING'''
+        await self._db_pool.execute(query, font_hash, metrics_hash, trans_map, order_map)
+
+    async def retrieve_chapter_content_keys(self) -> typing.List[typing.Tuple[int, int]]:
+        """Will retrieve the (book id, chapter id) of every chapter kept on the chapter content store"""
+        await self.__init_check__()
+        query = '''SELECT "BOOK_ID", "CHAPTER_ID" FROM "CHAPTER_CONTENTS"'''
+        records = await self._db_pool.fetch(query)
+        return [(record[0], record[1]) for record in records]
+
+    async def retrieve_chapter_contents(self, *keys: typing.Tuple[int, int]) -> \
+            typing.List[typing.Tuple[int, int, bytes]]:
+        """Will retrieve the compressed data of the given (book id, chapter id) chapters, missing ones are left out"""
+        await self.__init_check__()
+        query = '''SELECT "BOOK_ID", "CHAPTER_ID", "DATA" FROM "CHAPTER_CONTENTS" WHERE ("BOOK_ID", "CHAPTER_ID") IN 
+        (SELECT * FROM unnest($1::bigint[], $2::bigint[]))'''
+        records = await self._db_pool.fetch(query, [key[0] for key in keys], [key[1] for key in keys])
+        return [(record[0], record[1], record[2]) for record in records]
+
+    async def insert_chapter_contents(self, *rows: typing.Tuple[int, int, bytes]):
+        """Will store the (book id, chapter id, compressed data) rows, a chapter already stored is replaced"""
+        await self.__init_check__()
+        query = '''INSERT INTO "CHAPTER_CONTENTS" ("BOOK_ID", "CHAPTER_ID", "DATA") VALUES ($1, $2, $3) 
+        ON CONFLICT ("BOOK_ID", "CHAPTER_ID") DO UPDATE SET "DATA"=excluded."DATA"'''
+        await self._db_pool.executemany(query, rows)
+
     async def retrieve_char_bitwise(self) -> typing.Dict[str, int]:
         """Will retrieve all the char and its respective bitwise"""
         await self.__init_check__()
@@ -545,6 +658,19 @@ class Database:
             record = await self._db_pool.fetchrow(query, proxy_area_id)
             return Proxy(record[0], record[1], record[2], record[3], record[4], record[5], record[6], record[7])
 
+    async def retrieve_proxies(self, proxy_area_id: int, *, limit: int = None) -> typing.List[Proxy]:
+        """Will retrieve the working proxies of the given area, the ones with the lowest latency first
+            :arg limit if given no more than this many proxies are returned"""
+        await self.__init_check__()
+        query = '''SELECT "ID", "IP", "PORT", "TYPE", "UPTIME", "LATENCY", "SPEED", "REGION" FROM "PROXIES" WHERE 
+        "EXPIRED" = False AND "REGION" = $1 ORDER BY "LATENCY" LIMIT $2'''
+        list_of_records = await self._db_pool.fetch(query, proxy_area_id, limit)
+        proxies = []
+        for record in list_of_records:
+            proxies.append(Proxy(record[0], record[1], record[2], record[3], record[4], record[5], record[6],
+                                 record[7]))
+        return proxies
+
     async def retrieve_all_expired_proxies(self) -> typing.List[Proxy]:
         """Will retrieve all the proxies marked as expired from the db"""
         await self.__init_check__()
@@ -570,15 +696,78 @@ class Database:
         query_args = (new_download_speed, latency, proxy_id)
         await self._db_pool.execute(query, *query_args)
 
-    async def set_library_pages_number(self, account: QiAccount, pages_number: int):
-        """will update the total number of library pages in the given account"""
+    async def __delayed_account_writes_flush(self):
+        await asyncio.sleep(self._account_writes_delay)
+        try:
+            await self.flush_account_updates()
+        except asyncio.CancelledError as e:
+            raise e
+        except Exception as e:
+            print(f"Failed to flush the batched account updates, error:  {e}, type:  {type(e)}")
+            # the updates are back in the queue, they are tried again after another delay
+            self._account_writes_task = self.loop.create_task(self.__delayed_account_writes_flush())
+
+    async def queue_account_update(self, account: QiAccount, **columns):
+        """Will queue an update of the given QIACCOUNT columns to be written along with the other updates queued in the
+        same window, updates queued for the same account are merged with the latest value winning"""
+        await self.__account_write_queued(self._account_writes.add(account.guid, columns))
+
+    async def __account_write_queued(self, flush_now: bool):
+        if flush_now:
+            await self.flush_account_updates()
+        elif self._account_writes_task is None or self._account_writes_task.done():
+            self._account_writes_task = self.loop.create_task(self.__delayed_account_writes_flush())
+
+    async def flush_account_updates(self):
+        """Will write right away every queued account update, one executemany per set of updated columns. The flushes
+        are written one at a time so that an older value can't be committed over a newer one, and the updates go back
+        to the queue if the write fails"""
+        async with self._account_writes_lock:
+            pending = self._account_writes.pop()
+            queries = AccountWriteBatcher.build_queries(pending)
+            if len(queries) == 0:
+                return
+            try:
+                await self.__init_check__()
+                async with self._db_pool.acquire() as connection:
+                    connection: asyncpg.Connection
+                    async with connection.transaction():
+                        for query, query_args_list in queries:
+                            await connection.executemany(query, query_args_list)
+            except BaseException:
+                self._account_writes.restore(pending)
+                raise
+
+    async def close(self):
+        """Will write the queued account updates and close the connections"""
+        if self._account_writes_task is not None and not self._account_writes_task.done():
+            self._account_writes_task.cancel()
+        await self.flush_account_updates()
+        if self._running:
+            await self._db_pool.close()
+            self._running = False
+
+    async def set_library_pages_number(self, account: QiAccount, pages_number: int, *, batch: bool = False):
+        """will update the total number of library pages in the given account
+            :arg batch if true the update is queued and written with the next batch of account updates"""
+        if batch:
+            await self.queue_account_update(account, LIBRARY_PAGES=pages_number)
+            return
         await self.__init_check__()
         query = '''UPDATE "QIACCOUNT" SET "LIBRARY_PAGES"=$1 WHERE "GUID"=$2'''
         query_args = (pages_number, account.guid)
         await self._db_pool.execute(query, *query_args)
 
-    async def update_account_fp_count(self, fp_count: int, account: QiAccount, *, farm_update: bool = False):
-        """Will update the fp count of the respective account"""
+    async def update_account_fp_count(self, fp_count: int, account: QiAccount, *, farm_update: bool = False,
+                                      batch: bool = False):
+        """Will update the fp count of the respective account
+            :arg batch if true the update is queued and written with the next batch of account updates"""
+        if batch:
+            if farm_update:
+                await self.queue_account_update(account, FP=fp_count, LAST_CURRENCY_UPDATE_AT=time.time())
+            else:
+                await self.queue_account_update(account, FP=fp_count)
+            return
         await self.__init_check__()
         if farm_update:
             query = '''UPDATE "QIACCOUNT" SET "FP"=$1, "LAST_CURRENCY_UPDATE_AT"=$2 WHERE "GUID"=$3'''
@@ -591,9 +780,7 @@ class Database:
     async def retrieve_specific_library_type_number_account(self, library_type: int) -> QiAccount:
         """Will retrieve an account that has an specific library number assign"""
         await self.__init_check__()
-        query = '''SELECT "ID", "EMAIL", "PASSWORD", "COOKIES", "TICKET", "EXPIRED", "UPDATED_AT", "FP", "LIBRARY_TYPE",
-        "LIBRARY_PAGES", "MAIN_EMAIL", "GUID" FROM "QIACCOUNT" WHERE "LIBRARY_TYPE" = $1 AND "EXPIRED" = False'''
-        account_record = await self._db_pool.fetchrow(query, library_type)
+        account_record = await self._db_pool.fetchrow(LIBRARY_TYPE_ACCOUNT_QUERY, library_type)
         if account_record is None:
             raise NoEntryFoundInDatabaseError(f"No entry found for library type:  {library_type}")
         account = QiAccount(account_record[0], account_record[1], account_record[2], account_record[3],
@@ -632,18 +819,123 @@ class Database:
                                           record[7], record[8], record[9], record[10], record[11]))
         return accounts
 
+    async def retrieve_library_range(self, library_type: int) -> typing.Tuple[int, int]:
+        """Will retrieve the first and last account library type numbers of the given library"""
+        await self.__init_check__()
+        query = '''SELECT "STARTING_NUMBER", "LAST_NUMBER" FROM "LIBRARY_RANGES" WHERE "LIBRARY_TYPE" = $1'''
+        record = await self._db_pool.fetchrow(query, library_type)
+        if record is None:
+            raise NoEntryFoundInDatabaseError(f"No library range found for library type:  {library_type}")
+        return record[0], record[1]
+
+    async def retrieve_library_accounts(self, library_type: int, per_type: int) -> typing.List[QiAccount]:
+        """Will retrieve up to per_type non expired accounts for every account library type number of the given
+        library, the extra accounts are the standbys of the first one"""
+        await self.__init_check__()
+        query = '''SELECT "ID", "EMAIL", "PASSWORD", "COOKIES", "TICKET", "EXPIRED", "UPDATED_AT", "FP", "LIBRARY_TYPE",
+        "LIBRARY_PAGES", "MAIN_EMAIL", "GUID" FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY "LIBRARY_TYPE" ORDER BY "ID") AS "TYPE_RANK" FROM "QIACCOUNT"
+            WHERE "EXPIRED" = false AND "LIBRARY_TYPE" BETWEEN
+            (SELECT "STARTING_NUMBER" FROM "LIBRARY_RANGES" WHERE "LIBRARY_TYPE" = $1) AND
+            (SELECT "LAST_NUMBER" FROM "LIBRARY_RANGES" WHERE "LIBRARY_TYPE" = $1)) AS "LIBRARY_ACCOUNTS"
+        WHERE "TYPE_RANK" <= $2 ORDER BY "LIBRARY_TYPE", "TYPE_RANK"'''
+        records = await self._db_pool.fetch(query, library_type, per_type)
+        return [QiAccount(record[0], record[1], record[2], record[3], record[4], record[5], record[6], record[7],
+                          record[8], record[9], record[10], record[11]) for record in records]
+
     async def retrieve_account_for_farming(self):
         """Will retrieve an account that the last currency update was 24 hrs ago"""
-        query = '''SELECT "ID", "EMAIL", "PASSWORD", "COOKIES", "TICKET", "EXPIRED", "UPDATED_AT", "FP", "LIBRARY_TYPE",
-        "LIBRARY_PAGES", "MAIN_EMAIL", "GUID", "OWNED" FROM "QIACCOUNT"
+        query = f'''SELECT "ID", "EMAIL", "PASSWORD", "COOKIES", "TICKET", "EXPIRED", "UPDATED_AT", "FP",
+        "LIBRARY_TYPE", "LIBRARY_PAGES", "MAIN_EMAIL", "GUID", "OWNED" FROM "QIACCOUNT"
         WHERE (select extract(epoch from now())) - "LAST_CURRENCY_UPDATE_AT" >= 86400.0 and "EXPIRED" = False
-          and "IN_USE" = False and "OWNED" = True'''
+          and {ACCOUNT_AVAILABLE_CONDITION} and "OWNED" = True'''
         record = await self._db_pool.fetchrow(query)
         if record:
             return QiAccount(record[0], record[1], record[2], record[3], record[4], record[5], record[6], record[7],
                              record[8], record[9], record[10], record[11], record[12])
         return None
 
+    async def retrieve_accounts_for_farming(self, limit: int) -> typing.List[QiAccount]:
+        """Will retrieve up to limit accounts that the last currency update was 24 hrs ago, the ones waiting the longest
+        first"""
+        await self.__init_check__()
+        query = f'''SELECT "ID", "EMAIL", "PASSWORD", "COOKIES", "TICKET", "EXPIRED", "UPDATED_AT", "FP",
+        "LIBRARY_TYPE", "LIBRARY_PAGES", "MAIN_EMAIL", "GUID", "OWNED" FROM "QIACCOUNT"
+        WHERE (select extract(epoch from now())) - "LAST_CURRENCY_UPDATE_AT" >= 86400.0 and "EXPIRED" = False
+          and {ACCOUNT_AVAILABLE_CONDITION} and "OWNED" = True ORDER BY "LAST_CURRENCY_UPDATE_AT" LIMIT $1'''
+        records = await self._db_pool.fetch(query, limit)
+        return [QiAccount(record[0], record[1], record[2], record[3], record[4], record[5], record[6], record[7],
+                          record[8], record[9], record[10], record[11], record[12]) for record in records]
+
+    async def retrieve_fp_supply(self) -> typing.Tuple[int, int]:
+        """Will retrieve the fast passes held by the working accounts and how many of those accounts have any"""
+        await self.__init_check__()
+        query = '''SELECT COALESCE(SUM("FP"), 0), COUNT(*) FILTER (WHERE "FP" > 0) FROM "QIACCOUNT"
+        WHERE "EXPIRED" = False'''
+        record = await self._db_pool.fetchrow(query)
+        return int(record[0]), int(record[1])
+
+    async def retrieve_farming_due_times(self, horizon: float) -> typing.Tuple[int, typing.List[float]]:
+        """Will retrieve how many owned accounts can be farmed right now, and the times at which the ones farmed less
+        than 24 hrs ago become farmable again within the next horizon seconds"""
+        await self.__init_check__()
+        now = time.time()
+        query = '''SELECT "LAST_CURRENCY_UPDATE_AT" + 86400.0 FROM "QIACCOUNT" WHERE "EXPIRED" = False
+        AND "OWNED" = True AND "LAST_CURRENCY_UPDATE_AT" > $1 - 86400.0
+        AND "LAST_CURRENCY_UPDATE_AT" <= $1 - 86400.0 + $2 ORDER BY "LAST_CURRENCY_UPDATE_AT"'''
+        records = await self._db_pool.fetch(query, now, horizon)
+        due_query = '''SELECT COUNT(*) FROM "QIACCOUNT" WHERE "EXPIRED" = False AND "OWNED" = True
+        AND "LAST_CURRENCY_UPDATE_AT" <= $1 - 86400.0'''
+        due_now = await self._db_pool.fetchval(due_query, now)
+        return int(due_now), [record[0] for record in records]
+
+    async def record_farming_results(self, *, farmed: typing.List[typing.Tuple[QiAccount, int]],
+                                     expired: typing.List[QiAccount],
+                                     history: typing.List[typing.Tuple[int, int, int]]):
+        """Will write the results of a whole farming batch in a single transaction, the fp count and currency update
+        time of the farmed accounts, the expired accounts and the (guid, fp before, fp after) history rows. The account
+        updates queued by everything else are left to their own flush
+            :arg farmed (account, fp count) of the accounts that were farmed"""
+        farmed_at = time.time()
+        farming_updates = {account.guid: {'FP': fp_count, 'LAST_CURRENCY_UPDATE_AT': farmed_at}
+                           for account, fp_count in farmed}
+        for account in expired:
+            farming_updates[account.guid] = {'EXPIRED': True, 'IN_USE': False}
+        queries = AccountWriteBatcher.build_queries((farming_updates, {}))
+        if len(history) != 0:
+            history_query = '''INSERT INTO "FP_HISTORY" ("GUID", "FP_BEFORE", "FP_AFTER") VALUES ($1, $2, $3)'''
+            queries.append((history_query, history))
+        if len(queries) == 0:
+            return
+        await self.__init_check__()
+        # written along the batched flushes so that the two can't interleave their values for an account
+        async with self._account_writes_lock:
+            async with self._db_pool.acquire() as connection:
+                connection: asyncpg.Connection
+                async with connection.transaction():
+                    for query, query_args_list in queries:
+                        await connection.executemany(query, query_args_list)
+
+    async def retrieve_average_farm_gain(self, since: float) -> typing.Optional[float]:
+        """Will retrieve the average fast passes a farming run recorded after since gave, None if there is no record"""
+        await self.__init_check__()
+        query = '''SELECT AVG("FP_AFTER" - "FP_BEFORE") FROM "FP_HISTORY" WHERE "RECORDED_AT" >= $1'''
+        average = await self._db_pool.fetchval(query, since)
+        if average is None:
+            return None
+        return float(average)
+
+    async def count_paid_chapters_added_since(self, since: float, *, catalogue_window: float = 3600) -> int:
+        """Will count the paid, non privilege chapters of the tracked books found after since. The chapters have no
+        release date, so the ones found within catalogue_window seconds of the first chapters of their book are left
+        out, those are the back catalogue of a book that was just added and not new releases"""
+        await self.__init_check__()
+        query = '''SELECT COUNT(*) FROM "CHAPTERS" AS "FOUND_CHAPTERS"
+        WHERE "ADDED_AT" >= $1 AND "PRIVILEGE" = False AND "VIP_LEVEL" > 0
+        AND "ADDED_AT" > (SELECT MIN("ADDED_AT") FROM "CHAPTERS"
+                          WHERE "CHAPTERS"."BOOK_ID" = "FOUND_CHAPTERS"."BOOK_ID") + $2'''
+        return int(await self._db_pool.fetchval(query, since, float(catalogue_window)))
+
     async def retrieve_account_stats(self) -> typing.Tuple[typing.Tuple[int, int], int]:
         await self.__init_check__()
         account_stats_query = 'SELECT COUNT(*), SUM("FP") From "QIACCOUNT" WHERE "EXPIRED" = false '
@@ -670,8 +962,12 @@ class Database:
                                 account_record_obj[12])
         return account_obj
 
-    async def expired_account(self, account: QiAccount):
-        """will set an account cookies as expired"""
+    async def expired_account(self, account: QiAccount, *, batch: bool = False):
+        """will set an account cookies as expired
+            :arg batch if true the update is queued and written with the next batch of account updates"""
+        if batch:
+            await self.queue_account_update(account, EXPIRED=True, IN_USE=False)
+            return
         await self.__init_check__()
         query = 'UPDATE "QIACCOUNT" SET "EXPIRED"=TRUE, "IN_USE"=False WHERE "GUID"=$1'
         query_args = (account.guid,)
@@ -680,16 +976,38 @@ class Database:
     async def update_account_params(self, account: QiAccount):
         """will update the cookies, ticket, and expired status of the given account at the db"""
         await self.__init_check__()
+        # a queued expired flag written after this update would undo it
+        await self.flush_account_updates()
         query = f'UPDATE "QIACCOUNT" SET "COOKIES"=$1, "TICKET"=$2, "EXPIRED"=$3, ' \
                 f'"UPDATED_AT"={time.time()} WHERE "GUID"=$4'
         query_args = (json.dumps(account.cookies), account.ticket, account.expired, account.guid)
         await self._db_pool.execute(query, *query_args)
 
-    async def release_account(self, account: QiAccount):
-        """Will set an in use account as available again"""
+    async def update_account_cookies(self, account: QiAccount, *, batch: bool = False):
+        """Will update the cookies of the given account, used when the site refreshed them on a kept open session
+            :arg batch if true the update is queued and written with the next batch of account updates"""
+        if batch:
+            await self.queue_account_update(account, COOKIES=json.dumps(account.cookies))
+            return
         await self.__init_check__()
-        query = 'UPDATE "QIACCOUNT" SET "IN_USE"=FALSE WHERE "GUID"=$1'
-        query_args = (account.guid,)
+        query = 'UPDATE "QIACCOUNT" SET "COOKIES"=$1 WHERE "GUID"=$2'
+        query_args = (json.dumps(account.cookies), account.guid)
+        await self._db_pool.execute(query, *query_args)
+
+    async def release_account(self, account: QiAccount, *, batch: bool = False):
+        """Will set an in use account as available again, only if it still holds the lease it was given. An account
+        whose lease expired may already be leased by someone else, which must keep it
+            :arg batch if true the update is queued and written with the next batch of account updates"""
+        lease_id = account.lease_id
+        if lease_id is None:
+            return
+        account.lease_id = None
+        if batch:
+            await self.__account_write_queued(self._account_writes.add_release(account.guid, lease_id))
+            return
+        await self.__init_check__()
+        query = 'UPDATE "QIACCOUNT" SET "IN_USE"=FALSE, "LEASE_ID"=NULL WHERE "GUID"=$1 AND "LEASE_ID"=$2'
+        query_args = (account.guid, lease_id)
         await self._db_pool.execute(query, *query_args)
 
     async def retrieve_email_obj(self, *, id_: int = None, email_address: str = None):
@@ -710,8 +1028,7 @@ class Database:
 
     async def retrieve_all_books_pings(self) -> typing.Union[typing.Dict[int: int], None]:
         """Will retrieve all the books ids that have users requesting to be pinged about an update"""
-        query = '''SELECT "BOOK_ID", "USER_ID" FROM "BOOKS_PINGS_REQUESTS"'''
-        rows = await self._db_pool.fetch(query)
+        rows = await self._db_pool.fetch(ALL_BOOKS_PINGS_QUERY)
         if len(rows) == 0:
             return None
         return_dict = {}
@@ -727,8 +1044,7 @@ class Database:
 
     async def retrieve_user_pings(self, user_id: int):
         """Will retrieve all the books ids that the specific user is requesting to be pinged about an update"""
-        query = '''SELECT "BOOK_ID" FROM "BOOKS_PINGS_REQUESTS" WHERE "USER_ID"=$1'''
-        rows = await self._db_pool.fetch(query, user_id)
+        rows = await self._db_pool.fetch(USER_PINGS_QUERY, user_id)
         if len(rows) == 0:
             return None
         books_list = []
@@ -0,0 +1,76 @@
+import os
+import re
+import typing
+
+import asyncpg
+
+from .database_exceptions import DatabaseInitError
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+PAT_MIGRATION_FILE = re.compile(r'(\d+)_(\w+)\.sql')
+
+# arbitrary key used so that the bot and the background process never apply migrations at the same time
+MIGRATIONS_LOCK_KEY = 7_236_101
+
+CREATE_MIGRATIONS_TABLE_QUERY = '''CREATE TABLE IF NOT EXISTS "SCHEMA_MIGRATIONS"
+(
+    "VERSION"    int primary key,
+    "NAME"       varchar(100) not null,
+    "APPLIED_AT" double precision default extract(epoch from now()) not null
+)'''
+
+
+class Migration:
+    def __init__(self, version: int, name: str, path: str):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def __repr__(self):
+        return f'<MIGRATION (VERSION:{self.version}, NAME:{self.name})>'
+
+    def read_query(self) -> str:
+        with open(self.path) as file:
+            return file.read()
+
+
+def retrieve_migrations(directory: str = MIGRATIONS_DIRECTORY) -> typing.List[Migration]:
+    """Will return the migrations found on the directory ordered by their version number
+        :raises DatabaseInitError if two files share the same version number"""
+    migrations = {}
+    for file_name in os.listdir(directory):
+        match = PAT_MIGRATION_FILE.fullmatch(file_name)
+        if match is None:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise DatabaseInitError(f'Duplicated migration version {version}: {file_name} and '
+                                    f'{os.path.basename(migrations[version].path)}')
+        migrations[version] = Migration(version, match.group(2), os.path.join(directory, file_name))
+    return [migrations[version] for version in sorted(migrations)]
+
+
+async def apply_migrations(pool: asyncpg.pool.Pool, directory: str = MIGRATIONS_DIRECTORY) -> typing.List[Migration]:
+    """Will apply, in order and each one in its own transaction, every migration that isn't recorded in the
+    SCHEMA_MIGRATIONS table yet. Returns the list of migrations applied on this call"""
+    migrations = retrieve_migrations(directory)
+    applied_now = []
+    async with pool.acquire() as connection:
+        connection: asyncpg.Connection
+        await connection.execute('SELECT pg_advisory_lock($1)', MIGRATIONS_LOCK_KEY)
+        try:
+            await connection.execute(CREATE_MIGRATIONS_TABLE_QUERY)
+            records = await connection.fetch('SELECT "VERSION" FROM "SCHEMA_MIGRATIONS"')
+            applied_versions = {record[0] for record in records}
+            for migration in migrations:
+                if migration.version in applied_versions:
+                    continue
+                async with connection.transaction():
+                    await connection.execute(migration.read_query())
+                    await connection.execute('INSERT INTO "SCHEMA_MIGRATIONS" ("VERSION", "NAME") VALUES ($1, $2)',
+                                             migration.version, migration.name)
+                print(f'applied database migration {migration.version}: {migration.name}')
+                applied_now.append(migration)
+        finally:
+            await connection.execute('SELECT pg_advisory_unlock($1)', MIGRATIONS_LOCK_KEY)
+    return applied_now
@@ -1,8 +1,8 @@
 /*
-  DATABASE INITIALIZATION FILE FOR RAIDER
+  MIGRATION 0001:  initial tables
 
-  Used to verify all constraints and reinforce them
-  at the start up of the bot.
+  Former database initialization file for raider, only
+  applied once per database by the migration runner.
 
 */
 
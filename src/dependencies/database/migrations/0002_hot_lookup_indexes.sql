@@ -0,0 +1,47 @@
+/*
+  MIGRATION 0002:  indexes for the hot lookup columns
+
+  Chapter range lookups filter on the book id and index, buyer checkouts only
+  ever look at free, non expired accounts with fast passes left, the library
+  checker looks up accounts by library type, and the ping requests are looked
+  up by user.
+
+  These tables were created outside of the migrations, every statement on them
+  is skipped on a database that doesn't have the table.
+*/
+
+
+/*  TABLE:  CHAPTERS    */
+DO $$
+BEGIN
+    IF to_regclass('"CHAPTERS"') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS "CHAPTERS_BOOK_ID_INDEX_IDX"
+            ON "CHAPTERS" ("BOOK_ID", "INDEX");
+    END IF;
+END
+$$;
+
+/*  TABLE:  QIACCOUNT    */
+DO $$
+BEGIN
+    IF to_regclass('"QIACCOUNT"') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS "QIACCOUNT_AVAILABLE_FP_IDX"
+            ON "QIACCOUNT" ("FP" DESC, "GUID")
+            WHERE "IN_USE" = False AND "EXPIRED" = False AND "FP" > 0;
+
+        CREATE INDEX IF NOT EXISTS "QIACCOUNT_LIBRARY_TYPE_IDX"
+            ON "QIACCOUNT" ("LIBRARY_TYPE")
+            WHERE "EXPIRED" = False;
+    END IF;
+END
+$$;
+
+/*  TABLE:  BOOKS_PINGS_REQUESTS    */
+DO $$
+BEGIN
+    IF to_regclass('"BOOKS_PINGS_REQUESTS"') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS "BOOKS_PINGS_REQUESTS_USER_ID_IDX"
+            ON "BOOKS_PINGS_REQUESTS" ("USER_ID");
+    END IF;
+END
+$$;
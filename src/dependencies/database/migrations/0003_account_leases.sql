@@ -0,0 +1,30 @@
+/*
+  MIGRATION 0003:  account leases
+
+  Accounts checked out for buying now carry a lease id and an expiry time.
+  An account whose lease expired is free to be checked out again, which
+  replaces the periodic release of accounts in use for over five minutes.
+
+  Skipped on a database without the QIACCOUNT table, it was created outside of
+  the migrations.
+*/
+
+
+/*  TABLE:  QIACCOUNT    */
+DO $$
+BEGIN
+    IF to_regclass('"QIACCOUNT"') IS NOT NULL THEN
+        ALTER TABLE "QIACCOUNT" ADD COLUMN IF NOT EXISTS "LEASE_ID" varchar(32);
+        ALTER TABLE "QIACCOUNT" ADD COLUMN IF NOT EXISTS "LEASE_EXPIRES_AT" double precision default 0 not null;
+
+        -- keeps the five minutes limit for the accounts that were in use when the migration ran
+        UPDATE "QIACCOUNT" SET "LEASE_EXPIRES_AT" = COALESCE("USE_TIME", 0) + 300 WHERE "IN_USE" = True;
+
+        -- the lease expiry is evaluated at checkout, so "IN_USE" can't be part of the index predicate anymore
+        DROP INDEX IF EXISTS "QIACCOUNT_AVAILABLE_FP_IDX";
+        CREATE INDEX IF NOT EXISTS "QIACCOUNT_BUYABLE_FP_IDX"
+            ON "QIACCOUNT" ("FP" DESC, "GUID")
+            WHERE "EXPIRED" = False AND "FP" > 0;
+    END IF;
+END
+$$;
@@ -0,0 +1,22 @@
+/*
+  MIGRATION 0004:  font decode cache
+
+  Chapters are often served with the same obfuscation font. The translation
+  table and glyph order map found for a font are stored by the hash of the
+  font bytes, and by a fingerprint of its glyph metrics for fonts that only
+  differ in bytes.
+*/
+
+
+/*  TABLE:  FONT_DECODES    */
+CREATE TABLE IF NOT EXISTS "FONT_DECODES"
+(
+    "FONT_HASH"    varchar(40) primary key,
+    "METRICS_HASH" varchar(40)                                    not null,
+    "TRANS_MAP"    text                                           not null,
+    "ORDER_MAP"    text                                           not null,
+    "CREATED_AT"   double precision default extract(epoch from now()) not null
+);
+
+CREATE INDEX IF NOT EXISTS "FONT_DECODES_METRICS_HASH_IDX"
+    ON "FONT_DECODES" ("METRICS_HASH");
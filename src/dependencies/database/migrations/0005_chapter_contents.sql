@@ -0,0 +1,18 @@
+/*
+  MIGRATION 0005:  chapter content store
+
+  Chapters bought by the bot used to be pickled one file per chapter under
+  chapters/. They are now kept here, the pickled chapter compressed with
+  zlib, keyed by book and chapter id.
+*/
+
+
+/*  TABLE:  CHAPTER_CONTENTS    */
+CREATE TABLE IF NOT EXISTS "CHAPTER_CONTENTS"
+(
+    "BOOK_ID"    bigint                                         not null,
+    "CHAPTER_ID" bigint                                         not null,
+    "DATA"       bytea                                          not null,
+    "CREATED_AT" double precision default extract(epoch from now()) not null,
+    primary key ("BOOK_ID", "CHAPTER_ID")
+);
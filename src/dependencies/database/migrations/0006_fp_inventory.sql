@@ -0,0 +1,49 @@
+/*
+  MIGRATION 0006:  fast pass inventory
+
+  Every farming run records the fast passes of the account before and after
+  it, which gives the expected gain of farming an account. Chapters now carry
+  the time they were found, which gives how many paid chapters the tracked
+  books release per day. The chapters found before this migration keep 0.
+
+  CHAPTERS and QIACCOUNT were created outside of the migrations, the statements
+  on them are skipped on a database that doesn't have them.
+*/
+
+
+/*  TABLE:  FP_HISTORY    */
+CREATE TABLE IF NOT EXISTS "FP_HISTORY"
+(
+    "ID"          SERIAL primary key,
+    "GUID"        bigint                                         not null,
+    "FP_BEFORE"   int                                            not null,
+    "FP_AFTER"    int                                            not null,
+    "RECORDED_AT" double precision default extract(epoch from now()) not null
+);
+
+CREATE INDEX IF NOT EXISTS "FP_HISTORY_RECORDED_AT_IDX"
+    ON "FP_HISTORY" ("RECORDED_AT");
+
+/*  TABLE:  CHAPTERS    */
+DO $$
+BEGIN
+    IF to_regclass('"CHAPTERS"') IS NOT NULL THEN
+        ALTER TABLE "CHAPTERS" ADD COLUMN IF NOT EXISTS "ADDED_AT" double precision default 0 not null;
+        ALTER TABLE "CHAPTERS" ALTER COLUMN "ADDED_AT" SET DEFAULT extract(epoch from now());
+
+        CREATE INDEX IF NOT EXISTS "CHAPTERS_ADDED_AT_IDX"
+            ON "CHAPTERS" ("ADDED_AT");
+    END IF;
+END
+$$;
+
+/*  TABLE:  QIACCOUNT    */
+DO $$
+BEGIN
+    IF to_regclass('"QIACCOUNT"') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS "QIACCOUNT_FARMING_IDX"
+            ON "QIACCOUNT" ("LAST_CURRENCY_UPDATE_AT")
+            WHERE "EXPIRED" = False AND "OWNED" = True;
+    END IF;
+END
+$$;
@@ -0,0 +1,20 @@
+/*
+  MIGRATION 0007:  ping requests indexed by user
+
+  No query filters the ping requests by book alone, the only lookup is by
+  user. Databases that applied 0002 before it indexed the user get the index
+  here and lose the one on the book.
+*/
+
+
+/*  TABLE:  BOOKS_PINGS_REQUESTS    */
+DROP INDEX IF EXISTS "BOOKS_PINGS_REQUESTS_BOOK_ID_IDX";
+
+DO $$
+BEGIN
+    IF to_regclass('"BOOKS_PINGS_REQUESTS"') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS "BOOKS_PINGS_REQUESTS_USER_ID_IDX"
+            ON "BOOKS_PINGS_REQUESTS" ("USER_ID");
+    END IF;
+END
+$$;
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import bisect
+import contextvars
+import functools
+import inspect
+import time
+import typing
+from collections import deque
+
+import asyncpg
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket catches everything above
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_current_method: contextvars.ContextVar[str] = contextvars.ContextVar('database_method', default='unknown')
+
+
+class MethodStats:
+    """Aggregated timings of a single database method"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.pool_wait_time = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def add_call(self, elapsed: float, failed: bool):
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        self.histogram[bisect.bisect_left(HISTOGRAM_BUCKETS, elapsed)] += 1
+
+    def add_query(self, rows: int, pool_wait: float):
+        self.queries += 1
+        self.rows += rows
+        self.pool_wait_time += pool_wait
+
+    @property
+    def average_time(self) -> float:
+        if self.calls == 0:
+            return 0.0
+        return self.total_time / self.calls
+
+    def percentile(self, percent: float) -> float:
+        """Returns the upper bound of the histogram bucket where the given percentile falls"""
+        if self.calls == 0:
+            return 0.0
+        target = self.calls * percent / 100
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if seen >= target:
+                if index < len(HISTOGRAM_BUCKETS):
+                    return HISTOGRAM_BUCKETS[index]
+                return self.max_time
+        return self.max_time
+
+
+class SlowQuery:
+    def __init__(self, method: str, query: str, arguments: tuple, elapsed: float, pool_wait: float):
+        self.method = method
+        self.query = ' '.join(query.split())
+        # only the types of the arguments are kept so that cookies, passwords and the like never reach the log
+        self.arguments = tuple(f'${index + 1}=<{type(argument).__name__}>' for index, argument in enumerate(arguments))
+        self.elapsed = elapsed
+        self.pool_wait = pool_wait
+        self.time = time.time()
+
+    def __str__(self):
+        return f'{self.method} took {self.elapsed:.3f}s (pool wait {self.pool_wait:.3f}s):  {self.query}  ' \
+               f'[{", ".join(self.arguments)}]'
+
+
+class QueryProfiler:
+    """Keeps the per method latency stats, pool usage and the recent slow queries of a Database instance"""
+
+    def __init__(self, max_connections: int, slow_query_threshold: float = 0.5, slow_query_log_size: int = 50):
+        self.max_connections = max_connections
+        self.slow_query_threshold = slow_query_threshold
+        self.methods: typing.Dict[str, MethodStats] = {}
+        self.slow_queries: typing.Deque[SlowQuery] = deque(maxlen=slow_query_log_size)
+        self.busy_connections = 0
+        self.peak_busy_connections = 0
+        self.saturated_acquires = 0
+        self.acquires = 0
+        self.started = time.time()
+
+    def _method_stats(self, name: str) -> MethodStats:
+        stats = self.methods.get(name)
+        if stats is None:
+            stats = MethodStats(name)
+            self.methods[name] = stats
+        return stats
+
+    def record_call(self, name: str, elapsed: float, failed: bool):
+        self._method_stats(name).add_call(elapsed, failed)
+
+    def is_saturated(self) -> bool:
+        """True while every connection of the pool is checked out, an acquire made now has to wait"""
+        return self.busy_connections >= self.max_connections
+
+    def record_acquire(self, saturated: bool):
+        """:arg saturated if every connection of the pool was checked out when the acquire started, a wait for the pool
+        to open a new connection doesn't count"""
+        self.acquires += 1
+        if saturated:
+            self.saturated_acquires += 1
+        self.busy_connections += 1
+        if self.busy_connections > self.peak_busy_connections:
+            self.peak_busy_connections = self.busy_connections
+
+    def record_release(self):
+        self.busy_connections -= 1
+
+    def record_query(self, query: str, arguments: tuple, rows: int, elapsed: float, pool_wait: float):
+        method = _current_method.get()
+        self._method_stats(method).add_query(rows, pool_wait)
+        if elapsed + pool_wait >= self.slow_query_threshold:
+            slow_query = SlowQuery(method, query, arguments, elapsed, pool_wait)
+            self.slow_queries.append(slow_query)
+            print(f'Slow query: {slow_query}')
+
+    def reset(self):
+        self.methods.clear()
+        self.slow_queries.clear()
+        self.peak_busy_connections = self.busy_connections
+        self.saturated_acquires = 0
+        self.acquires = 0
+        self.started = time.time()
+
+    def return_sorted_methods(self, *, key: str = 'total_time') -> typing.List[MethodStats]:
+        return sorted(self.methods.values(), key=lambda stats: getattr(stats, key), reverse=True)
+
+
+def _rows_in_result(result) -> int:
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, str):
+        # status strings look like 'UPDATE 3' or 'INSERT 0 1'
+        last_word = result.rsplit(' ', maxsplit=1)[-1]
+        if last_word.isdigit():
+            return int(last_word)
+        return 0
+    if result is None:
+        return 0
+    return 1
+
+
+class _ProfiledAcquire:
+    def __init__(self, profiled_pool: ProfiledPool, timeout: float = None):
+        self._profiled_pool = profiled_pool
+        self._timeout = timeout
+        self._connection = None
+        self.wait_time = 0.0
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        profiler = self._profiled_pool.profiler
+        # checked before waiting, once the connection is there the pool is no longer full. The wait time alone can't
+        # tell saturation apart from the pool opening a new connection, which takes longer than most waits
+        pool_full = profiler.is_saturated()
+        start = time.perf_counter()
+        self._connection = await self._profiled_pool.pool.acquire(timeout=self._timeout)
+        self.wait_time = time.perf_counter() - start
+        profiler.record_acquire(pool_full)
+        return self._connection
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            await self._profiled_pool.pool.release(self._connection)
+        finally:
+            self._profiled_pool.profiler.record_release()
+
+
+class ProfiledPool:
+    """Thin wrapper over an asyncpg pool that times every query it runs and keeps track of how many connections are
+    checked out. Anything not redefined here is forwarded to the wrapped pool"""
+
+    def __init__(self, pool: asyncpg.pool.Pool, profiler: QueryProfiler):
+        self.pool = pool
+        self.profiler = profiler
+
+    def __getattr__(self, item):
+        return getattr(self.pool, item)
+
+    def acquire(self, *, timeout: float = None) -> _ProfiledAcquire:
+        return _ProfiledAcquire(self, timeout)
+
+    async def _run(self, method_name: str, query: str, args: tuple, **kwargs):
+        acquire_context = self.acquire()
+        async with acquire_context as connection:
+            start = time.perf_counter()
+            result = await getattr(connection, method_name)(query, *args, **kwargs)
+            elapsed = time.perf_counter() - start
+        if method_name == 'executemany':
+            rows = len(args[0])
+        else:
+            rows = _rows_in_result(result)
+        self.profiler.record_query(query, args if method_name != 'executemany' else (), rows, elapsed,
+                                   acquire_context.wait_time)
+        return result
+
+    async def execute(self, query: str, *args, timeout: float = None) -> str:
+        return await self._run('execute', query, args, timeout=timeout)
+
+    async def executemany(self, command: str, args, *, timeout: float = None):
+        return await self._run('executemany', command, (args,), timeout=timeout)
+
+    async def fetch(self, query: str, *args, timeout: float = None) -> list:
+        return await self._run('fetch', query, args, timeout=timeout)
+
+    async def fetchrow(self, query: str, *args, timeout: float = None):
+        return await self._run('fetchrow', query, args, timeout=timeout)
+
+    async def fetchval(self, query: str, *args, column: int = 0, timeout: float = None):
+        return await self._run('fetchval', query, args, column=column, timeout=timeout)
+
+
+def profile_methods(cls):
+    """Class decorator that times every public coroutine method of the class and tags the queries they run with the
+    method name, so that the pool stats can be grouped per method. Expects instances to have a `profiler` attribute"""
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.iscoroutinefunction(method):
+            continue
+        setattr(cls, name, _profiled_method(name, method))
+    return cls
+
+
+def _profiled_method(name: str, method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        token = _current_method.set(name)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await method(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            self.profiler.record_call(name, time.perf_counter() - start, failed)
+            _current_method.reset(token)
+    return wrapper
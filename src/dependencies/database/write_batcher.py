@@ -0,0 +1,70 @@
+import typing
+
+# (column updates per guid, lease id to release per guid)
+PendingWrites = typing.Tuple[typing.Dict[int, typing.Dict[str, typing.Any]], typing.Dict[int, str]]
+
+
+class AccountWriteBatcher:
+    """Collects the small per account updates (fp count, release, expired, library pages, cookies) and coalesces them
+    per guid so that a whole window of them can be written with a single executemany per group of columns"""
+
+    # whitelist of the columns that can be batched, the query is built from these names
+    COLUMNS = ('FP', 'LAST_CURRENCY_UPDATE_AT', 'IN_USE', 'EXPIRED', 'LIBRARY_PAGES', 'COOKIES')
+
+    def __init__(self, max_pending: int = 200):
+        self.max_pending = max_pending
+        self._pending: typing.Dict[int, typing.Dict[str, typing.Any]] = {}
+        self._releases: typing.Dict[int, str] = {}
+
+    def __len__(self):
+        return len(self._pending.keys() | self._releases.keys())
+
+    def add(self, guid: int, columns: typing.Dict[str, typing.Any]) -> bool:
+        """Merges the given column values into the pending update of the account, later values win
+            :returns True when enough updates are pending that they should be flushed right away"""
+        for column in columns:
+            if column not in self.COLUMNS:
+                raise ValueError(f"Column {column!r} can't be batched")
+        self._pending.setdefault(guid, {}).update(columns)
+        return len(self) >= self.max_pending
+
+    def add_release(self, guid: int, lease_id: str) -> bool:
+        """Queues the release of the lease of the account, it is only written if the account still holds that lease so
+        that a holder whose lease expired can't free the account for whoever leased it after
+            :returns True when enough updates are pending that they should be flushed right away"""
+        self._releases[guid] = lease_id
+        return len(self) >= self.max_pending
+
+    def pop(self) -> PendingWrites:
+        """Empties the pending updates and returns them, give them back with restore if they couldn't be written"""
+        pending = (self._pending, self._releases)
+        self._pending = {}
+        self._releases = {}
+        return pending
+
+    def restore(self, pending: PendingWrites):
+        """Puts back updates that couldn't be written, the values queued since they were popped win"""
+        columns_updates, releases = pending
+        for guid, columns in columns_updates.items():
+            self._pending[guid] = {**columns, **self._pending.get(guid, {})}
+        for guid, lease_id in releases.items():
+            self._releases.setdefault(guid, lease_id)
+
+    @classmethod
+    def build_queries(cls, pending: PendingWrites) -> typing.List[typing.Tuple[str, typing.List[tuple]]]:
+        """The popped updates as (query, arguments list) pairs ready for an executemany, one pair per distinct set of
+        updated columns and one for the releases"""
+        columns_updates, releases = pending
+        groups: typing.Dict[typing.Tuple[str, ...], typing.List[tuple]] = {}
+        for guid, columns in columns_updates.items():
+            column_names = tuple(column for column in cls.COLUMNS if column in columns)
+            groups.setdefault(column_names, []).append((guid, *(columns[column] for column in column_names)))
+
+        queries = []
+        for column_names, arguments in groups.items():
+            set_clause = ', '.join(f'"{column}"=${index + 2}' for index, column in enumerate(column_names))
+            queries.append((f'UPDATE "QIACCOUNT" SET {set_clause} WHERE "GUID"=$1', arguments))
+        if len(releases) != 0:
+            queries.append(('UPDATE "QIACCOUNT" SET "IN_USE"=False, "LEASE_ID"=NULL WHERE "GUID"=$1 AND "LEASE_ID"=$2',
+                            list(releases.items())))
+        return queries
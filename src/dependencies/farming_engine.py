@@ -0,0 +1,120 @@
+import asyncio
+import random
+import time
+import typing
+
+from .database import Database
+from .session_manager import AccountSessionManager
+from .webnovel.classes import QiAccount
+from .webnovel.web import account
+
+
+class RateLimiter:
+    """Spaces out the requests made through it so that no more than rate of them start per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if self.interval == 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_slot - now
+            self._next_slot = max(self._next_slot, now) + self.interval
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+
+class FarmingResult:
+    def __init__(self, account_: QiAccount, fp_before: int = 0, fp_after: int = 0, expired: bool = False,
+                 error: Exception = None):
+        self.account = account_
+        self.fp_before = fp_before
+        self.fp_after = fp_after
+        self.expired = expired
+        self.error = error
+
+    @property
+    def farmed(self) -> bool:
+        return not self.expired and self.error is None
+
+
+class FarmingEngine:
+    """Farms the daily rewards of many accounts at once, with at most concurrency accounts being farmed at the same
+    time and no more than requests_per_second requests to qi. The results of a whole batch are written to the db in a
+    single transaction once it is done
+        :arg concurrency accounts farmed at the same time
+        :arg requests_per_second requests started per second over all the accounts"""
+
+    def __init__(self, database: Database, session_manager: AccountSessionManager, *, concurrency: int = 10,
+                 requests_per_second: float = 5):
+        self.db = database
+        self.session_manager = session_manager
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.energy_books = []
+        self.power_books = []
+        self.last_updated_books = 0
+
+    async def refresh_books(self):
+        if time.time() - self.last_updated_books >= 43200:
+            self.energy_books = await account.retrieve_energy_stone_books()
+            self.power_books = await account.retrieve_power_stone_books()
+            self.last_updated_books = time.time()
+
+    async def farm_account(self, account_to_farm: QiAccount) -> FarmingResult:
+        await self.rate_limiter.wait()
+        account_is_working = await account_to_farm.async_check_valid()
+        if account_is_working is False:
+            return FarmingResult(account_to_farm, expired=True)
+        fp_before = account_to_farm.fast_pass_count
+
+        async with self.session_manager.checkout(account_to_farm) as session:
+            await self.rate_limiter.wait()
+            claim_farmed, power_stone_farmed, energy_stone_farmed = await account.retrieve_farm_status(session=session)
+
+            if claim_farmed is False:
+                await self.rate_limiter.wait()
+                await account.claim_login(session=session)
+
+            if power_stone_farmed is False:
+                await self.rate_limiter.wait()
+                await account.claim_power_stone(book_id=random.choice(self.power_books), session=session)
+
+            if energy_stone_farmed is False:
+                await self.rate_limiter.wait()
+                await account.claim_energy_stone(book=random.choice(self.energy_books), session=session)
+
+            await self.session_manager.store_cookies(account_to_farm)
+
+        # the claims change the fp count, the cached one can't be used
+        await self.rate_limiter.wait()
+        await account_to_farm.async_check_valid(force=True)
+        return FarmingResult(account_to_farm, fp_before, account_to_farm.fast_pass_count)
+
+    async def farm(self, accounts: typing.List[QiAccount]) -> typing.List[FarmingResult]:
+        """Farms the accounts and writes every result with a single transaction, an account that failed keeps its
+        previous currency update time so that it is picked again later"""
+        await self.refresh_books()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited_farm(account_to_farm: QiAccount) -> FarmingResult:
+            async with semaphore:
+                try:
+                    return await self.farm_account(account_to_farm)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # the cached validity let the account through, the next farm has to ask qi again
+                    account_to_farm.invalidate_validity()
+                    return FarmingResult(account_to_farm, error=e)
+
+        results = await asyncio.gather(*[limited_farm(account_to_farm) for account_to_farm in accounts])
+        await self.db.record_farming_results(
+            farmed=[(result.account, result.fp_after) for result in results if result.farmed],
+            expired=[result.account for result in results if result.expired],
+            history=[(result.account.guid, result.fp_before, result.fp_after) for result in results if result.farmed])
+        return results
@@ -0,0 +1,110 @@
+import math
+import time
+import typing
+
+from .database import Database
+
+DAY = 86400
+
+
+class InventoryForecast:
+    """Fast pass supply and demand over the forecast horizon
+        :ivar supply fast passes held by the working accounts right now
+        :ivar demand fast passes the tracked books are expected to need within the horizon
+        :ivar farmable_now accounts that can be farmed right now
+        :ivar replenishment fast passes expected from the accounts that become farmable within the horizon
+        :ivar farm_gain expected fast passes from farming one account"""
+
+    def __init__(self, supply: int, demand: float, farmable_now: int, replenishment: float, farm_gain: float,
+                 horizon: float):
+        self.supply = supply
+        self.demand = demand
+        self.farmable_now = farmable_now
+        self.replenishment = replenishment
+        self.farm_gain = farm_gain
+        self.horizon = horizon
+
+    @property
+    def deficit(self) -> float:
+        """Fast passes missing at the end of the horizon if nothing farmable right now is farmed"""
+        return max(self.demand - self.supply - self.replenishment, 0)
+
+    def accounts_needed(self) -> int:
+        """Accounts to farm right now to cover the deficit"""
+        if self.deficit == 0:
+            return 0
+        return min(math.ceil(self.deficit / max(self.farm_gain, 1)), self.farmable_now)
+
+    def __repr__(self):
+        return f'<FP_FORECAST (SUPPLY:{self.supply}, DEMAND:{self.demand:.0f}, REPLENISHMENT:' \
+               f'{self.replenishment:.0f}, FARMABLE_NOW:{self.farmable_now}, FARM_GAIN:{self.farm_gain:.2f}, ' \
+               f'HORIZON:{self.horizon / 3600:.1f}h)>'
+
+
+class FastPassInventory:
+    """Predicts the fast passes that will be available against the ones the tracked books will need, so that farming
+    happens ahead of the releases instead of after the buyers ran out
+        :arg horizon seconds ahead the forecast looks at
+        :arg safety_factor multiplies the expected demand, releases cluster around peak hours
+        :arg history_window seconds of history used for the release rate and the farm gain
+        :arg default_farm_gain fast passes expected from farming an account while there is no farming history"""
+
+    def __init__(self, database: Database, *, horizon: float = 6 * 3600, safety_factor: float = 1.5,
+                 history_window: float = 7 * DAY, default_farm_gain: float = 1):
+        self._database = database
+        self.horizon = horizon
+        self.safety_factor = safety_factor
+        self.history_window = history_window
+        self.default_farm_gain = default_farm_gain
+
+    async def releases_per_day(self) -> float:
+        since = time.time() - self.history_window
+        paid_chapters = await self._database.count_paid_chapters_added_since(since)
+        return paid_chapters / (self.history_window / DAY)
+
+    async def farm_gain(self) -> float:
+        average_gain = await self._database.retrieve_average_farm_gain(time.time() - self.history_window)
+        if average_gain is None:
+            return self.default_farm_gain
+        return max(average_gain, 0)
+
+    async def forecast(self) -> InventoryForecast:
+        supply, _ = await self._database.retrieve_fp_supply()
+        demand = await self.releases_per_day() * self.horizon / DAY * self.safety_factor
+        farm_gain = await self.farm_gain()
+        farmable_now, upcoming_due_times = await self._database.retrieve_farming_due_times(self.horizon)
+        # the accounts farmed on the last day come back as their daily claims reset
+        replenishment = len(upcoming_due_times) * farm_gain
+        return InventoryForecast(supply, demand, farmable_now, replenishment, farm_gain, self.horizon)
+
+
+class FarmingScheduler:
+    """Decides how many accounts are farmed on each run. A steady base batch keeps the daily claims going, and the
+    batch grows to whatever the forecast says is missing before the next releases
+        :arg base_batch accounts farmed on every run while there is no deficit
+        :arg max_batch upper bound of accounts farmed on a single run
+        :arg forecast_interval seconds a forecast is reused before a new one is made"""
+
+    def __init__(self, inventory: FastPassInventory, *, base_batch: int = 20, max_batch: int = 200,
+                 forecast_interval: float = 300):
+        self.inventory = inventory
+        self.base_batch = base_batch
+        self.max_batch = max_batch
+        self.forecast_interval = forecast_interval
+        self.last_forecast: typing.Optional[InventoryForecast] = None
+        self._last_forecast_time = 0
+
+    async def next_batch_size(self) -> int:
+        if self.last_forecast is None or time.time() - self._last_forecast_time >= self.forecast_interval:
+            self.last_forecast = await self.inventory.forecast()
+            self._last_forecast_time = time.time()
+            if self.last_forecast.deficit > 0:
+                print(f"Fast pass deficit expected, farming ahead: {self.last_forecast}")
+        return min(max(self.base_batch, self.last_forecast.accounts_needed()), self.max_batch)
+
+    def farmed(self, accounts: int):
+        """Takes the accounts just farmed off the reused forecast so the next batch doesn't count them again"""
+        if self.last_forecast is None:
+            return
+        self.last_forecast.farmable_now = max(self.last_forecast.farmable_now - accounts, 0)
+        self.last_forecast.supply += round(accounts * self.last_forecast.farm_gain)
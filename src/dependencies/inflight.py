@@ -0,0 +1,109 @@
+import asyncio
+import typing
+from collections import OrderedDict
+
+from .webnovel.classes import Chapter, SimpleChapter
+
+ChapterKey = typing.Tuple[int, int]
+
+
+def chapter_key(chapter: SimpleChapter) -> ChapterKey:
+    return chapter.parent_id, chapter.id
+
+
+class ChapterClaims:
+    """Result of claiming a group of chapters on the registry
+        :ivar owned the chapters the caller has to buy, it must resolve or fail each of them on the registry
+        :ivar waiting futures of the chapters someone else is already buying
+        :ivar completed the chapters that were already bought"""
+
+    def __init__(self):
+        self.owned: typing.List[SimpleChapter] = []
+        self.waiting: typing.List[asyncio.Future] = []
+        self.completed: typing.List[Chapter] = []
+        # futures put on the registry for the owned chapters
+        self.owned_futures: typing.Dict[ChapterKey, asyncio.Future] = {}
+
+
+class InFlightRegistry:
+    """Keeps track of the chapters being bought or fetched in this process so that requests for a chapter that is
+    already on its way wait for that same purchase instead of spending another fast pass on it. The chapters bought are
+    kept in a bounded store so that requests coming right after get them without a new purchase"""
+
+    def __init__(self, max_completed: int = 500, wait_timeout: float = 300):
+        """
+            :arg wait_timeout seconds a request waits on a purchase made by someone else before giving up on it
+        """
+        self.max_completed = max_completed
+        self.wait_timeout = wait_timeout
+        self._in_flight: typing.Dict[ChapterKey, asyncio.Future] = {}
+        self._completed: typing.OrderedDict[ChapterKey, Chapter] = OrderedDict()
+
+    def __contains__(self, key: ChapterKey) -> bool:
+        return key in self._in_flight
+
+    def retrieve_completed(self, key: ChapterKey) -> typing.Optional[Chapter]:
+        chapter = self._completed.get(key)
+        if chapter is not None:
+            self._completed.move_to_end(key)
+        return chapter
+
+    def store(self, chapter: Chapter):
+        key = chapter_key(chapter)
+        self._completed[key] = chapter
+        self._completed.move_to_end(key)
+        while len(self._completed) > self.max_completed:
+            self._completed.popitem(last=False)
+
+    def claim(self, *chapters: SimpleChapter) -> ChapterClaims:
+        """Sorts the chapters into the ones already bought, the ones someone else is buying and the ones the caller now
+        owns and has to buy"""
+        claims = ChapterClaims()
+        for chapter in chapters:
+            key = chapter_key(chapter)
+            completed_chapter = self.retrieve_completed(key)
+            if completed_chapter is not None:
+                claims.completed.append(completed_chapter)
+            elif key in self._in_flight:
+                claims.waiting.append(self._in_flight[key])
+            else:
+                future = asyncio.get_event_loop().create_future()
+                self._in_flight[key] = future
+                claims.owned_futures[key] = future
+                claims.owned.append(chapter)
+        return claims
+
+    def resolve(self, chapter: Chapter):
+        """Hands the bought chapter to everyone waiting on it and keeps it on the store"""
+        self.store(chapter)
+        future = self._in_flight.pop(chapter_key(chapter), None)
+        if future is not None and not future.done():
+            future.set_result(chapter)
+
+    def fail(self, chapter: SimpleChapter, error: BaseException):
+        """Hands the error to everyone waiting on the chapter, the next request for it will try to buy it again"""
+        future = self._in_flight.pop(chapter_key(chapter), None)
+        if future is not None and not future.done():
+            future.set_exception(error)
+            # marks the error as retrieved, nobody may be waiting on it
+            future.exception()
+
+    def fail_unresolved(self, claims: ChapterClaims, error: BaseException):
+        """Fails the owned chapters of the claims that weren't resolved or failed yet, a chapter claimed again since
+        then by someone else is left alone"""
+        for key, future in claims.owned_futures.items():
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+                if not future.done():
+                    future.set_exception(error)
+                    future.exception()
+
+    async def wait(self, future: asyncio.Future) -> Chapter:
+        """Waits on a purchase made by someone else
+            :raises asyncio.TimeoutError if it isn't done within wait_timeout seconds"""
+        # shielded so that a waiter that is cancelled or times out doesn't cancel the purchase for the rest
+        return await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+
+
+# shared by everything in the process that buys chapters
+chapter_registry = InFlightRegistry()
@@ -0,0 +1,123 @@
+import asyncio
+import time
+import typing
+
+import aiohttp
+
+from .database import Database
+from .proxy_classes import Proxy
+from .webnovel.classes import Chapter, SimpleChapter
+from .webnovel.exceptions import ErrorList
+from .webnovel.waka import book as waka_book
+
+# the waka proxies are reused for many chapters, so their connections are kept alive
+default_connector_settings = {'keepalive_timeout': 60, 'enable_cleanup_closed': True}
+
+WAKA_REGION = 1
+
+
+class ProxyStats:
+    """A proxy of the pool along with its session, how many requests it may have going and how it has done so far"""
+
+    def __init__(self, proxy: Proxy, max_concurrent: int):
+        self.proxy = proxy
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.total_latency = 0.0
+        self.resting_until = 0.0
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.session = aiohttp.ClientSession(connector=proxy.generate_connector(**default_connector_settings))
+
+    @property
+    def average_latency(self) -> typing.Optional[float]:
+        if self.successes == 0:
+            return None
+        return self.total_latency / self.successes
+
+    def is_resting(self) -> bool:
+        return time.time() < self.resting_until
+
+    def load(self) -> float:
+        return self.in_flight / self.max_concurrent
+
+    def sort_key(self) -> tuple:
+        # the least loaded first, among equals the one that answered the fastest, proxies not tried yet go first
+        latency = self.average_latency
+        return self.load(), 0 if latency is None else latency
+
+    def __repr__(self):
+        latency = 'n/a' if self.average_latency is None else f'{self.average_latency:.2f}s'
+        return f'<PROXY_STATS (ID:{self.proxy.id}, OK:{self.successes}, FAILED:{self.failures}, ' \
+               f'AVG_LATENCY:{latency}, IN_FLIGHT:{self.in_flight})>'
+
+
+class PrivilegeChapterFetcher:
+    """Retrieves the privilege chapters spread over several waka proxies, each proxy has a cap on how many requests it
+    has going at the same time. A failed request is tried again on the best proxy available after a backoff, and the
+    proxy that failed rests for a while so that one slow or broken proxy doesn't hold back every chapter
+        :arg max_per_proxy requests a single proxy has going at the same time
+        :arg max_attempts attempts made for a chapter before its errors are raised
+        :arg retry_base_delay seconds waited after the first failure, doubled on every following one"""
+
+    def __init__(self, proxies: typing.List[Proxy], *, max_per_proxy: int = 4, max_attempts: int = 6,
+                 retry_base_delay: float = 1, max_delay: float = 30):
+        if len(proxies) == 0:
+            raise ValueError("At least one proxy is needed to fetch privilege chapters")
+        self.proxies = [ProxyStats(proxy, max_per_proxy) for proxy in proxies]
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    async def from_database(cls, database: Database, *, max_proxies: int = 5, **kwargs) -> 'PrivilegeChapterFetcher':
+        proxies = await database.retrieve_proxies(WAKA_REGION, limit=max_proxies)
+        return cls(proxies, **kwargs)
+
+    def _backoff(self, failures: int) -> float:
+        return min(self.retry_base_delay * 2 ** (failures - 1), self.max_delay)
+
+    async def _pick_proxy(self) -> ProxyStats:
+        while True:
+            healthy_proxies = [stats for stats in self.proxies if not stats.is_resting()]
+            if len(healthy_proxies) != 0:
+                return min(healthy_proxies, key=ProxyStats.sort_key)
+            # every proxy is resting, waits for the first one to be back
+            await asyncio.sleep(min(stats.resting_until for stats in self.proxies) - time.time())
+
+    async def fetch(self, chapter: SimpleChapter) -> Chapter:
+        errors = []
+        for attempt in range(1, self.max_attempts + 1):
+            stats = await self._pick_proxy()
+            stats.in_flight += 1
+            try:
+                async with stats.semaphore:
+                    start = time.perf_counter()
+                    chapter_obj = await waka_book.chapter_retriever(chapter.parent_id, chapter.id,
+                                                                    chapter.volume_index, session=stats.session)
+            except (asyncio.CancelledError, NotImplementedError):
+                raise
+            except Exception as e:
+                errors.append(e)
+                stats.failures += 1
+                stats.consecutive_failures += 1
+                stats.resting_until = time.time() + self._backoff(stats.consecutive_failures)
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(self._backoff(attempt))
+            else:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                stats.total_latency += time.perf_counter() - start
+                return chapter_obj
+            finally:
+                stats.in_flight -= 1
+        raise ErrorList(*errors)
+
+    def stats(self) -> typing.List[ProxyStats]:
+        return sorted(self.proxies, key=lambda stats: stats.proxy.id)
+
+    async def close(self):
+        for stats in self.proxies:
+            await stats.session.close()
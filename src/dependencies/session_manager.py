@@ -0,0 +1,179 @@
+import contextlib
+import time
+import typing
+from collections import OrderedDict
+
+import aiohttp
+
+from .database import Database
+from .proxy_classes import Proxy
+from .webnovel.classes import QiAccount
+
+# keep alive is what makes a warm session worth keeping, so the connections aren't force closed here
+default_connector_settings = {'keepalive_timeout': 60, 'enable_cleanup_closed': True}
+
+
+def cookies_from_session(session: aiohttp.ClientSession) -> dict:
+    return {cookie.key: cookie.value for cookie in session.cookie_jar}
+
+
+class AccountSession:
+    """A session kept open for one account along with the csrf token read from its cookies"""
+
+    def __init__(self, account: QiAccount, proxy: Proxy = None):
+        self.account = account
+        self.proxy = proxy
+        if proxy:
+            connector = proxy.generate_connector(**default_connector_settings)
+        else:
+            connector = aiohttp.TCPConnector(**default_connector_settings)
+        self.session = aiohttp.ClientSession(connector=connector, cookies=account.cookies)
+        self.csrf_token = account.cookies.get('_csrfToken', '')
+        self.last_used = time.time()
+        # how many users hold the session right now, a pinned session is never closed under them
+        self.pins = 0
+
+    @property
+    def closed(self) -> bool:
+        return self.session.closed
+
+    @property
+    def pinned(self) -> bool:
+        return self.pins > 0
+
+    def refresh_csrf_token(self) -> str:
+        """Reads the csrf token from the cookie jar again, only needed after a response could have changed it"""
+        for cookie in self.session.cookie_jar:
+            if cookie.key == '_csrfToken':
+                self.csrf_token = cookie.value
+                break
+        return self.csrf_token
+
+
+class AccountSessionManager:
+    """Keeps one open session per account in use so that the services reuse the connections instead of paying a new
+    handshake on every loop. Sessions not used for idle_timeout seconds are closed, and when more than max_sessions are
+    open the least recently used ones are closed first. A session that is checked out is pinned and none of that
+    applies to it until it is unpinned. Cookies the site refreshed are written back to the db before a session is
+    closed"""
+
+    def __init__(self, database: Database = None, *, max_sessions: int = 50, idle_timeout: int = 600):
+        self.database = database
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions: typing.OrderedDict[int, AccountSession] = OrderedDict()
+        # pinned sessions that were replaced for their account, closed once their last user unpins them
+        self._detached: typing.List[AccountSession] = []
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def get(self, account: QiAccount, proxy: Proxy = None, *, pin: bool = False) -> AccountSession:
+        """Returns the open session of the account, a new one is made if there is none, it was closed or it goes through
+        another proxy
+            :arg pin if true the session is pinned and has to be given back with unpin once it isn't used anymore"""
+        await self.close_idle()
+        account_session = self._sessions.get(account.guid)
+        if account_session is not None:
+            proxy_id = account_session.proxy.id if account_session.proxy else None
+            if account_session.closed or proxy_id != (proxy.id if proxy else None):
+                await self.close(account)
+                account_session = None
+        if account_session is None:
+            account_session = AccountSession(account, proxy)
+            self._sessions[account.guid] = account_session
+        self._sessions.move_to_end(account.guid)
+        account_session.last_used = time.time()
+        if pin:
+            account_session.pins += 1
+        await self.__evict(keep=account_session)
+        return account_session
+
+    @contextlib.asynccontextmanager
+    async def checkout(self, account: QiAccount, proxy: Proxy = None) -> typing.AsyncIterator[aiohttp.ClientSession]:
+        """The session of the account, pinned while the block runs"""
+        account_session = await self.get(account, proxy, pin=True)
+        try:
+            yield account_session.session
+        finally:
+            await self.unpin(account_session)
+
+    async def unpin(self, account_session: AccountSession):
+        account_session.pins = max(account_session.pins - 1, 0)
+        account_session.last_used = time.time()
+        if account_session.pinned:
+            return
+        if account_session in self._detached:
+            self._detached.remove(account_session)
+            await self.__close_session(account_session)
+        else:
+            await self.__evict()
+
+    async def __evict(self, keep: AccountSession = None):
+        # the least recently used unpinned sessions go first, while all of them are pinned the limit is let go over
+        while len(self._sessions) > self.max_sessions:
+            oldest_session = next((account_session for account_session in self._sessions.values()
+                                   if not account_session.pinned and account_session is not keep), None)
+            if oldest_session is None:
+                return
+            await self.close(oldest_session.account)
+
+    def csrf_token(self, account: QiAccount) -> str:
+        """The csrf token of the open session of the account, kept up to date with the cookies the site refreshed, or
+        the one of the account cookies if it has no session open"""
+        account_session = self._sessions.get(account.guid)
+        if account_session is not None and not account_session.closed:
+            return account_session.csrf_token
+        return account.cookies.get('_csrfToken', '')
+
+    async def store_cookies(self, account: QiAccount):
+        """Writes the cookies of the session of the account back to the account and to the db if the site changed
+        them"""
+        account_session = self._sessions.get(account.guid)
+        if account_session is not None:
+            await self.__store_session_cookies(account_session)
+            account.cookies = account_session.account.cookies
+
+    async def __store_session_cookies(self, account_session: AccountSession):
+        if account_session.closed:
+            return
+        cookies = cookies_from_session(account_session.session)
+        if len(cookies) == 0 or cookies == account_session.account.cookies:
+            return
+        account_session.account.cookies = cookies
+        account_session.refresh_csrf_token()
+        if self.database is not None:
+            await self.database.update_account_cookies(account_session.account, batch=True)
+
+    async def __close_session(self, account_session: AccountSession):
+        if account_session.closed:
+            return
+        try:
+            await self.__store_session_cookies(account_session)
+        finally:
+            await account_session.session.close()
+
+    async def close(self, account: QiAccount):
+        """Closes the session of the account, if someone still has it pinned it is only closed once they unpin it"""
+        account_session = self._sessions.pop(account.guid, None)
+        if account_session is None:
+            return
+        if account_session.pinned and not account_session.closed:
+            self._detached.append(account_session)
+            return
+        await self.__close_session(account_session)
+
+    async def close_idle(self):
+        now = time.time()
+        idle_accounts = [account_session.account for account_session in self._sessions.values()
+                         if account_session.closed or
+                         (not account_session.pinned and now - account_session.last_used >= self.idle_timeout)]
+        for account in idle_accounts:
+            await self.close(account)
+
+    async def close_all(self):
+        """Closes every session, pinned or not, only meant for shutting down"""
+        for account_session in list(self._sessions.values()) + self._detached:
+            self._sessions.pop(account_session.account.guid, None)
+            await self.__close_session(account_session)
+        self._detached.clear()
@@ -3,11 +3,13 @@ import time
 import typing
 from operator import attrgetter
 
+from .buy_scheduler import schedule_buys
 from .database import Database
 from .database.database_exceptions import NoAccountFound
+from .inflight import InFlightRegistry, chapter_registry
 from .privatebin import upload_to_privatebin
+from .privilege_fetcher import PrivilegeChapterFetcher
 from .webnovel.classes import SimpleBook, SimpleChapter, QiAccount, Chapter
-from .webnovel.waka import book as waka_book
 from .webnovel.web import book
 
 paste_metadata = '<h3 data-book-Id="%s" data-chapter-Id="%s" data-almost-unix="%s" ' \
@@ -36,108 +38,128 @@ async def paste_generator(book_name: str, chapter: Chapter):
     return paste_url
 
 
-async def generic_buyer(db: Database, book_: SimpleBook, *chapters: SimpleChapter) -> Chapter:
+async def buy_chapters(db: Database, book_: SimpleBook, *chapters: SimpleChapter,
+                       registry: InFlightRegistry = chapter_registry) -> typing.Union[str, typing.List[Chapter]]:
     """
-    Takes a book and a list of chapters, and returns a string that contains the chapters' content
-    
+    Buys the chapters, or fetches them if they are privilege chapters. Chapters already being bought elsewhere in the
+    process are awaited instead of bought again, and the ones bought recently are taken from the registry store
+
     :param db: Database
     :type db: Database
     :param book_: SimpleBook
     :type book_: SimpleBook
-    :param : db: Database
-    :type : SimpleChapter
-    :return: A coroutine object.
+    :param registry: InFlightRegistry = chapter_registry
+    :type registry: InFlightRegistry
+    :return: The chapters ordered by index or a message for the user if no account could be leased
     """
     async def individual_buyer(inner_chapter: SimpleChapter, buyer_account: QiAccount = None):
         """
         If the chapter is a privilege chapter, then use a proxy to retrieve the chapter, otherwise use
-        the buyer account to buy the chapter.
-        
+        the buyer account to buy the chapter. The result is handed to the registry
+
         :param inner_chapter: SimpleChapter
         :type inner_chapter: SimpleChapter
         :param buyer_account: QiAccount = None
         :type buyer_account: QiAccount
         :return: A chapter object
         """
-        if inner_chapter.is_privilege:
-            waka_proxy = await db.retrieve_proxy(1)
-            chapter_obj = await waka_book.chapter_retriever(book_id=inner_chapter.parent_id,
-                                                            chapter_id=inner_chapter.id,
-                                                            volume_index=inner_chapter.volume_index, proxy=waka_proxy)
-        else:
-            if None:
-                raise ValueError("No buyer account was given for a non priv chapter")
-            chapter_obj = await book.chapter_buyer(book_id=inner_chapter.parent_id, chapter_id=inner_chapter.id,
-                                                   account=buyer_account)
-
+        try:
+            if inner_chapter.is_privilege:
+                chapter_obj = await privilege_fetcher.fetch(inner_chapter)
+            else:
+                if buyer_account is None:
+                    raise ValueError("No buyer account was given for a non priv chapter")
+                chapter_obj = await book.chapter_buyer(book_id=inner_chapter.parent_id, chapter_id=inner_chapter.id,
+                                                       account=buyer_account)
+        except BaseException as e:
+            registry.fail(inner_chapter, e)
+            raise
+        registry.resolve(chapter_obj)
         return chapter_obj
 
-    async def account_retriever() -> QiAccount:
-        """
-        Retrieves a buyer account from the database, checks if it's valid, and if it's not, it
-        retrieves another one
-        :return: The return value is a coroutine object.
-        """
-        buyer_account = await db.retrieve_buyer_account()
-        while True:
-            working = await buyer_account.async_check_valid()
-            if working:
-                break
-            buyer_account = await db.retrieve_buyer_account()
-        return buyer_account
-
-    enough_fp_count = len(chapters)
-    accounts_to_use = []
-    accounts_used = []
-    use_account = False
-    while True:
-        for chapter in chapters:
-            if not chapter.is_privilege:
-                use_account = True
-                break
-        if use_account is False:
-            break
+    claims = registry.claim(*chapters)
+    try:
+        non_privilege_chapters = [chapter for chapter in claims.owned if not chapter.is_privilege]
         try:
-            account = await account_retriever()
-        except NoAccountFound:
-            if len(accounts_to_use) != 0:
-                for account in accounts_to_use:
-                    await db.release_account(account)
+            assignments = await schedule_buys(db, non_privilege_chapters)
+        except NoAccountFound as e:
+            registry.fail_unresolved(claims, e)
             return f"Couldn't retrieve a valid account to buy the chapter for {book_.name}, please try again...."
-        db_fp_count = account.fast_pass_count
-        await account.async_check_valid()
-        qi_fp_count = account.fast_pass_count
-        if qi_fp_count == 0:
-            if db_fp_count != qi_fp_count:
-                await db.update_account_fp_count(0, account)
-            continue
-        else:
-            if db_fp_count != qi_fp_count:
-                await db.update_account_fp_count(qi_fp_count, account)
-            accounts_to_use.append(account)
-            enough_fp_count = enough_fp_count - account.fast_pass_count
-            if enough_fp_count <= 0:
-                break
 
-    async_tasks = []
-    for chapter in chapters:
-        if use_account:
-            async_tasks.append(asyncio.create_task(individual_buyer(chapter, accounts_to_use[0])))
-            accounts_to_use[0].fast_pass_count -= 1
-            if accounts_to_use[0].fast_pass_count == 0:
-                used_account = accounts_to_use.pop(0)
-                accounts_used.append(used_account)
-        else:
-            async_tasks.append(asyncio.create_task(individual_buyer(chapter)))
+        privilege_fetcher = None
+        if any(chapter.is_privilege for chapter in claims.owned):
+            # shared by all the privilege chapters of the call instead of a proxy retrieved for each of them
+            try:
+                privilege_fetcher = await PrivilegeChapterFetcher.from_database(db)
+            except BaseException:
+                for used_account, _ in assignments:
+                    await db.release_account(used_account, batch=True)
+                raise
+
+        async_tasks = []
+        accounts_tasks = []
+        for buyer_account, account_chapters in assignments:
+            account_tasks = [asyncio.create_task(individual_buyer(chapter, buyer_account))
+                             for chapter in account_chapters]
+            accounts_tasks.append((buyer_account, account_tasks))
+            async_tasks.extend(account_tasks)
+        for chapter in claims.owned:
+            if chapter.is_privilege:
+                async_tasks.append(asyncio.create_task(individual_buyer(chapter)))
+        for future in claims.waiting:
+            async_tasks.append(asyncio.create_task(registry.wait(future)))
+
+        try:
+            # every buy is let to finish so that the accounts are released knowing what they spent
+            results = await asyncio.gather(*async_tasks, return_exceptions=True)
+        finally:
+            if privilege_fetcher is not None:
+                await privilege_fetcher.close()
+            for used_account, account_tasks in accounts_tasks:
+                bought = [task for task in account_tasks if task.done() and not task.cancelled() and
+                          task.exception() is None]
+                # the real count is read on the next lease, no need to ask qi right after buying
+                used_account.spend_fast_passes(len(bought))
+                if len(bought) != len(account_tasks):
+                    # a failed buy may have spent a fast pass or not, the next use has to ask qi
+                    used_account.invalidate_validity()
+                await db.update_account_fp_count(used_account.fast_pass_count, used_account, batch=True)
+                await db.release_account(used_account, batch=True)
+    except BaseException as e:
+        # any error or cancellation before the buys handed out their chapters would leave the claims in flight for
+        # good and every later request for those chapters waiting on them
+        registry.fail_unresolved(claims, e)
+        raise
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if any(isinstance(error, NoAccountFound) for error in errors):
+        # a purchase this call was waiting on couldn't find an account either
+        return f"Couldn't retrieve a valid account to buy the chapter for {book_.name}, please try again...."
+    if len(errors) != 0:
+        raise errors[0]
+    bought_chapters: typing.List[Chapter] = results
+    bought_chapters.extend(claims.completed)
+    bought_chapters.sort(key=attrgetter('index'))
+    return bought_chapters
+
 
+async def generic_buyer(db: Database, book_: SimpleBook, *chapters: SimpleChapter) -> Chapter:
+    """
+    Takes a book and a list of chapters, and returns a string that contains the chapters' content
+    
+    :param db: Database
+    :type db: Database
+    :param book_: SimpleBook
+    :type book_: SimpleBook
+    :param : db: Database
+    :type : SimpleChapter
+    :return: A coroutine object.
+    """
     ranges = [chapter.index for chapter in chapters]
     ranges.sort()
-    chapters = await asyncio.gather(*async_tasks)
-    for used_account in accounts_used:
-        await used_account.async_check_valid()
-        await db.update_account_fp_count(used_account.fast_pass_count, used_account)
-        await db.release_account(used_account)
-    chapters.sort(key=attrgetter('index'))
+    chapters = await buy_chapters(db, book_, *chapters)
+    if isinstance(chapters, str):
+        return chapters
     chapters_strings = []
     for chapter in chapters:
         metadata = paste_metadata % (
@@ -175,97 +197,9 @@ async def generic_buyer_obj(db: Database, book_: SimpleBook, *chapters: SimpleCh
     :type : SimpleChapter
     :return: A list of Chapter objects
     """
-    async def individual_buyer(inner_chapter: SimpleChapter, buyer_account: QiAccount = None):
-        """
-        If the chapter is a privilege chapter, then use a proxy to retrieve the chapter, otherwise use
-        the buyer account to buy the chapter.
-        
-        :param inner_chapter: SimpleChapter
-        :type inner_chapter: SimpleChapter
-        :param buyer_account: QiAccount = None
-        :type buyer_account: QiAccount
-        :return: A chapter object
-        """
-        if inner_chapter.is_privilege:
-            waka_proxy = await db.retrieve_proxy(1)
-            chapter_obj = await waka_book.chapter_retriever(book_id=inner_chapter.parent_id,
-                                                            chapter_id=inner_chapter.id,
-                                                            volume_index=inner_chapter.volume_index, proxy=waka_proxy)
-        else:
-            if None:
-                raise ValueError("No buyer account was given for a non priv chapter")
-            chapter_obj = await book.chapter_buyer(book_id=inner_chapter.parent_id, chapter_id=inner_chapter.id,
-                                                   account=buyer_account)
-
-        return chapter_obj
-
-    async def account_retriever() -> QiAccount:
-        """
-        Retrieves a QiAccount from the database, checks if it's valid, and if it's not, it retrieves
-        another QiAccount from the database
-        :return: The return value is a coroutine object.
-        """
-        buyer_account = await db.retrieve_buyer_account()
-        while True:
-            working = await buyer_account.async_check_valid()
-            if working:
-                break
-            buyer_account = await db.retrieve_buyer_account()
-        return buyer_account
-
-    enough_fp_count = len(chapters)
-    accounts_to_use = []
-    accounts_used = []
-    use_account = False
-    while True:
-        for chapter in chapters:
-            if not chapter.is_privilege:
-                use_account = True
-                break
-        if use_account is False:
-            break
-        try:
-            account = await account_retriever()
-        except NoAccountFound:
-            if len(accounts_to_use) != 0:
-                for account in accounts_to_use:
-                    await db.release_account(account)
-            return f"Couldn't retrieve a valid account to buy the chapter for {book_.name}, please try again...."
-        db_fp_count = account.fast_pass_count
-        await account.async_check_valid()
-        qi_fp_count = account.fast_pass_count
-        if qi_fp_count == 0:
-            if db_fp_count != qi_fp_count:
-                await db.update_account_fp_count(0, account)
-            continue
-        else:
-            if db_fp_count != qi_fp_count:
-                await db.update_account_fp_count(qi_fp_count, account)
-            accounts_to_use.append(account)
-            enough_fp_count = enough_fp_count - account.fast_pass_count
-            if enough_fp_count <= 0:
-                break
-
-    async_tasks = []
-    for chapter in chapters:
-        if use_account:
-            async_tasks.append(asyncio.create_task(individual_buyer(chapter, accounts_to_use[0])))
-            accounts_to_use[0].fast_pass_count -= 1
-            if accounts_to_use[0].fast_pass_count == 0:
-                used_account = accounts_to_use.pop(0)
-            accounts_used.append(accounts_to_use[0])
-        else:
-            async_tasks.append(asyncio.create_task(individual_buyer(chapter)))
-
-    ranges = [chapter.index for chapter in chapters]
-    ranges.sort()
-    chapters = await asyncio.gather(*async_tasks)
-    chapters: typing.List[Chapter]
-    for used_account in accounts_used:
-        await used_account.async_check_valid()
-        await db.update_account_fp_count(used_account.fast_pass_count, used_account)
-        await db.release_account(used_account)
-    chapters.sort(key=attrgetter('index'))
+    chapters = await buy_chapters(db, book_, *chapters)
+    if isinstance(chapters, str):
+        return chapters
 
 
 
@@ -1,4 +1,5 @@
 import json
+import time
 import typing
 from operator import attrgetter
 
@@ -403,6 +404,12 @@ class Comic(SimpleComic):
 
 
 class QiAccount:
+    # seconds a validity check is trusted before qi is asked again
+    VALIDITY_TTL = 300
+    # guid: (checked at, valid, fp count), shared by every object of the same account as they are rebuilt from the db
+    # on each retrieval
+    _validity_cache: typing.Dict[int, typing.Tuple[float, bool, int]] = {}
+
     def __init__(self, id_: int, qi_email: str, qi_pass: str, cookies: dict, ticket: str, expired: bool,
                  update_time: int, fp: int, library_type: int, library_pages: int, main_email_id: int, guid: int,
                  owned: bool = True):
@@ -423,6 +430,11 @@ class QiAccount:
         self.host_email_id = main_email_id
         self.guid = int(guid)
         self.owned = owned
+        # only set while the account is checked out for buying
+        self.lease_id = None
+        self.lease_expires_at = 0
+        # True when the last validity check was answered by the cache, the fp count it set may be older than the db one
+        self.validity_from_cache = False
 
     def __repr__(self):
         return f'<QI_ACCOUNT (ID:{self.id}, GUID:{self.guid}, EMAIL:{self.email}, FP_COUNT:{self.fast_pass_count}, ' \
@@ -444,7 +456,39 @@ class QiAccount:
     #     user_dict = response_dict['user']
     #     return self._read_valid(user_dict)
 
-    async def async_check_valid(self) -> bool:
+    @property
+    def validity_checked_at(self) -> float:
+        return self._validity_cache.get(self.guid, (0, False, 0))[0]
+
+    def invalidate_validity(self):
+        """Drops the cached validity so that the next check goes to qi, meant for when a request with the account failed
+        or its fast passes were spent"""
+        self._validity_cache.pop(self.guid, None)
+
+    def spend_fast_passes(self, amount: int):
+        """Takes the spent fast passes off the local count without asking qi, the cached validity is dropped so the real
+        count is read on the next check"""
+        self.fast_pass_count = max(self.fast_pass_count - amount, 0)
+        self.invalidate_validity()
+
+    async def async_check_valid(self, *, force: bool = False, max_age: float = None) -> bool:
+        """Checks if the account still works and reads its fast pass count, a check done less than max_age seconds
+        ago (VALIDITY_TTL by default) is reused unless force is set"""
+        if max_age is None:
+            max_age = self.VALIDITY_TTL
+        cached = self._validity_cache.get(self.guid)
+        if not force and cached is not None and time.time() - cached[0] < max_age:
+            _, valid, fast_pass_count = cached
+            if valid:
+                self.fast_pass_count = fast_pass_count
+            self.validity_from_cache = True
+            return valid
+        valid = await self._request_valid()
+        self.validity_from_cache = False
+        self._validity_cache[self.guid] = (time.time(), valid, self.fast_pass_count)
+        return valid
+
+    async def _request_valid(self) -> bool:
         task_list_url = 'https://www.webnovel.com/go/pcm/task/getTaskList'
         params = {'taskType': 1, '_csrfToken': self.cookies['_csrfToken']}
         try_attempt = 0
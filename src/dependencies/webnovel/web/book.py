@@ -127,7 +127,7 @@ async def trail_read_books_finder() -> List[int]:
 
 
 async def chapter_list_retriever(book: Union[classes.SimpleBook, int], session: aiohttp.ClientSession = None,
-                                 proxy: Proxy = None, return_book: bool = False
+                                 proxy: Proxy = None, return_book: bool = False, csrf_token: str = None
                                  ) -> Union[List[classes.Volume], Tuple[List[classes.Volume], classes.SimpleBook]]:
     """
     Takes a book object, and returns a list of Volume objects
@@ -140,6 +140,8 @@ async def chapter_list_retriever(book: Union[classes.SimpleBook, int], session:
     :type proxy: Proxy
     :param return_book: bool = False, defaults to False
     :type return_book: bool (optional)
+    :param csrf_token: str = None
+    :type csrf_token: str (optional)
     :return: A list of Volume objects or a tuple in the following format (list[volume objects],simple
     book])
     """
@@ -150,6 +152,7 @@ async def chapter_list_retriever(book: Union[classes.SimpleBook, int], session:
             account arg to generate a request
         :arg proxy accepts an aiohttp proxy connector object, will be ignored if session is given
         :arg return_book defines if it should return the book metadata found on the chapter list
+        :arg csrf_token the csrf token of the session, when given the cookie jar of the session isn't scanned for it
         :returns a list containing Volume objects or a tuple in the following format (list[volume objects],simple book])
 
     """
@@ -158,10 +161,11 @@ async def chapter_list_retriever(book: Union[classes.SimpleBook, int], session:
     params = {'bookId': str(book.id), '_': str(time())}
     if session:
         assert isinstance(session, aiohttp.ClientSession)
-        csrf_token = ''
-        for cookie in session.cookie_jar:
-            if cookie.key == '_csrfToken':
-                csrf_token = cookie.value
+        if csrf_token is None:
+            csrf_token = ''
+            for cookie in session.cookie_jar:
+                if cookie.key == '_csrfToken':
+                    csrf_token = cookie.value
         params['_csrfToken'] = csrf_token
     api = '/'.join((API_ENDPOINT_2, 'get-chapter-list'))
     try_attempts = 0
@@ -364,7 +368,7 @@ def __full_chapter_parser(book_id: int, chapter_id: int, chapter_info: dict, vol
 
 async def full_book_retriever(book_or_book_id: Union[classes.SimpleBook, classes.Book, int],
                               session: aiohttp.ClientSession = None,
-                              proxy: Proxy = None) -> classes.Book:
+                              proxy: Proxy = None, csrf_token: str = None) -> classes.Book:
     """
     Retrieves a book's metadata and chapter list, then uses the last chapter's metadata to retrieve
     the book's metadata
@@ -375,6 +379,8 @@ async def full_book_retriever(book_or_book_id: Union[classes.SimpleBook, classes
     :type session: aiohttp.ClientSession
     :param proxy: Proxy = None
     :type proxy: Proxy
+    :param csrf_token: str = None, the csrf token of the session, passed on to the chapter list request
+    :type csrf_token: str (optional)
     :return: A full book object.
     """
     if isinstance(book_or_book_id, int):
@@ -383,7 +389,7 @@ async def full_book_retriever(book_or_book_id: Union[classes.SimpleBook, classes
     while True:
         try:
             volumes, chapter_list_book_meta = await chapter_list_retriever(book_or_book_id, session, proxy,
-                                                                           return_book=True)
+                                                                           return_book=True, csrf_token=csrf_token)
             break
         except json.JSONDecodeError:
             pass
@@ -0,0 +1,84 @@
+import asyncio
+import io
+import typing
+
+from .decode_executor import DecodeExecutor
+from .font_cache import FontDecodeCache, font_bytes_hash
+from .utils import ContentInfo
+
+
+class FontDecodeResult:
+    """Decode of one font, shared by every chapter of the batch served with it"""
+
+    def __init__(self, font_hash: str, font_bytes: bytes):
+        self.font_hash = font_hash
+        self.font_bytes = font_bytes
+        self.trans_map: typing.Dict[int, str] = {}
+        self.order_map: typing.Dict[int, str] = {}
+        # glyph order number: (obfuscated char, png of the glyph)
+        self.unknown_glyphs: typing.Dict[int, typing.Tuple[str, io.BytesIO]] = {}
+        self.chapters = []
+
+    @property
+    def is_complete(self) -> bool:
+        return len(self.unknown_glyphs) == 0
+
+    def learn(self, order_num: int, true_char: str):
+        """Maps an unknown glyph to the char a human read on it"""
+        char, _ = self.unknown_glyphs.pop(order_num)
+        self.order_map[order_num] = true_char
+        self.trans_map[ord(char)] = true_char
+
+
+class ChapterDecode:
+    def __init__(self, chapter, content_info: ContentInfo, font: FontDecodeResult):
+        self.chapter = chapter
+        self.content_info = content_info
+        self.font = font
+        self.obfuscated_text: typing.Optional[str] = None
+
+    @property
+    def is_complete(self) -> bool:
+        return self.font.is_complete
+
+    def decoded_text(self) -> str:
+        return self.obfuscated_text.translate(self.font.trans_map)
+
+
+async def _decode_font(font: FontDecodeResult, executor: DecodeExecutor, font_cache: typing.Optional[FontDecodeCache]):
+    if font_cache is not None:
+        cached_decode = await font_cache.retrieve(font.font_bytes)
+        if cached_decode is not None:
+            font.trans_map, font.order_map = cached_decode
+            return
+    font.trans_map, font.order_map, font.unknown_glyphs = await executor.build_map(font.font_bytes)
+    if font_cache is not None and font.is_complete:
+        await font_cache.store(font.font_bytes, font.trans_map, font.order_map)
+
+
+async def _unscramble(chapter_decode: ChapterDecode, executor: DecodeExecutor):
+    chapter_decode.obfuscated_text = await executor.unscramble(chapter_decode.chapter.content)
+
+
+async def decode_chapters(chapters: list, executor: DecodeExecutor, font_cache: FontDecodeCache = None) -> \
+        typing.Tuple[typing.List[ChapterDecode], typing.List[FontDecodeResult]]:
+    """Decodes a batch of obfuscated chapters. Chapters are grouped by the hash of their font so that each distinct font
+    is matched once, while every chapter is unscrambled in parallel on the executor
+        :returns the chapter decodes ordered by (book, index) and the fonts that still have unknown glyphs, any learned
+            glyph on one of those fonts applies to all the chapters using it"""
+    fonts: typing.Dict[str, FontDecodeResult] = {}
+    chapter_decodes = []
+    for chapter in chapters:
+        content_info = ContentInfo.from_content_info(chapter.content)
+        font_hash = font_bytes_hash(content_info.font_bytes)
+        if font_hash not in fonts:
+            fonts[font_hash] = FontDecodeResult(font_hash, content_info.font_bytes)
+        chapter_decode = ChapterDecode(chapter, content_info, fonts[font_hash])
+        fonts[font_hash].chapters.append(chapter_decode)
+        chapter_decodes.append(chapter_decode)
+
+    await asyncio.gather(*[_decode_font(font, executor, font_cache) for font in fonts.values()],
+                         *[_unscramble(chapter_decode, executor) for chapter_decode in chapter_decodes])
+
+    chapter_decodes.sort(key=lambda chapter_decode: (chapter_decode.chapter.parent_id, chapter_decode.chapter.index))
+    return chapter_decodes, [font for font in fonts.values() if not font.is_complete]
@@ -0,0 +1,85 @@
+import asyncio
+import io
+import multiprocessing
+import typing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from .glyph_dictionary import GlyphDictionary
+from .utils import ContentInfo
+
+# set on every worker process by _init_worker
+_worker_dictionary: typing.Optional[GlyphDictionary] = None
+
+
+def _init_worker(decoder_class, dictionary_state: str):
+    global _worker_dictionary
+    _worker_dictionary = GlyphDictionary(decoder_class)
+    _worker_dictionary.deserialise(dictionary_state)
+
+
+def _unscramble(content_str: str) -> str:
+    return ContentInfo.from_content_info(content_str).unscramble_fast()
+
+
+def _build_map(font_bytes: bytes):
+    decoder = _worker_dictionary.create_decoder(io.BytesIO(font_bytes))
+    tl_map, order_map, unknown_glyphs = decoder._build_map()
+    # only plain bytes go back through the pipe
+    unknown_glyphs = {order_num: (char, image.getvalue()) for order_num, (char, image) in unknown_glyphs.items()}
+    return tl_map, order_map, unknown_glyphs
+
+
+class DecodeExecutor:
+    """Runs the cpu heavy steps of decoding a chapter (unscrambling the html and matching the font glyphs) on a pool of
+    worker processes so that the event loop stays responsive. Every worker holds its own copy of the glyph dictionary,
+    refresh_dictionary has to be called after the dictionary changes"""
+
+    def __init__(self, glyph_dictionary: GlyphDictionary, max_workers: int = None):
+        self.glyph_dictionary = glyph_dictionary
+        self.max_workers = max_workers
+        self._pool: typing.Optional[Executor] = None
+        # version of the glyph dictionary the workers were started with
+        self._pool_version = None
+        self._refresh_pending = False
+
+    def _get_pool(self) -> Executor:
+        if self._refresh_pending:
+            self._refresh_pending = False
+            if self._pool is not None and self._pool_version != self.glyph_dictionary.version:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+        if self._pool is None:
+            self._pool_version = self.glyph_dictionary.version
+            initargs = (self.glyph_dictionary.decoder_class, self.glyph_dictionary.serialise())
+            if multiprocessing.current_process().daemon:
+                # daemon processes (the background process) can't have children, threads at least keep the loop free
+                self._pool = ThreadPoolExecutor(self.max_workers, initializer=_init_worker, initargs=initargs)
+            else:
+                self._pool = ProcessPoolExecutor(self.max_workers, initializer=_init_worker, initargs=initargs)
+        return self._pool
+
+    def refresh_dictionary(self):
+        """Workers are started again with the current state of the glyph dictionary when the next task is submitted,
+        and only if it changed since they were started. Several fonts learned in a row cost a single restart, tasks
+        already submitted finish on the old workers"""
+        self._refresh_pending = True
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_pool(), function, *args)
+
+    async def unscramble(self, content_str: str) -> str:
+        """The chapter content, as returned by the api, with its words back in order and still obfuscated"""
+        return await self._run(_unscramble, content_str)
+
+    async def build_map(self, font_bytes: bytes) -> typing.Tuple[typing.Dict[int, str], typing.Dict[int, str],
+                                                                 typing.Dict[int, typing.Tuple[str, io.BytesIO]]]:
+        """Same as DecoderBase._build_map for a font, matched against the glyph dictionary"""
+        tl_map, order_map, unknown_glyphs = await self._run(_build_map, font_bytes)
+        unknown_glyphs = {order_num: (char, io.BytesIO(image)) for order_num, (char, image) in unknown_glyphs.items()}
+        return tl_map, order_map, unknown_glyphs
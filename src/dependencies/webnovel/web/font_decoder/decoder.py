@@ -6,14 +6,17 @@ from abc import ABC
 from typing import Dict, List, Union
 
 import imagehash
+import numpy as np
 from PIL import ImageFont, Image, ImageDraw
 from fontTools import ttLib
 
-from .utils import DistComparable
+from .utils import DistComparable, GlyphIndex
 
 
 class DecoderBase(ABC):
     SCORE_CUTOFF = 0
+    # decoders whose glyph keys don't come from the rendered glyph skip rendering it
+    USES_GLYPH_IMAGE = True
 
     def __init__(self, filename: Union[str, io.BytesIO]):
         self.filename = filename
@@ -26,6 +29,8 @@ class DecoderBase(ABC):
 
         # ident: true_char
         self._dec_info = {}
+        # built from _dec_info on the first lookup, dropped whenever a sample is added
+        self._index = None
 
     # region Utils
     @property
@@ -56,6 +61,11 @@ class DecoderBase(ABC):
         return new_image
         # im.save(filename)
 
+    def get_glyph_png(self, character: str, size: int = 30) -> io.BytesIO:
+        io_byte = io.BytesIO()
+        self.save_glyph_image("", character, size).save(io_byte, "PNG")
+        return io_byte
+
     def dump_all(self, dest: str, size: int = 30):
         os.makedirs(dest, exist_ok=True)
 
@@ -69,7 +79,7 @@ class DecoderBase(ABC):
     # endregion
 
     def get_glyph_key(self, character: str, size: int = 30):
-        image = self.get_glyph_image(character)
+        image = self.get_glyph_image(character, size) if self.USES_GLYPH_IMAGE else None
 
         return self._get_glyph_key(image, character, size)
 
@@ -85,24 +95,42 @@ class DecoderBase(ABC):
 
         self._add_sample(sample, char_map)
 
-    def _add_sample(self, sample: "DecoderBase", char_map: List[str]):
-        real_glyph_names = set(sample.cmap.values())
-        order_map = {x: idx for idx, x in enumerate(filter(lambda x: x in real_glyph_names, sample.tt.glyphOrder))}
+    def sample_glyphs(self, char_map: List[str]):
+        """Yields (ident, true_char) for every glyph of this font, char_map being the true chars in glyph order"""
+        real_glyph_names = set(self.cmap.values())
+        order_map = {x: idx for idx, x in enumerate(filter(lambda x: x in real_glyph_names, self.tt.glyphOrder))}
 
-        for char, glpyh_name in sample.cmap.items():
+        for char, glpyh_name in self.cmap.items():
             true_char = char_map[order_map[glpyh_name]]
             if true_char is None:
                 continue
 
-            ident = sample.get_glyph_key(chr(char))
+            yield self.get_glyph_key(chr(char)), true_char
 
+    def _add_sample(self, sample: "DecoderBase", char_map: List[str]):
+        for ident, true_char in sample.sample_glyphs(char_map):
             existing = self._dec_info.get(ident, None)
             if existing is not None and existing != true_char:
                 raise ValueError(f"Glyph ident collision! have {ident!r}={existing!r}, tried to map it to {true_char!r}!")
 
             self._dec_info[ident] = true_char
-
-    def _build_map(self):
+        self._index = None
+
+    def use_glyphs(self, dec_info: dict, index: GlyphIndex = None):
+        """Makes the decoder look up glyphs on an already built dictionary instead of its own samples"""
+        self._dec_info = dec_info
+        self._index = index
+
+    def _get_index(self) -> GlyphIndex:
+        if self._index is None:
+            idents = list(self._dec_info)
+            self._index = GlyphIndex([self._ident_vector(ident) for ident in idents], idents)
+        return self._index
+
+    def _build_map(self, render_unknown: bool = True):
+        """Returns the translation table, glyph order number -> true char map and the glyphs that couldn't be matched
+        as glyph order number -> (obfuscated char, png of the glyph). With render_unknown False the png is None and can
+        be rendered later with get_glyph_png"""
         real_glyph_names = set(self.cmap.values())
         order_map = {x: idx for idx, x in enumerate(filter(lambda x: x in real_glyph_names, self.tt.glyphOrder))}
 
@@ -115,26 +143,21 @@ class DecoderBase(ABC):
             order_num = order_map[glyph_name]
 
             if char_ident not in self._dec_info:
-                options = [(self._compare_idents(char_ident, cand_ident), cand_ident) for cand_ident, cand_char in self._dec_info.items()]
-                options = sorted(options, key=lambda x: x[0])
-                if len(options) == 0:
+                index = self._get_index()
+                if len(index) == 0:
                     print(f"No match found!!")
-                    io_byte = io.BytesIO()
-                    im = self.save_glyph_image(f"{str(char_ident)}.png", chr(char))
-                    im.save(io_byte, "PNG")
-                    unknown_glyphs[order_num] = (chr(char), io_byte)
-                elif options[0][0] <= self.SCORE_CUTOFF:
-                    # print(f"Matched with score {options[0][0]}")
-                    char_ident = options[0][1]
+                    unknown_glyphs[order_num] = (chr(char), self.get_glyph_png(chr(char)) if render_unknown else None)
+                    continue
+                score, closest_ident = index.query(self._ident_vector(char_ident))
+                if score <= self.SCORE_CUTOFF:
+                    # print(f"Matched with score {score}")
+                    char_ident = closest_ident
 
                     char_map[chr(char)] = self._dec_info[char_ident]
                     order_tl[order_num] = self._dec_info[char_ident]
                 else:
-                    print(f"Closest was {self._dec_info[options[0][1]]!r} with a score of {options[0][0]}")
-                    io_byte = io.BytesIO()
-                    im = self.save_glyph_image(f"{str(char_ident)}.png", chr(char))
-                    im.save(io_byte, "PNG")
-                    unknown_glyphs[order_num] = (chr(char), io_byte)
+                    print(f"Closest was {self._dec_info[closest_ident]!r} with a score of {score}")
+                    unknown_glyphs[order_num] = (chr(char), self.get_glyph_png(chr(char)) if render_unknown else None)
                     # im.save(f"{str(char_ident)}.png")
                     # raise ValueError(f"Unknown character {str(char_ident)!r} at index {order_map[glyph_name]}")
 
@@ -146,11 +169,30 @@ class DecoderBase(ABC):
     def _compare_idents(self, a, b):
         return a - b
 
+    @classmethod
+    def _ident_vector(cls, ident):
+        """The ident as a flat sequence of numbers, the L1 distance between two of them must match _compare_idents"""
+        return ident.as_vector()
+
+    @classmethod
+    def _ident_from_vector(cls, vector):
+        return DistComparable(tuple(vector))
+
+    @classmethod
+    def dump_glyphs(cls, dec_info: dict) -> list:
+        """The dictionary as a json friendly list of [vector, true_char]"""
+        return [[[int(x) for x in cls._ident_vector(ident)], true_char] for ident, true_char in dec_info.items()]
+
+    @classmethod
+    def load_glyphs(cls, glyphs: list) -> dict:
+        return {cls._ident_from_vector(vector): true_char for vector, true_char in glyphs}
+
     def serialise(self) -> str:
-        return json.dumps(self._dec_info)
+        return json.dumps(self.dump_glyphs(self._dec_info))
 
     def deserialise(self, state: str):
-        self._dec_info = json.loads(state)
+        self._dec_info = self.load_glyphs(json.loads(state))
+        self._index = None
 
 
 class HashBasedDecoder(DecoderBase):
@@ -159,9 +201,20 @@ class HashBasedDecoder(DecoderBase):
     def _get_glyph_key(self, image: Image, character: str, size: int):
         return imagehash.average_hash(image)
 
+    @classmethod
+    def _ident_vector(cls, ident):
+        # the hamming distance of two hashes is the L1 distance of their flattened bits
+        return ident.hash.flatten()
+
+    @classmethod
+    def _ident_from_vector(cls, vector):
+        hash_size = int(len(vector) ** 0.5)
+        return imagehash.ImageHash(np.array(vector, dtype=bool).reshape(hash_size, hash_size))
+
 
 class MetricsBasedDecoder(DecoderBase):
     SCORE_CUTOFF = 10
+    USES_GLYPH_IMAGE = False
 
     def _get_glyph_key(self, image: Image, character: str, size: int):
         glyph_name = self.cmap[ord(character)]
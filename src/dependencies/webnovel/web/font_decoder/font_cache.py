@@ -0,0 +1,115 @@
+import hashlib
+import io
+import json
+import typing
+from collections import OrderedDict
+
+from fontTools import ttLib
+
+# (translation table for str.translate, glyph order number: true char)
+FontDecode = typing.Tuple[typing.Dict[int, str], typing.Dict[int, str]]
+
+
+def font_bytes_hash(font_bytes: bytes) -> str:
+    return hashlib.sha1(font_bytes).hexdigest()
+
+
+def font_metrics_hash(font_bytes: bytes) -> typing.Optional[str]:
+    """Fingerprint of the code points, glyph order and glyph metrics of the font, fonts that differ in bytes but draw
+    the same glyphs on the same code points share it. The order map of a decode is keyed by the glyph order, so it is
+    part of the fingerprint. None if the font has no glyf table"""
+    tt = ttLib.TTFont(io.BytesIO(font_bytes))
+    if "glyf" not in tt:
+        return None
+    glyf_table = tt["glyf"]
+    metrics = tt["hmtx"].metrics
+    cmap = tt["cmap"].tables[0].cmap
+    glyph_order = {glyph_name: order for order, glyph_name in enumerate(tt.getGlyphOrder())}
+    hasher = hashlib.sha1()
+    for code_point, glyph_name in sorted(cmap.items()):
+        glyph = glyf_table[glyph_name]
+        values = (code_point, glyph_order[glyph_name], getattr(glyph, "xMin", 0), getattr(glyph, "xMax", 0),
+                  getattr(glyph, "yMin", 0), getattr(glyph, "yMax", 0), *metrics[glyph_name])
+        hasher.update(repr(values).encode())
+    return hasher.hexdigest()
+
+
+class FontDecodeCache:
+    """Content addressed cache of the font decodes, an in memory lru in front of the FONT_DECODES table. A hit turns
+    decoding a chapter into a single str.translate"""
+
+    def __init__(self, database=None, max_size: int = 500):
+        """
+            :arg database a Database, if None the cache only lives in memory
+        """
+        self._database = database
+        self.max_size = max_size
+        self._decodes: typing.OrderedDict[str, FontDecode] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._decodes)
+
+    def _remember(self, key: str, decode: FontDecode):
+        self._decodes[key] = decode
+        self._decodes.move_to_end(key)
+        while len(self._decodes) > self.max_size:
+            self._decodes.popitem(last=False)
+
+    def _from_memory(self, key: str) -> typing.Optional[FontDecode]:
+        decode = self._decodes.get(key)
+        if decode is not None:
+            self._decodes.move_to_end(key)
+        return decode
+
+    @staticmethod
+    def _encode(decode: FontDecode) -> typing.Tuple[str, str]:
+        return json.dumps(decode[0]), json.dumps(decode[1])
+
+    @staticmethod
+    def _decode(trans_map: str, order_map: str) -> FontDecode:
+        return ({int(key): value for key, value in json.loads(trans_map).items()},
+                {int(key): value for key, value in json.loads(order_map).items()})
+
+    async def retrieve(self, font_bytes: bytes) -> typing.Optional[FontDecode]:
+        """Looks the font up by the hash of its bytes and then by its metrics fingerprint
+            :returns (translation table, order map) or None if the font was never decoded"""
+        return await self.retrieve_hashed(font_bytes_hash(font_bytes), lambda: font_metrics_hash(font_bytes))
+
+    async def retrieve_hashed(self, font_hash: str, metrics_hash: typing.Union[str, None, typing.Callable[[], str]]) \
+            -> typing.Optional[FontDecode]:
+        """Same as retrieve for a font whose hashes are already known, so that a font looked up again and again isn't
+        parsed every time
+            :arg metrics_hash the metrics fingerprint or a callable returning it, only called if it is needed"""
+        decode = self._from_memory(font_hash)
+        if decode is None:
+            if callable(metrics_hash):
+                metrics_hash = metrics_hash()
+            if metrics_hash is not None:
+                decode = self._from_memory(metrics_hash)
+            if decode is None and self._database is not None:
+                record = await self._database.retrieve_font_decode(font_hash, metrics_hash)
+                if record is not None:
+                    decode = self._decode(*record)
+            if decode is not None:
+                self._remember(font_hash, decode)
+                if metrics_hash is not None:
+                    self._remember(metrics_hash, decode)
+        if decode is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # copies so that callers can add learned letters without touching the cached decode
+        return dict(decode[0]), dict(decode[1])
+
+    async def store(self, font_bytes: bytes, trans_map: typing.Dict[int, str], order_map: typing.Dict[int, str]):
+        """Stores a complete decode of the font, decodes with unknown glyphs shouldn't be stored"""
+        decode = (dict(trans_map), dict(order_map))
+        font_hash = font_bytes_hash(font_bytes)
+        metrics_hash = font_metrics_hash(font_bytes)
+        self._remember(font_hash, decode)
+        if metrics_hash is not None:
+            self._remember(metrics_hash, decode)
+        if self._database is not None:
+            await self._database.insert_font_decode(font_hash, metrics_hash or font_hash, *self._encode(decode))
@@ -0,0 +1,142 @@
+import hashlib
+import io
+import json
+import os
+import typing
+
+try:
+    import fcntl
+except ImportError:
+    # not on windows, the saves of the processes are still merged but not serialised there
+    fcntl = None
+
+from .decoder import DecoderBase, MetricsBasedDecoder
+from .utils import GlyphIndex
+
+DEFAULT_DICTIONARY_PATH = "glyph_dictionary.json"
+
+
+class GlyphDictionary:
+    """Long lived glyph ident -> true char dictionary shared by every chapter decoder. Each known font is only parsed
+    once, when it is added, instead of once per decoded chapter"""
+
+    def __init__(self, decoder_class: typing.Type[DecoderBase] = MetricsBasedDecoder,
+                 path: str = DEFAULT_DICTIONARY_PATH):
+        self.decoder_class = decoder_class
+        self.path = path
+        # ident: true_char
+        self._dec_info = {}
+        self._font_hashes = set()
+        self._index = None
+        # bumped on every change so that the copies of the dictionary know when they are stale
+        self.version = 0
+
+    def __len__(self):
+        return len(self._dec_info)
+
+    @staticmethod
+    def font_hash(font_bytes: bytes) -> str:
+        return hashlib.sha1(font_bytes).hexdigest()
+
+    def has_font(self, font_bytes: bytes) -> bool:
+        return self.font_hash(font_bytes) in self._font_hashes
+
+    def add_font(self, font_bytes: bytes, char_map: typing.Union[str, typing.List[str]]) -> bool:
+        """Will add the glyphs of the font to the dictionary, a font that was already added is skipped
+            :returns True if the font was new"""
+        font_hash = self.font_hash(font_bytes)
+        if font_hash in self._font_hashes:
+            return False
+        if type(char_map) is str:
+            char_map = list(char_map)
+
+        sample = self.decoder_class(io.BytesIO(font_bytes))
+        for ident, true_char in sample.sample_glyphs(char_map):
+            existing = self._dec_info.get(ident, None)
+            if existing is not None and existing != true_char:
+                print(f"Glyph ident collision! have {ident!r}={existing!r}, ignoring {true_char!r}")
+                continue
+            self._dec_info[ident] = true_char
+        self._font_hashes.add(font_hash)
+        self._index = None
+        self.version += 1
+        return True
+
+    def add_fonts(self, fonts: typing.Iterable[typing.Tuple[str, bytes]]) -> int:
+        """Adds the (letters, font bytes) pairs as returned by Database.retrieve_top_50_fonts
+            :returns the amount of fonts that were new"""
+        return sum(self.add_font(font_bytes, letters) for letters, font_bytes in fonts)
+
+    def _get_index(self) -> GlyphIndex:
+        if self._index is None:
+            idents = list(self._dec_info)
+            self._index = GlyphIndex([self.decoder_class._ident_vector(ident) for ident in idents], idents)
+        return self._index
+
+    def create_decoder(self, font: io.BytesIO) -> DecoderBase:
+        """A decoder for the given font that matches its glyphs against this dictionary. Samples must be added to the
+        dictionary, not to the returned decoder"""
+        decoder = self.decoder_class(font)
+        decoder.use_glyphs(self._dec_info, self._get_index())
+        return decoder
+
+    def serialise(self) -> str:
+        return json.dumps({"fonts": sorted(self._font_hashes),
+                           "glyphs": self.decoder_class.dump_glyphs(self._dec_info)})
+
+    def deserialise(self, state: str):
+        data = json.loads(state)
+        self._font_hashes = set(data["fonts"])
+        self._dec_info = self.decoder_class.load_glyphs(data["glyphs"])
+        self._index = None
+        self.version += 1
+
+    def merge(self, state: str) -> int:
+        """Adds the fonts and glyphs of a serialised dictionary that this one doesn't have, on a glyph collision the
+        glyph already known wins
+            :returns the amount of fonts that were new"""
+        data = json.loads(state)
+        new_fonts = set(data["fonts"]) - self._font_hashes
+        if len(new_fonts) == 0:
+            return 0
+        for ident, true_char in self.decoder_class.load_glyphs(data["glyphs"]).items():
+            self._dec_info.setdefault(ident, true_char)
+        self._font_hashes.update(new_fonts)
+        self._index = None
+        self.version += 1
+        return len(new_fonts)
+
+    def save(self):
+        """Saves the dictionary merged with the one on disk. The bot and the background process learn fonts on their
+        own and save to the same file, so the saves are serialised with a lock file and each process writes through its
+        own temp file"""
+        with open(f"{self.path}.lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.path):
+                    try:
+                        with open(self.path, "r") as file:
+                            self.merge(file.read())
+                    except (ValueError, KeyError) as e:
+                        print(f"Glyph dictionary at {self.path} couldn't be merged, it will be overwritten: {e}")
+                temp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(temp_path, "w") as file:
+                    file.write(self.serialise())
+                os.replace(temp_path, self.path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self) -> bool:
+        """Loads the dictionary saved on disk, if there is one
+            :returns True if it was loaded"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r") as file:
+                self.deserialise(file.read())
+        except (ValueError, KeyError) as e:
+            print(f"Glyph dictionary at {self.path} couldn't be loaded, it will be rebuilt: {e}")
+            return False
+        return True
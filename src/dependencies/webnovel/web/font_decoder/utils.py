@@ -1,17 +1,53 @@
+import html
 import io
 import json
 import os
 import re
 import tempfile
+import typing
 from collections import defaultdict
-from io import BytesIO
 
 import bs4
+import numpy as np
 from bs4 import BeautifulSoup
 
 PAT_CSS_ORDER_RULE = re.compile(r"(\w+){order:(\d+);}")
 PAT_CSS_ATTR_RULE = re.compile(r"(\._p\w+) (\w+)::(before|after){content:attr\((\w+)\)}")
 
+# a paragraph holding only text and flat word tags, anything else goes through BeautifulSoup. The attributes skip over
+# quoted values so that a ">" inside one doesn't end the tag early
+_HTML_ATTRS = r"""((?:[^<>"']|"[^"]*"|'[^']*')*)"""
+PAT_HTML_PARAGRAPH = re.compile(rf"<(\w+){_HTML_ATTRS}>(.*)</\1\s*>([^<]*)", re.S | re.I)
+PAT_HTML_NODE = re.compile(rf"<(\w+){_HTML_ATTRS}>([^<]*)</\1\s*>|([^<]+)|(<)", re.I)
+PAT_HTML_ATTR = re.compile(r"""([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+
+# BeautifulSoup collapses a text node made only of these characters to a single one
+_BS4_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+
+def _parse_html_attrs(attrs_str: str) -> typing.Optional[dict]:
+    """The attributes of a tag, None for the ones the fast path doesn't reproduce the BeautifulSoup way, a repeated
+    attribute or a value holding a tag bracket"""
+    if "<" in attrs_str or ">" in attrs_str:
+        return None
+    attrs = {}
+    for match in PAT_HTML_ATTR.finditer(attrs_str.rstrip("/")):
+        name = match.group(1).lower()
+        if name in attrs:
+            return None
+        value = next((group for group in match.group(2, 3, 4) if group is not None), "")
+        attrs[name] = html.unescape(value)
+    return attrs
+
+
+def _is_blank_text(text: str) -> bool:
+    return text != "" and text.strip(_BS4_ASCII_SPACES) == ""
+
+
+def _escape_text(text: str) -> str:
+    # same substitutions as the "minimal" formatter BeautifulSoup serialises text with
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
 
 class DistComparable:
     def __init__(self, items):
@@ -32,6 +68,33 @@ class DistComparable:
     def __str__(self):
         return str(hash(self._items))
 
+    def as_vector(self):
+        return self._items
+
+
+class GlyphIndex:
+    """Nearest neighbour lookup over the known glyph idents. The idents are stacked once in a matrix so that a query
+    is a single vectorized L1 distance against all of them instead of a python level comparison per ident"""
+
+    def __init__(self, vectors: list, values: list):
+        self._values = values
+        if len(vectors) == 0:
+            self._matrix = np.zeros((0, 0), dtype=np.int64)
+        else:
+            self._matrix = np.asarray(vectors, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._values)
+
+    def query(self, vector) -> tuple:
+        """Returns (distance, value) of the closest ident, the first one added wins ties
+            :raises ValueError if the index is empty"""
+        if len(self._values) == 0:
+            raise ValueError("Can't query an empty index")
+        distances = np.abs(self._matrix - np.asarray(vector, dtype=np.int64)).sum(axis=1)
+        position = int(distances.argmin())
+        return int(distances[position]), self._values[position]
+
 
 class ContentInfo:
     def __init__(self):
@@ -46,12 +109,21 @@ class ContentInfo:
         self._bytes = None
 
     def get_font(self):
-        # return copy.deepcopy(self._font)
-        # return self._bytes
-        data = io.BytesIO()
-        data.write(self._bytes)
-        data.seek(0)
-        return data
+        # BytesIO shares the immutable bytes until something writes to it, so no copy is made here
+        return io.BytesIO(self._bytes)
+
+    @property
+    def font_bytes(self) -> bytes:
+        return self._bytes
+
+    @property
+    def font_view(self) -> memoryview:
+        """Read only view of the font bytes"""
+        return memoryview(self._bytes)
+
+    def _load_font(self, font_values: list):
+        self._bytes = bytes(font_values)
+        self._font = io.BytesIO(self._bytes)
 
     @classmethod
     def from_api_data(cls, filename: str):
@@ -83,14 +155,7 @@ class ContentInfo:
         inst.content = content["contents"]
         inst.css = content["css"]
 
-        font = BytesIO()
-        for x in content["font"]:
-            font.write(x.to_bytes(1, "big"))
-
-        bytes_ = font.getbuffer().tobytes()
-        inst._bytes = bytes_
-        font = BytesIO(bytes_)
-        inst._font = BytesIO(bytes_)
+        inst._load_font(content["font"])
 
         # with open(inst.path_font, "wb") as f:
         #     f.write(font.getbuffer())
@@ -114,14 +179,7 @@ class ContentInfo:
         inst.content = content["contents"]
         inst.css = content["css"]
 
-        font = BytesIO()
-        for x in content["font"]:
-            font.write(x.to_bytes(1, "big"))
-
-        bytes_ = font.getbuffer().tobytes()
-        inst._bytes = bytes_
-        font = BytesIO(bytes_)
-        inst._font = BytesIO(bytes_)
+        inst._load_font(content["font"])
 
         # with open(inst.path_font, "wb") as f:
         #     f.write(font.getbuffer())
@@ -145,42 +203,103 @@ class ContentInfo:
 
         return order_map, attr_map
 
-    def unscramble(self):
-        order_map, attr_map = self._parse_css()
-
-        doc = []
-
-        for par_obj in self.content:
-            soup = BeautifulSoup(par_obj["content"], "html.parser")
-
-            try:
-                assert len(soup.contents) == 1 or type(soup.contents[1]) is bs4.element.NavigableString
-            except AssertionError:
-                raise AssertionError
-
-            paragraph = soup.contents[0]
-            paragraph = soup.contents[0]
-            if paragraph.name == "annotations":
-                # hope that it isn't word scrambled
-                doc.append(str(paragraph))
+    @staticmethod
+    def _unscramble_paragraph_fast(content: str, order_map: dict, attr_map: dict):
+        """Same output as _unscramble_paragraph for paragraphs made of text and flat word tags, without building a tree.
+        Returns None for anything else so that the caller falls back to BeautifulSoup"""
+        paragraph_match = PAT_HTML_PARAGRAPH.fullmatch(content)
+        if paragraph_match is None:
+            return None
+        paragraph_name = paragraph_match.group(1).lower()
+        if paragraph_name == "annotations":
+            return None
+        p_attrs = _parse_html_attrs(paragraph_match.group(2))
+        if p_attrs is None:
+            return None
+        p_classes = p_attrs.get("class", "").split()
+        if len(p_classes) == 0:
+            return None
+        word_attrs = attr_map[p_classes[0]] if p_classes[0] in attr_map else {}
+
+        words = []
+        for node_match in PAT_HTML_NODE.finditer(paragraph_match.group(3)):
+            if node_match.group(5) is not None:
+                return None
+            if node_match.group(4) is not None:
+                text = html.unescape(node_match.group(4))
+                if _is_blank_text(text):
+                    return None
+                words.append((0, _escape_text(text)))
                 continue
-            p_tag = paragraph.attrs["class"][0]
+            name = node_match.group(1).lower()
+            if name not in order_map:
+                return None
+            attrs = _parse_html_attrs(node_match.group(2))
+            if attrs is None:
+                return None
+            pseudo_contents = word_attrs.get(name, {})
+            parts = []
+            for position in ("before", "after"):
+                attr_name = pseudo_contents.get(position, None)
+                if attr_name is not None and attr_name not in attrs:
+                    return None
+                parts.append("" if attr_name is None else _escape_text(attrs[attr_name]))
+            text = html.unescape(node_match.group(3))
+            if _is_blank_text(text):
+                return None
+            text = _escape_text(text)
+            words.append((order_map[name], f"{parts[0]}{text}{parts[1]}"))
+
+        words.sort(key=lambda word: word[0])
+        return f"<{paragraph_name}>{''.join(word[1] for word in words)}</{paragraph_name}>"
+
+    @staticmethod
+    def _unscramble_paragraph(content: str, order_map: dict, attr_map: dict) -> str:
+        soup = BeautifulSoup(content, "html.parser")
+
+        try:
+            assert len(soup.contents) == 1 or type(soup.contents[1]) is bs4.element.NavigableString
+        except AssertionError:
+            raise AssertionError
+
+        paragraph = soup.contents[0]
+        if paragraph.name == "annotations":
+            # hope that it isn't word scrambled
+            return str(paragraph)
+        p_tag = paragraph.attrs["class"][0]
+
+        words = [x.extract() for x in paragraph.contents.copy()]
+        words = sorted(words, key=lambda x: order_map.get(x.name, 0))
+
+        for word in words:
+            if (before := attr_map[p_tag][word.name].get("before", None)) is not None:
+                paragraph.insert(len(paragraph.contents), word.attrs[before])
+
+            paragraph.insert(len(paragraph.contents), word)
+            if hasattr(word, "contents") and word.name in order_map:
+                word.replace_with_children()
+
+            if (after := attr_map[p_tag][word.name].get("after", None)) is not None:
+                paragraph.insert(len(paragraph.contents), word.attrs[after])
+
+        paragraph.attrs.clear()
+        return str(paragraph)
 
-            words = [x.extract() for x in paragraph.contents.copy()]
-            words = sorted(words, key=lambda x: order_map.get(x.name, 0))
-
-            for word in words:
-                if (before := attr_map[p_tag][word.name].get("before", None)) is not None:
-                    paragraph.insert(len(paragraph.contents), word.attrs[before])
+    def unscramble(self):
+        order_map, attr_map = self._parse_css()
 
-                paragraph.insert(len(paragraph.contents), word)
-                if hasattr(word, "contents") and word.name in order_map:
-                    word.replace_with_children()
+        return "\n\n".join(self._unscramble_paragraph(par_obj["content"], order_map, attr_map)
+                             for par_obj in self.content)
 
-                if (after := attr_map[p_tag][word.name].get("after", None)) is not None:
-                    paragraph.insert(len(paragraph.contents), word.attrs[after])
+    def unscramble_fast(self):
+        """Same result as unscramble, only the paragraphs the fast path can't handle are parsed with BeautifulSoup"""
+        order_map, attr_map = self._parse_css()
 
-            paragraph.attrs.clear()
-            doc.append(str(paragraph))
+        doc = []
+        for par_obj in self.content:
+            paragraph = self._unscramble_paragraph_fast(par_obj["content"], order_map, attr_map)
+            if paragraph is None:
+                paragraph = self._unscramble_paragraph(par_obj["content"], order_map, attr_map)
+            doc.append(paragraph)
 
         return "\n\n".join(doc)
@@ -20,11 +20,17 @@ default_connector_settings = {'force_close': True, 'enable_cleanup_closed': True
 
 # TODO deal with the connector to be able to self close or something... Needs further thinking
 
-def __request_data_generator(session: aiohttp.ClientSession, account: classes.QiAccount) -> (bool, dict):   #deprecated as of python 3.10, needs to be bool | dict
-    """Returns the initial return values indicates if a session should be used the other is the payload data"""
+#deprecated as of python 3.10, needs to be bool | dict
+def __request_data_generator(session: aiohttp.ClientSession, account: classes.QiAccount,
+                             csrf_token: str = None) -> (bool, dict):
+    """Returns the initial return values indicates if a session should be used the other is the payload data
+        :arg csrf_token the csrf token of the session, when given the cookie jar of the session isn't scanned for it"""
     if session is None and account is None:
         raise ValueError("No valid value was passed to either session or account")
     # TODO: Ask bum why only csrf token is being sent.
+    if session and csrf_token is not None:
+        assert isinstance(session, aiohttp.ClientSession)
+        return True, {'_csrfToken': csrf_token}
     if session:
         assert isinstance(session, aiohttp.ClientSession)
         csrf_token = ''
@@ -61,7 +67,7 @@ def __parse_library_page(library_page_list: typing.List[dict]) -> typing.List[ty
 
 
 async def retrieve_library_page(page_index: int = 1, session: aiohttp.ClientSession = None,
-                                account: classes.QiAccount = None, proxy: Proxy = None) -> (
+                                account: classes.QiAccount = None, proxy: Proxy = None, csrf_token: str = None) -> (
         typing.List[typing.Union[classes.SimpleBook, classes.SimpleComic]], int):
     """Retrieves a page from the library
         :arg page_index is the page number that will be requested from the library
@@ -70,6 +76,7 @@ async def retrieve_library_page(page_index: int = 1, session: aiohttp.ClientSess
         :arg account receives an account object, will be ignored if a session object is given; if a session object is
             not given it will use the account object to generate a request
         :arg proxy accepts an aiohhtp proxy connector object, will be ignored if session is given
+        :arg csrf_token the csrf token of the session, when given the cookie jar of the session isn't scanned for it
         :returns a tuple containing a list which containing a dict for every book present in the library page and a
             bool representing if this is the last page on the library
     """
@@ -78,7 +85,7 @@ async def retrieve_library_page(page_index: int = 1, session: aiohttp.ClientSess
     # aiohttp.TCPConnector(force_close=True)
     # api_url = '/'.join([main_api_url, 'LibraryAjax'])
     api_url = '/'.join([new_api_url, 'library'])
-    use_session, payload_data = __request_data_generator(session, account)
+    use_session, payload_data = __request_data_generator(session, account, csrf_token)
     payload_data['pageIndex'] = page_index
     payload_data['orderBy'] = 2
     while True:
@@ -125,9 +132,10 @@ async def retrieve_library_page(page_index: int = 1, session: aiohttp.ClientSess
 
 
 async def retrieve_all_library_pages(session: aiohttp.ClientSession = None, account: classes.QiAccount = None,
-                                     proxy: Proxy = None) -> \
+                                     proxy: Proxy = None, csrf_token: str = None) -> \
         typing.Tuple[typing.List[typing.Union[classes.SimpleBook, classes.SimpleComic]], int]:
-    """Will retrieve all library library_items associated with the account"""
+    """Will retrieve all library library_items associated with the account
+        :arg csrf_token the csrf token of the session, when given the cookie jar of the session isn't scanned for it"""
     if account is None and session is None:
         raise ValueError("No valid data was given")
 
@@ -139,6 +147,8 @@ async def retrieve_all_library_pages(session: aiohttp.ClientSession = None, acco
     else:
         library_pages = 1
 
+    # a session given by the caller is kept open for it
+    close_session = session is None
     if session is None:
         assert account is not None
         if proxy:
@@ -149,7 +159,8 @@ async def retrieve_all_library_pages(session: aiohttp.ClientSession = None, acco
 
     tasks = []
     for page in range(1, library_pages + 1):
-        tasks.append(retrieve_library_page(page, session=session))
+        tasks.append(retrieve_library_page(page, session=session, account=account,
+                                           csrf_token=csrf_token))
 
     all_pages = False
     library_pages_items = []
@@ -172,14 +183,16 @@ async def retrieve_all_library_pages(session: aiohttp.ClientSession = None, acco
             library_pages_items.extend(item_list)
 
     if raise_error:
-        await session.close()
+        if close_session:
+            await session.close()
         raise ErrorList(*errors)
 
     if all_pages is False:
         try:
             while True:
                 library_pages += 1
-                library_items, is_last_page = await retrieve_library_page(library_pages, session=session)
+                library_items, is_last_page = await retrieve_library_page(library_pages, session=session,
+                                                                          account=account, csrf_token=csrf_token)
                 library_pages_items.extend(library_items)
                 if is_last_page == 0:
                     pass
@@ -195,16 +208,18 @@ async def retrieve_all_library_pages(session: aiohttp.ClientSession = None, acco
         except Exception as e:
             raise e
         finally:
-            await session.close()
+            if close_session:
+                await session.close()
 
-    await session.close()
+    if close_session:
+        await session.close()
 
     return library_pages_items, library_pages
 
 
 async def add_item_to_library(item: typing.Union[classes.SimpleBook, classes.SimpleComic],
                               session: aiohttp.ClientSession = None, account: classes.QiAccount = None,
-                              proxy: Proxy = None) -> bool:
+                              proxy: Proxy = None, csrf_token: str = None) -> bool:
     """Add an item to the library
         :arg item receives either a book or a comic object to be added to the library
         :arg session receives an aiohttp session object that includes the cookies of the account, if empty will use the
@@ -212,6 +227,7 @@ async def add_item_to_library(item: typing.Union[classes.SimpleBook, classes.Sim
         :arg account receives an account object to generate a request with it, will be ignored if a session object is
         given
         :arg proxy accepts an aiohhtp proxy connector object, will be ignored if session is given
+        :arg csrf_token the csrf token of the session, when given the cookie jar of the session isn't scanned for it
 
         :returns a bool value representing if the request was completed successfully
     """
@@ -219,7 +235,7 @@ async def add_item_to_library(item: typing.Union[classes.SimpleBook, classes.Sim
     assert issubclass(type(item), (classes.SimpleBook, classes.SimpleComic)) or isinstance(item, (classes.SimpleBook,
                                                                                                   classes.SimpleComic))
 
-    use_session, payload_data = __request_data_generator(session, account)
+    use_session, payload_data = __request_data_generator(session, account, csrf_token)
     payload_data['bookIds'] = item.id
     payload_data['novelType'] = item.NovelType
     # add_data = {'_csrfToken': csrf, 'bookIds': item_id, 'novelType': type_}
@@ -255,7 +271,7 @@ async def add_item_to_library(item: typing.Union[classes.SimpleBook, classes.Sim
 
 async def remove_item_from_library(item: typing.Union[classes.SimpleBook, classes.SimpleComic],
                                    session: aiohttp.ClientSession = None, account: classes.QiAccount = None,
-                                   proxy: Proxy = None) -> bool:
+                                   proxy: Proxy = None, csrf_token: str = None) -> bool:
     """Removes an item from the library
         :arg item receives either a book or a comic object to be added to the library
         :arg session receives an aiohttp session object that includes the cookies of the account, if empty will use the
@@ -263,12 +279,13 @@ async def remove_item_from_library(item: typing.Union[classes.SimpleBook, classe
         :arg account receives an account object to generate a request with it, will be ignored if a session object is
             given
         :arg proxy accepts a Proxy object, will be ignored if session is given
+        :arg csrf_token the csrf token of the session, when given the cookie jar of the session isn't scanned for it
 
         :returns a bool value representing if the request was completed successfully
     """
     supported_types = (classes.SimpleBook, classes.SimpleComic)
     assert issubclass(type(item), supported_types) or isinstance(item, supported_types)
-    use_session, payload_data = __request_data_generator(session, account)
+    use_session, payload_data = __request_data_generator(session, account, csrf_token)
     full_data = {**payload_data, 'bookItems': '[{"bookId":"%s","novelType":%s}]' % (item.id, item.NovelType)}
     api_url = '/'.join((new_api_url, 'deleteLibraryItemsAjax'))
     string = "&".join([f'{key}={value}' for key, value in full_data.items()])
@@ -311,9 +328,9 @@ async def remove_item_from_library(item: typing.Union[classes.SimpleBook, classe
 async def batch_remove_books_from_library(*items: typing.Union[classes.SimpleBook,
                                                                classes.SimpleComic],
                                           session: aiohttp.ClientSession = None, account: classes.QiAccount = None,
-                                          proxy: Proxy = None) -> bool:
+                                          proxy: Proxy = None, csrf_token: str = None) -> bool:
     supported_types = (classes.SimpleBook, classes.SimpleComic)
-    use_session, payload_data = __request_data_generator(session, account)
+    use_session, payload_data = __request_data_generator(session, account, csrf_token)
     items_dict_string = []
     for item in items:
         try:
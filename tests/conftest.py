@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the code is imported the same way the launcher does it, from the src directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("bs4")
+pytest.importorskip("numpy")
+
+from dependencies.webnovel.web.font_decoder.utils import ContentInfo  # noqa: E402
+
+CSS = "WN_CHAPTER i{order:1;}WN_CHAPTER b{order:2;}WN_CHAPTER u{order:3;}" \
+      "WN_CHAPTER ._p1 b::before{content:attr(dx)}WN_CHAPTER ._p1 u::after{content:attr(dy)}"
+
+PARAGRAPHS = [
+    # handled by the fast path
+    '<p class="_p1"><b dx="Hello ">x</b><i>world</i><u dy="!">y</u></p>',
+    '<p class="_p1">lead <b dx="&amp;">a &lt; b</b><i>c&gt;d</i></p>',
+    "<p class='_p1 other'><u dy=' end'>z</u><i>start</i></p>\n",
+    # whitespace only text nodes are collapsed by BeautifulSoup
+    '<p class="_p1"><b dx="">a</b>   <i>b</i></p>',
+    '<p class="_p1"><b dx="">a</b>\n\t<i>b</i></p>',
+    '<p class="_p1"><i>  </i><b dx="">a</b></p>',
+    '<p class="_p1"><b dx="">a</b>&#32;<i>b</i></p>',
+    # BeautifulSoup keeps the last value of a repeated attribute
+    '<p class="_p1"><b dx="one" dx="two">a</b></p>',
+    '<p class="_p2" class="_p1"><b dx="one">a</b></p>',
+    # a tag bracket inside a quoted value
+    '<p class="_p1"><b dx="a>b">c</b><i>d</i></p>',
+    '<p class="_p1" title="x>y"><b dx="">c</b><i>d</i></p>',
+    '<p class="_p1"><u dy=\'<\'>c</u></p>',
+]
+
+
+def content_info(*paragraphs: str) -> ContentInfo:
+    inst = ContentInfo()
+    inst.css = CSS
+    inst.content = [{"content": paragraph} for paragraph in paragraphs]
+    return inst
+
+
+@pytest.mark.parametrize("paragraph", PARAGRAPHS)
+def test_fast_paragraph_matches_beautifulsoup(paragraph):
+    order_map, attr_map = content_info()._parse_css()
+    fast = ContentInfo._unscramble_paragraph_fast(paragraph, order_map, attr_map)
+    if fast is not None:
+        assert fast == ContentInfo._unscramble_paragraph(paragraph, order_map, attr_map)
+
+
+def test_fast_path_is_used_for_plain_paragraphs():
+    order_map, attr_map = content_info()._parse_css()
+    assert ContentInfo._unscramble_paragraph_fast(PARAGRAPHS[0], order_map, attr_map) == \
+        "<p>worldHello xy!</p>"
+
+
+def test_unscramble_fast_matches_unscramble():
+    inst = content_info(*PARAGRAPHS)
+    assert inst.unscramble_fast() == inst.unscramble()